@@ -1,3 +1,5 @@
-from project import app
+# Offload worker processes import this module as __mp_main__; they do not need the app
+if __name__ != '__mp_main__':
+  from project import app
 if __name__ == '__main__':
   app.run(debug=True, host='0.0.0.0')
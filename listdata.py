@@ -0,0 +1,96 @@
+# RAVENPOINT LIST DATA
+# Shaping of list query results: multi-lookups are fetched with secondary queries and nested
+# into the rows. This module is kept outside the project package, which sets up the app when
+# imported, so that offload worker processes (project/offload.py) can import it on its own
+import json
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+# Parent Ids per secondary query for expanded multi-lookups
+expand_batch_size = 500
+
+# Function to handle Id and Title in lookup values; expanded lists and records are kept
+def clean_lookup_value(value):
+  if isinstance(value, (list, dict)):
+    return value
+  if value is None or pd.isnull(value):
+    return ''
+  if isinstance(value, (float, int, np.number)):
+    return int(value)
+  if isinstance(value, str):
+    return str(value)
+
+# Function to nest lookup columns in a record, e.g. `a__b__Title` -> {'a': {'b': {'Title': ...}}}
+def nest_record(record):
+  output = {key: value for key, value in record.items() if '__' not in key}
+  for key, value in record.items():
+    if '__' not in key:
+      continue
+    *path, col = key.split('__')
+    target = output
+    for segment in path:
+      if not isinstance(target.get(segment), dict):
+        target[segment] = {}
+      target = target[segment]
+    target[col] = clean_lookup_value(value)
+  return output
+
+# Function to run the secondary queries of a list query for the fetched rows
+# Queries run parents first, for the distinct Ids their parent rows refer to, in batches of
+# `expand_batch_size`; results are then grouped by parent Id in a hash map and nested children
+# first, so the cost is linear in the size of the result. Returns the expansions to pass to
+# process_list_data
+def fetch_expansions(conn, query, data):
+  results = {}
+  for secondary in query['secondary']:
+    source = data if secondary['parent_owner'] is None else results[secondary['parent_owner']]
+    ids = [str(i) for i in source[secondary['key']].dropna().astype(int).unique()] if secondary['key'] in source else []
+    batches = [ids[start:start + expand_batch_size] for start in range(0, len(ids), expand_batch_size)] or [[]]
+    results[secondary['path']] = pd.concat([pd.read_sql(secondary['sql'].replace('{ids}', ', '.join(batch)), con=conn) \
+      for batch in batches], ignore_index=True)
+
+  expansions = {}
+  for secondary in reversed(query['secondary']):
+    children = [expansions.pop(other['path']) for other in query['secondary'] \
+      if other['parent_owner'] == secondary['path'] and other['path'] in expansions]
+    values = {}
+    for record in process_list_data(results[secondary['path']], children).to_dict('records'):
+      parent = record.pop('_parent')
+      values.setdefault(int(parent), []).append({key: clean_lookup_value(value) for key, value in record.items()})
+    expansions[secondary['path']] = {'key': secondary['key'], 'out_col': secondary['out_col'], 'values': values}
+  return list(expansions.values())
+
+# Function to nest lookup columns in list query results
+def process_list_data(data, expansions=()):
+  # Attach lookups fetched by secondary queries, by the hidden key of their parent
+  for expansion in expansions:
+    data[expansion['out_col']] = [[] if pd.isnull(key) else expansion['values'].get(int(key), []) \
+      for key in data[expansion['key']]]
+  data = data.drop([expansion['key'] for expansion in expansions], axis=1)
+
+  # Process single lookup columns
+  if not any(['__' in col for col in data.columns]):
+    return data
+  return pd.DataFrame([nest_record(record) for record in data.to_dict('records')])
+
+# Function to run a list query and shape the response in a worker process
+# The rows (and the count, if `count_query` is given) fill in `value` (and `__count`) of the
+# output; returns the response as JSON bytes
+def render_list_items(path, query, sql_query, count_query, output):
+  conn = sqlite3.connect(path)
+  try:
+    conn.execute('BEGIN')
+    data = pd.read_sql(sql_query, con=conn)
+    expansions = fetch_expansions(conn, query, data)
+    if count_query is not None:
+      count = conn.execute(count_query).fetchone()[0]
+  finally:
+    conn.rollback()
+    conn.close()
+  data = process_list_data(data, expansions)
+  output['value'] = data.replace({np.nan: None}).to_dict('records')
+  if count_query is not None:
+    output['__count'] = count
+  return json.dumps(output).encode()
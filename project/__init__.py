@@ -1,3 +1,4 @@
+import atexit
 import logging
 import os
 
@@ -6,6 +7,7 @@ from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_restx import Api
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.pool import NullPool
 
 # Initialise app
 app = Flask(__name__)
@@ -17,11 +19,25 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 
 # App configs
 app.config['SECRET_KEY'] = 'ravenpoint'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'data', 'data.sqlite')
+# Database file, or `:memory:` for ephemeral test runs; an in-memory database can be loaded
+# from a snapshot archive or seed spec (.json) at startup and saved as a snapshot on shutdown
+app.config['DATABASE'] = os.environ.get('RAVENPOINT_DATABASE', os.path.join(basedir, 'data', 'data.sqlite'))
+app.config['DATABASE_LOAD'] = os.environ.get('RAVENPOINT_DATABASE_LOAD')
+app.config['DATABASE_PERSIST'] = os.environ.get('RAVENPOINT_DATABASE_PERSIST')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['RESTPLUS_MASK_SWAGGER'] = False
 app.config['SWAGGER_UI_DOC_EXPANSION'] = 'list'
 app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'static', 'files')
+app.config['DOCUMENTS_FOLDER'] = os.path.join(basedir, 'data', 'documents')
+os.makedirs(app.config['DOCUMENTS_FOLDER'], exist_ok=True)
+
+# Flask-SQLAlchemy opens its connections through the same connection manager as the API
+# Connections are not pooled, as each request may be served from a different site's database
+from project.database import get_connection, get_sqlalchemy_uri, is_memory_database, prepare_database, \
+  site_initializers, SiteMiddleware
+app.config['SQLALCHEMY_DATABASE_URI'] = get_sqlalchemy_uri()
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'creator': get_connection, 'poolclass': NullPool}
+prepare_database()
 
 print(basedir)
 # CORS
@@ -30,6 +46,20 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 db = SQLAlchemy(app)
 Migrate(app, db)
 
+# Site collections (`/ravenpoint/sites/<site>/_api/...`) get the registry tables when first opened
+def create_site_tables():
+  with app.app_context():
+    db.create_all()
+
+site_initializers.append(create_site_tables)
+
+# Create the in-memory database before the blueprints prepare their tables
+if is_memory_database():
+  from project.cli import load_database, persist_database
+  load_database()
+  if app.config['DATABASE_PERSIST']:
+    atexit.register(persist_database)
+
 # Import blueprints
 from project.api import api, api_namespace
 from project.admin.views import admin
@@ -57,4 +87,12 @@ api_extension.add_namespace(api_namespace)
 
 # Register blueprints
 app.register_blueprint(api, url_prefix='/ravenpoint')
-app.register_blueprint(admin)
\ No newline at end of file
+app.register_blueprint(admin)
+
+# Serve site collections, and apply performance profiles to the API
+from project.profiles import ProfileMiddleware
+app.wsgi_app = SiteMiddleware(ProfileMiddleware(app.wsgi_app))
+
+# Register CLI commands
+from project.cli import ravenpoint_cli
+app.cli.add_command(ravenpoint_cli)
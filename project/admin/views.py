@@ -1,14 +1,20 @@
 import json
 import os
+import numpy as np
 import pandas as pd
-import sqlite3
 
 from flask import render_template, Blueprint, url_for, redirect, request, flash, send_from_directory
 from project import db, app
+from project.database import get_connection
 from project.admin.forms import UploadData, EditRelationship,UploadFile,CreateUser
-from project.models import Table, Relationship
+from project.models import Table, Relationship, OutboxEmail
+from project.outbox import start_sender
+from project.relationships import get_migrations, migrate_relationship
 from project.utils import get_all_table_names, get_all_table_metadata, translate_odata, \
-    get_all_relationships
+    get_all_relationships, replace_table, build_junction_table, \
+    default_folder, get_document, store_document, import_legacy_documents, list_folder, remove_document, \
+    ensure_user_table, clear_user_cache, infer_field_types, apply_lookup_fields, register_fields, \
+    unregister_fields, get_table_fields, build_search_index, drop_search_index
 from werkzeug.utils import secure_filename
 
 admin = Blueprint(
@@ -16,9 +22,6 @@ admin = Blueprint(
     template_folder='templates'
 )
 
-# Configure connection string
-conn_string = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
-
 @admin.route('/', methods=['GET', 'POST'])
 def index():
     # Test
@@ -30,7 +33,7 @@ def index():
     form = UploadData()
 
     # Get tables metadata
-    with sqlite3.connect(conn_string) as conn:
+    with get_connection() as conn:
         all_tables = get_all_table_names(conn)
         table_metadata = get_all_table_metadata(conn, all_tables)
 
@@ -59,16 +62,26 @@ def index():
 
             # Load into sqlite
             try:
-                # Add table to database
-                with sqlite3.connect(conn_string) as conn:
-                    df.to_sql(table_db_name, con=conn, if_exists='replace', index=False,
-                            dtype={f'{df.columns[0]}': 'INTEGER PRIMARY KEY'})
+                # Add table to database; re-uploads replace the table in one swap
+                # Field types are inferred once here and stored in the registry
+                with get_connection() as conn:
+                    fields = apply_lookup_fields(infer_field_types(df), table_db_name,
+                                                 get_all_relationships(conn))
+                    replace_table(conn, df, table_db_name, fields, primary_key=df.columns[0])
+                    register_fields(conn, table_db_name, fields)
 
                 # Add table to register
                 new_table = Table(table_name, table_db_name)
-                db.session.add(new_table)
+                db.session.merge(new_table)
                 db.session.commit()
 
+                # Rebuild junction tables for multi-lookups from the new data
+                multi_rships = Relationship.query.filter_by(table_left=table_db_name, is_multi=True).all()
+                with get_connection() as conn:
+                    for rship in multi_rships:
+                        build_junction_table(conn, rship.table_left, rship.table_left_on, rship.table_lookup)
+                    build_search_index(conn, table_db_name)
+
             except Exception as e:
                 print('Error loading data into database:')
                 print(e)
@@ -94,13 +107,40 @@ def table_view(id):
     table = Table.query.filter_by(id=id).first_or_404()
     
     # Connect to database
-    with sqlite3.connect(conn_string) as conn:
+    with get_connection() as conn:
         # Get data
         df = pd.read_sql(f'SELECT * FROM {table.table_db_name}', conn)
-    
+        fields = get_table_fields(conn, table.table_db_name)
+        searchable = [row[0] for row in conn.execute(
+            'SELECT column_name FROM columns WHERE table_db_name = ? AND searchable',
+            (table.table_db_name,)).fetchall()]
+
     return render_template('table.html', table=df.to_dict('records'), id=id,
                             columns=df.columns.tolist(), table_name=table.table_name,
-                            table_db_name=table.table_db_name)
+                            table_db_name=table.table_db_name,
+                            text_fields=[col for col, field_type in fields.items() if field_type == 'Text'],
+                            searchable=searchable)
+
+# Search index endpoint
+@admin.route('/table/<string:id>/search', methods=['POST'])
+def table_search(id):
+    table = Table.query.filter_by(id=id).first_or_404()
+    columns = request.form.getlist('search_columns')
+    with get_connection() as conn:
+        try:
+            conn.execute('UPDATE columns SET searchable = (field_type = \'Text\' AND column_name IN (SELECT value FROM json_each(?))) \
+                         WHERE table_db_name = ?', (json.dumps(columns), table.table_db_name))
+            conn.commit()
+            build_search_index(conn, table.table_db_name)
+        except Exception as e:
+            conn.rollback()
+            flash(f'Error: Could not build the search index for {table.table_db_name}. \n{e}', 'danger')
+            return redirect(url_for('admin.table_view', id=id))
+    if columns:
+        flash(f"Search index built on {', '.join(columns)}.", 'success')
+    else:
+        flash('Search index removed.', 'success')
+    return redirect(url_for('admin.table_view', id=id))
 
 # Delete table endpoint
 @admin.route('/table/<string:id>/delete', methods=['POST'])
@@ -109,11 +149,13 @@ def table_delete(id):
     table = Table.query.filter_by(id=id).first_or_404()
     # print(table)
     # Run delete query
-    with sqlite3.connect(conn_string) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         try:
+            drop_search_index(conn, table.table_db_name)
             cursor.execute(f'DROP TABLE {table.table_db_name}')
             cursor.execute(f"DELETE FROM tables WHERE id='{id}'")
+            unregister_fields(conn, table.table_db_name)
             conn.commit()
         except Exception as e:
             conn.rollback()
@@ -129,7 +171,7 @@ def relationships():
     form = EditRelationship()
     
     # Get all relationships
-    with sqlite3.connect(conn_string) as conn:
+    with get_connection() as conn:
         all_relationships = get_all_relationships(conn)
     if request.method == 'POST':
         if form.validate_on_submit():
@@ -142,39 +184,19 @@ def relationships():
             description = form.description.data
 
             # Create new relationship
-            new_rship = Relationship(table_left, table_left_on, table_lookup, 
-                                     table_lookup_on, is_multi, description)
-
-            # Create new junction table
-            if is_multi:
-                # Get left table
-                with sqlite3.connect(conn_string) as conn:
-                    df = pd.read_sql(F'SELECT * FROM {table_left}', con=conn)
-                
-                    # Transform lookup table into a junction table
-                    df[table_left_on] = df[table_left_on].str.split(',')
-                    df = df[['Id', table_left_on]].explode(table_left_on)
-                    
-                    # Clean data format and index and column names
-                    df[table_left_on] = pd.to_numeric(df[table_left_on])
-                    df = df.dropna()
-                    df[table_left_on] = df[table_left_on].astype(int)
-                    df = df.reset_index(drop=True).reset_index()
-                    df = df.rename(columns={'Id': f'{table_left}_pk', table_left_on: f'{table_lookup}_pk', 'index': 'Id'})
-
-                    # Save to database
-                    df.to_sql(f'{table_left}_{table_lookup}', con=conn, if_exists='replace', index=False,
-                                dtype={f'{df.columns[0]}': 'INTEGER PRIMARY KEY'})
-            
-            # Commit changes
-            try:
-                db.session.add(new_rship)
-                db.session.commit()
-            except Exception as e:
-                db.session.rollback()
-                flash(f"Failed to load data into database:\n{e}", 'danger')
-                return redirect(url_for('admin.relationships'))
-            
+            values = {
+                'table_left': table_left,
+                'table_left_on': table_left_on,
+                'table_lookup': table_lookup,
+                'table_lookup_on': table_lookup_on,
+                'is_multi': is_multi,
+                'description': description
+            }
+
+            # Create the junction table and register the relationship in the background, then
+            # update the field type of the lookup column; triggers keep the junction in sync
+            rship_id, _ = migrate_relationship(None, values)
+            flash(f'Relationship ID={rship_id} queued. It is added once its data is migrated.', 'success')
             return redirect(url_for('admin.relationships'))
         else:
             # Print errors
@@ -182,16 +204,15 @@ def relationships():
                 for err in error_msg:
                     print(f"{field}:  {err}")
     return render_template('relationships.html', form=form,
-                           relationships=all_relationships.to_dict('records'))
+                           relationships=all_relationships.to_dict('records'), migrations=get_migrations())
 
 
 @admin.route('/files', methods=['GET', 'POST'])
 def files():
     form = UploadFile()
-    folder = "/project/data/documents"
-    curdir = os.path.abspath(os.getcwd())
-    fulldir = curdir.replace('''\\''',"/") + folder
-    files = os.listdir(fulldir)
+    import_legacy_documents()
+    documents, _ = list_folder(default_folder)
+    files = [document.name for document in documents]
 
     if request.method == 'POST':
         if form.validate_on_submit():
@@ -199,9 +220,7 @@ def files():
             # Upload file to server
             file = request.files['file']
             filename = secure_filename(file.filename)
-            filepath = os.path.join(fulldir, filename)
-            print(filepath)
-            file.save(filepath)
+            store_document(default_folder, filename, file.stream)
             flash(
                 f'Successfully loaded file as {file.filename}.', 'success')
             return redirect(url_for('admin.files'))
@@ -218,23 +237,13 @@ def files():
 
 @admin.route('/files/<string:file_name>/delete', methods=['POST'])
 def file_delete(file_name):
-    folder = "/project/data/documents"
-    curdir = os.path.abspath(os.getcwd())
-    fulldir = curdir.replace('''\\''',"/") + folder
-    files = os.listdir(fulldir)
-
     if request.method == 'POST':
         print(file_name)
-        if file_name in files:
-
-            # Upload file to server
-   
-            filepath = os.path.join(fulldir, file_name)
-            print(filepath)
-            os.remove(filepath)
+        if get_document(default_folder, file_name) is not None:
+            remove_document(default_folder, file_name)
             flash(
                 f'Successfully deleted file  {file_name}.', 'success')
-            return redirect(url_for('admin.files'))
+        return redirect(url_for('admin.files'))
 
 
 @admin.route('/users', methods=['GET', 'POST'])
@@ -247,18 +256,11 @@ def users():
             email = username+"@defencemail.gov.sg"
             df = pd.DataFrame({'Title': [username], 'Email': [email]})
             print(df)
-            with sqlite3.connect(conn_string) as conn:
-                cursor = conn.cursor()
+            with get_connection() as conn:
                 try:
-                   res = cursor.execute(''' SELECT count(name) FROM sqlite_master WHERE type='table' AND name='rpusers' ''')
-                   tableExists = res.fetchone()[0]
-                   if tableExists==1 :
-                       df.to_sql('rpusers', con=conn, if_exists='append', index=False)
-                       db.session.commit()
-                   else:
-                       cursor.execute('''CREATE TABLE rpusers (Id INTEGER PRIMARY KEY , Title text, Email text)''')
-                       df.to_sql('rpusers', con=conn, if_exists='append', index=False)
-                       db.session.commit()
+                    ensure_user_table(conn)
+                    df.to_sql('rpusers', con=conn, if_exists='append', index=False)
+                    clear_user_cache()
                 except Exception as e:
                     print("user create error:",e)
                     db.session.rollback()
@@ -267,7 +269,7 @@ def users():
                     return redirect(url_for('admin.users'))
     else:
         try:
-            with sqlite3.connect(conn_string) as conn:
+            with get_connection() as conn:
                 df = pd.read_sql('''SELECT * FROM rpusers''', con=conn)
                 users = df.to_dict('records')
         except Exception as e:
@@ -277,10 +279,12 @@ def users():
 @admin.route('/users/<int:id>/delete', methods=['POST'])
 def user_delete(id):
     if request.method == 'POST':
-        with sqlite3.connect(conn_string) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             try:
                 cursor.execute('''DELETE FROM rpusers WHERE Id=?''',(id,))
+                conn.commit()
+                clear_user_cache()
                 db.session.commit()
             except Exception as e:
                 print("user delete error:",e)
@@ -314,13 +318,18 @@ def relationship(id):
 
     if request.method == 'POST' and form.validate_on_submit():
         # Extract form data
-        rship.table_left = form.table_left.data
-        rship.table_left_on = form.table_left_on.data
-        rship.table_lookup = form.table_lookup.data
-        rship.table_lookup_on = 'Id'
-        rship.is_multi = form.is_multi.data
-        rship.description = form.description.data
-        db.session.commit()
+        values = {
+            'table_left': form.table_left.data,
+            'table_left_on': form.table_left_on.data,
+            'table_lookup': form.table_lookup.data,
+            'table_lookup_on': 'Id',
+            'is_multi': form.is_multi.data,
+            'description': form.description.data
+        }
+        # Build, rebuild or drop the junction table in the background, as the edit requires; the
+        # registry is updated with it
+        _, steps = migrate_relationship(id, values)
+        flash(f"Relationship ID={id} queued for update. Migration: {', '.join([step[0] for step in steps]) or 'fields only'}.", 'success')
         return redirect(url_for('admin.relationships'))
 
     return render_template('relationship.html', form=form, id=id, rship=json.dumps(output))
@@ -334,19 +343,49 @@ def relationship_delete(id):
     # Delete id
     rship = Relationship.query.get(id)
         
-    # Run delete query
+    # Run delete query in the background, with the drop of the junction table
     try:
-            
-        if rship.is_multi:
-            db.session.execute(f'DROP TABLE {rship.table_left}_{rship.table_lookup}')
-        db.session.delete(rship)
-        db.session.commit()
+        migrate_relationship(id, None)
     except Exception as e:
-        db.session.rollback()
         flash(f'Error: Could not delete relationship ID={rship.rship_id}. \n{e}', 'danger')
         return redirect(url_for('admin.relationships'))
     return redirect(url_for('admin.relationships'))
 
+@admin.route('/outbox', methods=['GET'])
+def outbox():
+    # Make sure queued emails are being delivered
+    start_sender()
+    emails = OutboxEmail.query.order_by(OutboxEmail.id.desc()).all()
+    counts = {status: 0 for status in ['queued', 'sending', 'sent', 'failed']}
+    latencies = []
+    for email in emails:
+        counts[email.status] = counts.get(email.status, 0) + 1
+        if email.sent_at is not None:
+            latencies.append(email.sent_at - email.queued_at)
+    latency = {}
+    if latencies:
+        latency = {
+            'mean': float(np.mean(latencies)),
+            'p95': float(np.percentile(latencies, 95)),
+            'max': float(np.max(latencies))
+        }
+    return render_template('outbox.html', emails=emails, counts=counts, latency=latency)
+
+
+# Performance profiles endpoint: switch the profile applied to API requests without the header
+@admin.route('/profiles', methods=['GET', 'POST'])
+def profiles():
+    if request.method == 'POST':
+        profile = request.form.get('profile') or None
+        if profile is not None and profile not in app.config['PROFILES']:
+            flash(f'Profile {profile} does not exist.', 'danger')
+        else:
+            app.config['PROFILE'] = profile
+            flash(f"Profile set to {profile or 'none'}.", 'success')
+        return redirect(url_for('admin.profiles'))
+    return render_template('profiles.html', profiles=app.config['PROFILES'], active=app.config['PROFILE'])
+
+
 @admin.route('/guide', methods=['GET'])
 def guide():
     return render_template('guide.html')
@@ -354,7 +393,7 @@ def guide():
 
 @admin.route('/get_tables', methods=['GET'])
 def get_tables():
-    with sqlite3.connect(conn_string) as conn:
+    with get_connection() as conn:
         all_tables = get_all_table_names(conn)
         table_metadata = get_all_table_metadata(conn, all_tables)
         table_metadata['columns'] = table_metadata['columns'].str.replace(' ', '', regex=False)
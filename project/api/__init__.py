@@ -2,19 +2,27 @@ import json
 import os
 import numpy as np
 import pandas as pd
-import sqlite3
 import time
 
-from flask import Blueprint, request, jsonify, send_from_directory,Response 
-from flask_mail import Mail
-from flask_mail import Message
+from flask import Blueprint, request, jsonify, send_from_directory, send_file, Response 
 
 from flask_restx import Namespace, Resource, fields
 from project import db, app
+from project.database import get_connection, site_initializers
 from project.utils import get_all_table_names, get_all_relationships, parse_odata_filter, \
-  parse_odata_query, validate_create_update_query, validate_delete_query, \
-  validate_create_update_query_listname, validate_delete_query_listname, validate_file_query
-from werkzeug.exceptions import BadRequest
+  parse_odata_query, parse_odata_top, build_list_query, compile_list_query, compile_count_query, \
+  process_list_data, fetch_expansions, read_snapshot, validate_create_update_query, validate_delete_query, \
+  validate_create_update_query_listname, validate_delete_query_listname, validate_file_query, \
+  normalize_folder, get_blob_path, get_document, store_document, list_folder, get_file_metadata, \
+  append_upload_chunk, finish_upload, users_table, ensure_user_table, get_user_by_id, get_user_by_email, \
+  get_current_user, ensure_user, get_all_fields, get_table_fields, get_list_fields, parse_item_values, \
+  backfill_fields, write_list_item, parse_change_token, get_latest_change_token, get_changes_since, \
+  get_change_events
+from project.events import subscribe, unsubscribe, stream_events
+from project.outbox import enqueue_email
+from project.offload import should_offload, offload_list_items
+from project.throttle import client_header, throttle
+from werkzeug.exceptions import BadRequest, ServiceUnavailable
 
 # Create blueprint
 api = Blueprint(
@@ -22,20 +30,37 @@ api = Blueprint(
   template_folder='api_templates'
 )
 
-app.config['MAIL_SERVER']='localhost'
-app.config['MAIL_PORT'] = 1025
 
-mail = Mail(app)
 
-# Connection string
-conn_string = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
 
 
+# URL params accepted by list item endpoints
+list_item_keywords = ['$select', '$filter', '$expand', '$orderby', '$top', '$inlinecount', '$apply', '$search']
 
+# URL params accepted by the site users endpoint
+user_keywords = ['$select', '$filter', '$expand', '$orderby', '$top']
+
+# Function to create the users table and its indexes, and register field types of existing lists
+def prepare_site_tables():
+  with get_connection() as conn:
+    ensure_user_table(conn)
+    backfill_fields(conn)
+
+# Prepare the default site now, and each site collection when it is first opened
+prepare_site_tables()
+site_initializers.append(prepare_site_tables)
 
 # Create namespace
 api_namespace = Namespace('_api', 'RavenPoint REST API endpoints')
 
+# Function to throttle requests to the namespace's endpoints (not the Swagger docs)
+@api.before_request
+def throttle_api_request():
+  view_class = getattr(app.view_functions.get(request.endpoint), 'view_class', None)
+  if view_class not in [resource.resource for resource in api_namespace.resources]:
+    return
+  throttle(request.headers.get(client_header, request.remote_addr), request.endpoint)
+
 # Hello world example
 hello_world_model = api_namespace.model(
   'Hello World', {
@@ -89,7 +114,7 @@ class ListMetadata(Resource):
     '''RavenPoint list metadata endpoint'''
     print(request.args.items())
     # Check if list exists
-    with sqlite3.connect(conn_string) as conn:
+    with get_connection() as conn:
       all_tables = get_all_table_names(conn)
     if list_id not in all_tables.id.tolist():
       raise BadRequest('List does not exist.')
@@ -142,7 +167,7 @@ class ListByTitleMetadata(Resource):
     '''RavenPoint list metadata endpoint'''
     print(request.args.items())
     # Check if list exists
-    with sqlite3.connect(conn_string) as conn:
+    with get_connection() as conn:
       all_tables = get_all_table_names(conn)
     if list_name not in all_tables.table_name.tolist():
       raise BadRequest('List does not exist.')
@@ -177,6 +202,210 @@ class ListByTitleMetadata(Resource):
 
     return {'d': output}
 
+# Endpoint for list fields
+@api_namespace.route(
+  "/web/Lists(guid'<string:list_id>')/fields",
+  doc={'description': '''Endpoint for getting the fields (columns) of a List and their \
+SharePoint field types. Use `$select` to choose specific field properties.'''}
+)
+@api_namespace.doc(params={'list_id': 'Simulated SP List ID'})
+class ListFields(Resource):
+  @api_namespace.response(200, 'Success: Returns List fields')
+  @api_namespace.response(400, 'Bad request: Invalid query.')
+  def get(self, list_id):
+    '''RavenPoint list fields endpoint'''
+    with read_snapshot() as conn:
+      all_tables = get_all_table_names(conn)
+      if list_id not in all_tables.id.tolist():
+        raise BadRequest('List does not exist.')
+      curr_db_table = all_tables.loc[all_tables.id.eq(list_id)].table_db_name.iloc[0]
+      return {'d': {'results': get_fields_response(conn, curr_db_table, all_tables)}}
+
+
+@api_namespace.route(
+  "/web/lists/GetByTitle('<string:list_name>')/fields",
+  doc={'description': '''Endpoint for getting the fields (columns) of a List and their \
+SharePoint field types. Use `$select` to choose specific field properties.'''}
+)
+@api_namespace.doc(params={'list_name': 'Simulated SP List Name'})
+class ListByTitleFields(Resource):
+  @api_namespace.response(200, 'Success: Returns List fields')
+  @api_namespace.response(400, 'Bad request: Invalid query.')
+  def get(self, list_name):
+    '''RavenPoint list fields endpoint'''
+    with read_snapshot() as conn:
+      all_tables = get_all_table_names(conn)
+      if list_name not in all_tables.table_name.tolist():
+        raise BadRequest('List does not exist.')
+      curr_db_table = all_tables.loc[all_tables.table_name.eq(list_name)].table_db_name.iloc[0]
+      return {'d': {'results': get_fields_response(conn, curr_db_table, all_tables)}}
+
+# Function to build the fields response for a list
+def get_fields_response(conn, curr_db_table, all_tables):
+  if any([key != '$select' for key in request.args.keys()]):
+    raise BadRequest('Invalid keyword(s). Use only $select.')
+  fields = get_list_fields(curr_db_table, get_table_fields(conn, curr_db_table), all_tables,
+                           get_all_relationships(conn))
+  if '$select' in request.args:
+    properties = [prop.strip() for prop in request.args['$select'].split(',')]
+    fields = [{prop: field.get(prop) for prop in properties} for field in fields]
+  return fields
+
+# Endpoint for list changes
+change_keywords = ['changeToken', '$select', '$expand']
+
+@api_namespace.route(
+  "/web/Lists(guid'<string:list_id>')/GetListItemChangesSinceToken",
+  doc={'description': '''Endpoint for incremental sync. Returns the items added or updated \
+and the Ids of items deleted since a change token, plus a new token for the next call. Pass the \
+token as `changeToken` (GET) or `{"query": {"ChangeToken": "<token>"}}` (POST); omit it for a full \
+sync. `$select` and `$expand` apply to the returned items.'''}
+)
+@api_namespace.doc(params={'list_id': 'Simulated SP List ID'})
+class ListItemChanges(Resource):
+  @api_namespace.response(200, 'Success: Returns changed items, deleted Ids and a new change token')
+  @api_namespace.response(400, 'Bad request: Invalid query.')
+  def get(self, list_id):
+    '''RavenPoint list changes endpoint'''
+    return get_changes_response(lambda all_tables: all_tables.id.eq(list_id), request.args.get('changeToken'))
+
+  def post(self, list_id):
+    '''RavenPoint list changes endpoint'''
+    return get_changes_response(lambda all_tables: all_tables.id.eq(list_id), get_posted_change_token())
+
+
+@api_namespace.route(
+  "/web/lists/GetByTitle('<string:list_name>')/GetListItemChangesSinceToken",
+  doc={'description': '''Endpoint for incremental sync. Returns the items added or updated \
+and the Ids of items deleted since a change token, plus a new token for the next call. Pass the \
+token as `changeToken` (GET) or `{"query": {"ChangeToken": "<token>"}}` (POST); omit it for a full \
+sync. `$select` and `$expand` apply to the returned items.'''}
+)
+@api_namespace.doc(params={'list_name': 'Simulated SP List Name'})
+class ListByTitleItemChanges(Resource):
+  @api_namespace.response(200, 'Success: Returns changed items, deleted Ids and a new change token')
+  @api_namespace.response(400, 'Bad request: Invalid query.')
+  def get(self, list_name):
+    '''RavenPoint list changes endpoint'''
+    return get_changes_response(lambda all_tables: all_tables.table_name.eq(list_name), request.args.get('changeToken'))
+
+  def post(self, list_name):
+    '''RavenPoint list changes endpoint'''
+    return get_changes_response(lambda all_tables: all_tables.table_name.eq(list_name), get_posted_change_token())
+
+# Function to read the change token from a POST body
+def get_posted_change_token():
+  data = request.get_json(silent=True) or {}
+  query = data.get('query', {}) if isinstance(data.get('query'), dict) else {}
+  return query.get('ChangeToken', request.args.get('changeToken'))
+
+# Function to build the changes response for a list
+# Only the rows changed since the token are read; the token is taken in the same snapshot
+def get_changes_response(match_table, token):
+  if any([key not in change_keywords for key in request.args.keys()]):
+    raise BadRequest(f"Invalid keyword(s). Use only {', '.join(change_keywords)}.")
+  token = parse_change_token(token)
+  params = parse_odata_query({key: value for key, value in request.args.items() if key.startswith('$')})
+
+  with read_snapshot() as conn:
+    all_tables = get_all_table_names(conn)
+    curr_table = all_tables.loc[match_table(all_tables)].to_dict('records')
+    if len(curr_table) == 0:
+      raise BadRequest('List does not exist.')
+    curr_db_table = curr_table[0]['table_db_name']
+    latest_token = get_latest_change_token(conn)
+    changes = get_changes_since(conn, curr_db_table, token)
+
+    query = build_list_query(params, get_all_relationships(conn), curr_db_table, all_fields=get_all_fields(conn))
+    if changes is not None:
+      changed_ids = ', '.join([str(int(item_id)) for item_id in changes['changed']])
+      query['where'] = f"{curr_db_table}.Id IN ({changed_ids})"
+    # Large results (e.g. a full sync) are left to a worker process, which reads a later
+    # snapshot: items changed since are sent again on the next sync, so none are missed
+    offload = should_offload(conn, query, rows=None if changes is None else len(changes['changed']))
+    if not offload:
+      data = pd.read_sql(compile_list_query(query), con=conn)
+      expansions = fetch_expansions(conn, query, data)
+
+  output = {
+    'listId': curr_table[0]['id'],
+    'changeToken': str(latest_token),
+    'fullSync': changes is None,
+    'value': None,
+    'deleted': [] if changes is None else changes['deleted']
+  }
+  if offload:
+    return Response(offload_list_items(query, compile_list_query(query), output), mimetype='application/json')
+  data = process_list_data(data, expansions)
+  output['value'] = data.replace({np.nan: None}).to_dict('records')
+  return output
+
+# Endpoint for list change events
+@api_namespace.route(
+  "/web/Lists(guid'<string:list_id>')/subscribe",
+  doc={'description': '''Server-Sent Events stream of item changes (`Add`, `Update`, `Delete`) for \
+a List. Each event id is a change token: reconnecting clients send it as `Last-Event-ID` (or \
+`?lastEventId=`) to replay missed changes. A `Reset` event means the client must sync in full.'''}
+)
+@api_namespace.doc(params={'list_id': 'Simulated SP List ID'})
+class ListSubscribe(Resource):
+  @api_namespace.response(200, 'Success: Streams change events')
+  @api_namespace.response(400, 'Bad request: Invalid query.')
+  @api_namespace.response(503, 'Too many subscribers')
+  def get(self, list_id):
+    '''RavenPoint list change events endpoint'''
+    return get_subscribe_response(lambda all_tables: all_tables.id.eq(list_id))
+
+
+@api_namespace.route(
+  "/web/lists/GetByTitle('<string:list_name>')/subscribe",
+  doc={'description': '''Server-Sent Events stream of item changes (`Add`, `Update`, `Delete`) for \
+a List. Each event id is a change token: reconnecting clients send it as `Last-Event-ID` (or \
+`?lastEventId=`) to replay missed changes. A `Reset` event means the client must sync in full.'''}
+)
+@api_namespace.doc(params={'list_name': 'Simulated SP List Name'})
+class ListByTitleSubscribe(Resource):
+  @api_namespace.response(200, 'Success: Streams change events')
+  @api_namespace.response(400, 'Bad request: Invalid query.')
+  @api_namespace.response(503, 'Too many subscribers')
+  def get(self, list_name):
+    '''RavenPoint list change events endpoint'''
+    return get_subscribe_response(lambda all_tables: all_tables.table_name.eq(list_name))
+
+# Function to open an event stream for a list
+def get_subscribe_response(match_table):
+  subscriber, replay, token = open_subscription(match_table, request.args, request.headers)
+  return Response(stream_events(subscriber, replay, token), mimetype='text/event-stream',
+                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Function to subscribe to a list and read the changes missed since Last-Event-ID
+# The subscription is registered before missed changes are read, so none fall in between
+# Shared with the ASGI app, which passes its event loop
+def open_subscription(match_table, args, headers, loop=None):
+  if any([key != 'lastEventId' for key in args.keys()]):
+    raise BadRequest('Invalid keyword(s). Use only lastEventId.')
+  token = parse_change_token(headers.get('Last-Event-ID', args.get('lastEventId')))
+
+  with read_snapshot() as conn:
+    all_tables = get_all_table_names(conn)
+    curr_table = all_tables.loc[match_table(all_tables)].to_dict('records')
+    if len(curr_table) == 0:
+      raise BadRequest('List does not exist.')
+    curr_db_table = curr_table[0]['table_db_name']
+
+  subscriber = subscribe(curr_db_table, loop)
+  if subscriber is None:
+    raise ServiceUnavailable('Too many subscribers. Try again later.')
+  replay = []
+  if token is not None:
+    try:
+      with read_snapshot() as conn:
+        replay = get_change_events(conn, curr_db_table, token, app.config['EVENTS_QUEUE_SIZE'])
+    except Exception:
+      unsubscribe(subscriber)
+      raise
+  return subscriber, replay, token or 0
+
 # Endpoint for getting list items
 lietfn_model = api_namespace.model(
   'ListItemEntityTypeFullName', {
@@ -232,12 +461,18 @@ create_update_model = api_namespace.model(
 @api_namespace.route(
   "/web/Lists(guid'<string:list_id>')/items",
   doc={'description': '''Endpoint for retrieving List items. \
-Currently implemented URL params: `select`, `expand`, and `filter`.
+Currently implemented URL params: `select`, `expand`, `filter`, `orderby` and `top`.
 
 - Use `$select=ListItemEntityTypeFullName` to get the List item entity type.
 - Use `$select=<columns>` to select columns.
 - Use `$expand=<lookup_table>` to join tables.
 - Use `$filter=<criteria>` to filter items.
+- Use `$search=<terms>` to find items containing every term in their search-indexed (or Text) fields.
+- Use `$orderby=<column> [asc|desc],...` to sort items. Lookup columns must be expanded.
+- Use `$top=<n>` to return only the first n items.
+- Use `$inlinecount=allpages` to add the total number of matching items as `__count`.
+- Use `$apply=groupby((<columns>),aggregate(<column> with <method> as <alias>))` to \
+summarise items (RavenPoint extension). Methods: `count`, `countdistinct`, `sum`, `average`, `min`, `max`.
 
 The URL parameter hierarchy is `select` > `expand` > `filter`. Any other combination may result in an error.
 
@@ -255,144 +490,74 @@ class ListItems(Resource):
   @api_namespace.response(500, 'Internal Server Error')
   def get(self, list_id):
     '''RavenPoint list items endpoint (Read)'''
-    # time.sleep(2)
-    
     # Check for invalid keywords
     request_keys = request.args.keys()
-    if any([key not in ['$select', '$filter', '$expand', '$top'] for key in request_keys]):
-      raise BadRequest('Invalid keyword(s). Use only $select, $filter, or $expand.')
+    if any([key not in list_item_keywords for key in request_keys]):
+      raise BadRequest(f"Invalid keyword(s). Use only {', '.join(list_item_keywords)}.")
+    if request.args.get('$inlinecount', 'none') not in ['allpages', 'none']:
+      raise BadRequest('Invalid $inlinecount value. Use allpages or none.')
     
     # Extract URL params
     params = parse_odata_query(request.args)
     if params:
       params['listId'] = list_id
 
-    # Check if list exists; get all relationships
-    with sqlite3.connect(conn_string) as conn:
+    # Read the registry and items from one consistent snapshot
+    with read_snapshot() as conn:
+      # Check if list exists; get all relationships
       all_tables = get_all_table_names(conn)
       all_rships = get_all_relationships(conn)
-    if list_id not in all_tables.id.tolist():
-      raise BadRequest('List does not exist.')
-
-    # Extract table metadata
-    curr_table = all_tables.loc[all_tables.id.eq(list_id)].to_dict('records')[0]
-    curr_db_table = curr_table['table_db_name']
-    # Extract table
-    with sqlite3.connect(conn_string) as conn:
-        df = pd.read_sql(f"SELECT * FROM {curr_db_table}", conn)
-    
-    # If no params are given, return all data
-    if '$select' not in request_keys and '$filter' not in request_keys and '$expand' not in request_keys:
-      return {
-        'listId': list_id,
-        'value': df.to_dict('records')
-      }
-    
-    # EXPAND - Get all tables in query
-    joins = {}
-    for col in params['expand_cols']:
-      # Check if the column to expand was included in the selected columns
-      if not any([col in join_col for join_col in params['join_cols']]):
-        raise BadRequest(f"The query to field '{col}' is not valid. The $select query string must specify the target fields and the $expand query string must contain {col}.")
+      all_fields = get_all_fields(conn)
+      if list_id not in all_tables.id.tolist():
+        raise BadRequest('List does not exist.')
+
+      # Extract table metadata
+      curr_table = all_tables.loc[all_tables.id.eq(list_id)].to_dict('records')[0]
+      curr_db_table = curr_table['table_db_name']
+      # If no params are given, return all data; large lists are left to a worker process
+      if not any([key in request_keys for key in list_item_keywords]):
+        query = build_list_query(params, all_rships, curr_db_table, all_fields=all_fields)
+        if not should_offload(conn, query):
+          df = pd.read_sql(f"SELECT * FROM {curr_db_table}", conn)
+          return {
+            'listId': list_id,
+            'value': df.replace({np.nan: None}).to_dict('records')
+          }
+        # End the snapshot before waiting on the worker, which reads its own
+        conn.rollback()
+        body = offload_list_items(query, compile_list_query(query), {'listId': list_id, 'value': None})
+        return Response(body, mimetype='application/json')
       
-      # Check if relationship exists
-      rship = all_rships.loc[all_rships.table_left.eq(curr_db_table) & \
-        all_rships.table_left_on.eq(col)].to_dict('records')
-      if len(rship) == 0:
-        raise BadRequest(f"Relationship from field '{col}' does not exist.")
-      else:
-        joins[col] = {
-          'table': rship[0]['table_lookup'],
-          'table_pk': rship[0]['table_lookup_on'],
-          'is_multi': rship[0]['is_multi']
-        }
-        print(joins)
-
-    # Process joins data
-    for i, col in enumerate(params['join_cols']):
-      lookup_col, lookup_table_col = col.split('/')
-      if not lookup_col in params['expand_cols']:
-        raise BadRequest(f'Lookup field {lookup_col} not specified in $expand parameter.')
-      params['join_cols'][i] = params['join_cols'][i].replace(
-        lookup_col + '/', joins[lookup_col]['table'] + '.'
-      ) + f" AS '{lookup_col}__{lookup_table_col}'"
-
-    # Process filter
-    params['filter_query'] = parse_odata_filter(params['filter_query'], joins, curr_db_table)
-
-    # Add aliases to lookup tables
-    select_aliases = [f"{curr_db_table}.{col}" for col in params['main_cols']] + \
-      params['join_cols']
-    
-    # Prepare SQL query
-    sql_query = []
-    sql_query.append(f"SELECT {', '.join(select_aliases)}")
-    sql_query.append(f"FROM {curr_db_table}")
-
-    # If single lookup, do a left join; otherwise, left join the junction table first
-    multi_cols = []
-    for expand_col, lookup_data in joins.items():
-      lookup_table = lookup_data['table']
-      if lookup_data['is_multi'] == 0:
-        sql_query.append(f"LEFT JOIN {lookup_data['table']}" + \
-          f" ON {curr_db_table}.{expand_col} = {lookup_data['table']}.{lookup_data['table_pk']}")
-      else:
-        junction_table = f"{curr_db_table}_{lookup_data['table']}"
-        multi_cols.append(expand_col)
-        sql_query.append(
-          f"LEFT JOIN {junction_table} " + 
-          f"ON {curr_db_table}.Id = {junction_table}.{curr_db_table}_pk " +
-          f"LEFT JOIN {lookup_table} " +
-          f"ON {junction_table}.{lookup_table}_pk = {lookup_table}.Id"
-        )
-
-    if params['filter_query']:
-      sql_query.append(f"WHERE {params['filter_query']}")
-
-    # Query database and process data
-    with sqlite3.connect(conn_string) as conn:
-      data = pd.read_sql(' '.join(sql_query), con=conn)
-    nested_cols = data.columns[data.columns.str.contains('__', regex=False)]
-    nested_cols = list(set([col.split('__')[0] for col in nested_cols]))
-    nested_cols = [col for col in nested_cols if not col in multi_cols]
-
-    # Function to handle Id and Title
-    def clean_id_and_title(value):
-      if pd.isnull(value) or value is None:
-        return ''
-      if type(value) in [float, int]:
-        return int(value)
-      if type(value) == str:
-        return str(value)
-
-    # Process multi-lookup columns first
-    if len(multi_cols) > 0:
-      for multi_col in multi_cols:
-        sub_cols = data.columns[data.columns.str.contains(multi_col + '__')]
-        data[multi_col] = data[sub_cols].apply(lambda x: {k.replace(f'{multi_col}__', ''): clean_id_and_title(v) for k, v in zip(x.index, x.values)}, axis=1)
-        data = data.drop(sub_cols, axis=1)
-    
-      # Merge multi-lookup values
-      merge_cols = [col for col in data.columns if not col in multi_cols]
-      data = data.groupby(merge_cols).agg(lambda x: x.tolist()).reset_index()
-      for multi_col in multi_cols:
-        data[multi_col] = data[multi_col].apply(lambda x: [] if all([elem['Id'] == '' for elem in x]) else x)
-    
-    # Process single lookup columns
-    for nested_col in nested_cols:
-      sub_cols = data.columns[data.columns.str.contains(nested_col + '__')]
-      data[nested_col] = data[sub_cols].apply(lambda x: {k.replace(f'{nested_col}__', ''): clean_id_and_title(v) for k, v in zip(x.index, x.values)}, axis=1)
-      data = data.drop(sub_cols, axis=1)
+      # Build SQL query
+      query = build_list_query(params, all_rships, curr_db_table, all_fields=all_fields)
+      top = parse_odata_top(params['top'])
+      sql_query = compile_list_query(query, top)
+
+      # Query database and process data; large results are left to a worker process
+      offload = should_offload(conn, query, top)
+      if not offload:
+        data = pd.read_sql(sql_query, con=conn)
+        expansions = fetch_expansions(conn, query, data)
+        if params['inlinecount'] == 'allpages':
+          count = conn.execute(compile_count_query(query)).fetchone()[0]
 
     # Update diagnostic params
-    params['sql_query'] = ' '.join(sql_query)
-    params['joins'] = joins
+    params['sql_query'] = sql_query
+    params['joins'] = query['joins']
+
+    if offload:
+      count_query = compile_count_query(query) if params['inlinecount'] == 'allpages' else None
+      body = offload_list_items(query, sql_query, {'diagnostics': params, 'value': None}, count_query)
+      return Response(body, mimetype='application/json')
+    data = process_list_data(data, expansions)
 
     # Allow cross-origin
     output = {
       'diagnostics': params,
       'value': data.replace({np.nan: None}).to_dict('records')
     }
+    if params['inlinecount'] == 'allpages':
+      output['__count'] = count
 
     return output
   
@@ -411,36 +576,15 @@ class ListItems(Resource):
     if check_reqs.get('BadRequest'):
       raise BadRequest(check_reqs.get('BadRequest'))
     
-    # Get data types
-    df = check_reqs['data']
-    df = df.drop('Id', axis=1)
-    dtypes_lookup = df.dtypes.astype(str).to_dict()
-
-    # Prepare INSERT query
-    colnames = []
-    values_clause = []
-    for k, v in data.items():
-      if k in ['Id', '__metadata']:
-        continue
-      # Convert implicit lookup column Id
-      if (len(k) > 2) and ('/' not in k) and (k[-2:] == 'Id') and (k != 'parentKrId'):
-        k = k[:-2]
-      data_type = dtypes_lookup.get(k, 'object')
-      colnames.append(k)
-      values_clause.append(f"{v}" if ('int' in data_type or 'float' in data_type) else f"'{v}'")
-    query = f'''INSERT INTO {check_reqs.get('table')} ({', '.join(colnames)}) \
-VALUES ({', '.join(values_clause)})'''
-
-    # Run update
-    with sqlite3.connect(conn_string) as conn:
-      cursor = conn.cursor()
+    # Coerce values to the registered field types
+    colnames, values = parse_item_values(data, check_reqs['fields'])
+
+    # Run insert; the item is stamped and the change logged in the same transaction
+    with get_connection() as conn:
       try:
-        cursor.execute(query)
-        Id = cursor.lastrowid
-        conn.commit()
+        query, Id = write_list_item(conn, check_reqs.get('table'), 'Add', colnames, values)
       except Exception as e:
         print(e)
-        conn.rollback()
         raise BadRequest(f'Invalid request - data does not match table schema: {e}')
     return {
       # 'data': data,
@@ -451,6 +595,39 @@ VALUES ({', '.join(values_clause)})'''
       'message': f'Successfully added item.',
     }
 
+@api_namespace.route(
+  "/web/Lists(guid'<string:list_id>')/items/$count",
+  doc={'description': '''Endpoint for counting List items without retrieving them. \
+Use `$filter=<criteria>` (and `$expand=<lookup_table>` to filter on lookup columns) or \
+`$search=<terms>` to count matching items only. Returns the count as plain text.'''})
+@api_namespace.doc(params={'list_id': 'Simulated SP List ID'})
+class ListItemsCount(Resource):
+  @api_namespace.response(200, 'Success: Returns the number of matching list items.')
+  @api_namespace.response(400, 'Bad request: Invalid query.')
+  @api_namespace.response(500, 'Internal Server Error')
+  def get(self, list_id):
+    '''RavenPoint list item count endpoint'''
+    # Check for invalid keywords
+    request_keys = request.args.keys()
+    if any([key not in ['$filter', '$expand', '$search'] for key in request_keys]):
+      raise BadRequest('Invalid keyword(s). Use only $filter, $expand or $search.')
+    params = parse_odata_query(request.args)
+
+    with read_snapshot() as conn:
+      # Check if list exists; get all relationships
+      all_tables = get_all_table_names(conn)
+      all_rships = get_all_relationships(conn)
+      all_fields = get_all_fields(conn)
+      if list_id not in all_tables.id.tolist():
+        raise BadRequest('List does not exist.')
+      curr_table = all_tables.loc[all_tables.id.eq(list_id)].to_dict('records')[0]
+
+      # Count in SQL
+      query = build_list_query(params, all_rships, curr_table['table_db_name'], check_select=False,
+                               all_fields=all_fields)
+      count = conn.execute(compile_count_query(query)).fetchone()[0]
+    return Response(str(count), mimetype='text/plain')
+
 @api_namespace.route(
   "/web/Lists(guid'<string:list_id>')/items(<string:item_id>)",
   doc={'description': '''Endpoint for updating List items.'''})
@@ -476,33 +653,14 @@ class UpdateListItems(Resource):
       if check_reqs.get('BadRequest'):
         raise BadRequest(check_reqs.get('BadRequest'))
       
-      # Get data types
-      df = check_reqs['data']
-      df = df.drop('Id', axis=1)
-      dtypes_lookup = df.dtypes.astype(str).to_dict()
-
-      # Prepare UPDATE query
-      set_clause = []
-      for k, v in data.items():
-        if k in ['Id', '__metadata']:
-          continue
-        # Convert implicit lookup column Id
-        if (len(k) > 2) and ('/' not in k) and (k[-2:] == 'Id') and (k != 'parentKrId'):
-          k = k[:-2]
-        data_type = dtypes_lookup.get(k, 'object')
-        set_clause.append(f"{k} = {v}" if ('int' in data_type or 'float' in data_type) else f"{k} = '{v}'")
-      query = f'''UPDATE {check_reqs.get('table')} \
-  SET {', '.join(set_clause)} \
-  WHERE Id = {item_id}'''
-
-      # Run update
-      with sqlite3.connect(conn_string) as conn:
-        cursor = conn.cursor()
+      # Coerce values to the registered field types
+      colnames, values = parse_item_values(data, check_reqs['fields'])
+
+      # Run update; the item is stamped and the change logged in the same transaction
+      with get_connection() as conn:
         try:
-          cursor.execute(query)
-          conn.commit()
+          query, Id = write_list_item(conn, check_reqs.get('table'), 'Update', colnames, values, int(item_id))
         except Exception as e:
-          conn.rollback()
           raise BadRequest(f'Invalid request - data does not match table schema: {e}')
       return {
         # 'data': data,
@@ -517,16 +675,11 @@ class UpdateListItems(Resource):
       if check_reqs.get('BadRequest'):
         raise BadRequest(check_reqs.get('BadRequest'))
 
-      # Create query
-      query = f'''DELETE FROM {check_reqs.get('table')} WHERE Id = {item_id}'''
-      # Run update
-      with sqlite3.connect(conn_string) as conn:
-        cursor = conn.cursor()
+      # Run delete and log the change
+      with get_connection() as conn:
         try:
-          cursor.execute(query)
-          conn.commit()
+          query, _ = write_list_item(conn, check_reqs.get('table'), 'Delete', item_id=int(item_id))
         except Exception as e:
-          conn.rollback()
           raise BadRequest(f'Invalid request - could not delete item: {e}')
       return {
         # 'data': data,
@@ -540,12 +693,18 @@ class UpdateListItems(Resource):
 @api_namespace.route(
   "/web/lists/GetByTitle('<string:list_name>')/items",
   doc={'description': '''Endpoint for retrieving List items. \
-Currently implemented URL params: `select`, `expand`, and `filter`.
+Currently implemented URL params: `select`, `expand`, `filter`, `orderby` and `top`.
 
 - Use `$select=ListItemEntityTypeFullName` to get the List item entity type.
 - Use `$select=<columns>` to select columns.
 - Use `$expand=<lookup_table>` to join tables.
 - Use `$filter=<criteria>` to filter items.
+- Use `$search=<terms>` to find items containing every term in their search-indexed (or Text) fields.
+- Use `$orderby=<column> [asc|desc],...` to sort items. Lookup columns must be expanded.
+- Use `$top=<n>` to return only the first n items.
+- Use `$inlinecount=allpages` to add the total number of matching items as `__count`.
+- Use `$apply=groupby((<columns>),aggregate(<column> with <method> as <alias>))` to \
+summarise items (RavenPoint extension). Methods: `count`, `countdistinct`, `sum`, `average`, `min`, `max`.
 
 The URL parameter hierarchy is `select` > `expand` > `filter`. Any other combination may result in an error.
 
@@ -563,153 +722,74 @@ class ListByTitleItems(Resource):
   @api_namespace.response(500, 'Internal Server Error')
   def get(self, list_name):
     '''RavenPoint list items endpoint (Read)'''
-    # time.sleep(2)
-    
     # Check for invalid keywords
     request_keys = request.args.keys()
-    if any([key not in ['$select', '$filter', '$expand', '$top'] for key in request_keys]):
-      raise BadRequest('Invalid keyword(s). Use only $select, $filter, or $expand.')
+    if any([key not in list_item_keywords for key in request_keys]):
+      raise BadRequest(f"Invalid keyword(s). Use only {', '.join(list_item_keywords)}.")
+    if request.args.get('$inlinecount', 'none') not in ['allpages', 'none']:
+      raise BadRequest('Invalid $inlinecount value. Use allpages or none.')
     
     # Extract URL params
     params = parse_odata_query(request.args)
     if params:
       params['listTitle'] = list_name
 
-    # Check if list exists; get all relationships
-    with sqlite3.connect(conn_string) as conn:
+    # Read the registry and items from one consistent snapshot
+    with read_snapshot() as conn:
+      # Check if list exists; get all relationships
       all_tables = get_all_table_names(conn)
       all_rships = get_all_relationships(conn)
-    if list_name not in all_tables.table_name.tolist():
-      raise BadRequest('List does not exist.')
-
-    # Extract table metadata
-    curr_table = all_tables.loc[all_tables.table_name.eq(list_name)].to_dict('records')[0]
-    curr_db_table = curr_table['table_db_name']
-
-    # Extract table
-    with sqlite3.connect(conn_string) as conn:
-        df = pd.read_sql(f"SELECT * FROM {curr_db_table}", conn)
-    
-    # If no params are given, return all data
-    if '$select' not in request_keys and '$filter' not in request_keys and '$expand' not in request_keys:
-      return {
-        'listTitle': list_name,
-        'value': df.to_dict('records')
-      }
-    
-    # EXPAND - Get all tables in query
-    joins = {}
-    print('tables to join',joins)
-    for col in params['expand_cols']:
-      # Check if the column to expand was included in the selected columns
-      if not any([col in join_col for join_col in params['join_cols']]):
-        raise BadRequest(f"The query to field '{col}' is not valid. The $select query string must specify the target fields and the $expand query string must contain {col}.")
+      all_fields = get_all_fields(conn)
+      if list_name not in all_tables.table_name.tolist():
+        raise BadRequest('List does not exist.')
+
+      # Extract table metadata
+      curr_table = all_tables.loc[all_tables.table_name.eq(list_name)].to_dict('records')[0]
+      curr_db_table = curr_table['table_db_name']
+      # If no params are given, return all data; large lists are left to a worker process
+      if not any([key in request_keys for key in list_item_keywords]):
+        query = build_list_query(params, all_rships, curr_db_table, all_fields=all_fields)
+        if not should_offload(conn, query):
+          df = pd.read_sql(f"SELECT * FROM {curr_db_table}", conn)
+          return {
+            'listTitle': list_name,
+            'value': df.replace({np.nan: None}).to_dict('records')
+          }
+        # End the snapshot before waiting on the worker, which reads its own
+        conn.rollback()
+        body = offload_list_items(query, compile_list_query(query), {'listTitle': list_name, 'value': None})
+        return Response(body, mimetype='application/json')
       
-      # Check if relationship exists
-      print(col)
-      print('all_rships',all_rships)
-      print(all_rships.loc[all_rships.table_left.eq(curr_db_table) & \
-        all_rships.table_left_on.eq(col)].to_dict('records'))
-      rship = all_rships.loc[all_rships.table_left.eq(curr_db_table) & \
-        all_rships.table_left_on.eq(col)].to_dict('records')
-      if len(rship) == 0 or rship == []:
-        raise BadRequest(f"Relationship from field '{col}' does not exist.")
-      else:
-        joins[col] = {
-          'table': rship[0]['table_lookup'],
-          'table_pk': rship[0]['table_lookup_on'],
-          'is_multi': rship[0]['is_multi']
-        }
-
-    # Process joins data
-    for i, col in enumerate(params['join_cols']):
-      lookup_col, lookup_table_col = col.split('/')
-      if not lookup_col in params['expand_cols']:
-        raise BadRequest(f'Lookup field {lookup_col} not specified in $expand parameter.')
-      params['join_cols'][i] = params['join_cols'][i].replace(
-        lookup_col + '/', joins[lookup_col]['table'] + '.'
-      ) + f" AS '{lookup_col}__{lookup_table_col}'"
-
-    # Process filter
-    params['filter_query'] = parse_odata_filter(params['filter_query'], joins, curr_db_table)
-
-    # Add aliases to lookup tables
-    select_aliases = [f"{curr_db_table}.{col}" for col in params['main_cols']] + \
-      params['join_cols']
-    if not select_aliases :
-      select_aliases = ["*"]
-    print("",select_aliases)
-    # Prepare SQL query
-    sql_query = []
-    sql_query.append(f"SELECT {', '.join(select_aliases)}")
-    sql_query.append(f"FROM {curr_db_table}")
-
-    # If single lookup, do a left join; otherwise, left join the junction table first
-    multi_cols = []
-    for expand_col, lookup_data in joins.items():
-      lookup_table = lookup_data['table']
-      if lookup_data['is_multi'] == 0:
-        sql_query.append(f"LEFT JOIN {lookup_data['table']}" + \
-          f" ON {curr_db_table}.{expand_col} = {lookup_data['table']}.{lookup_data['table_pk']}")
-      else:
-        junction_table = f"{curr_db_table}_{lookup_data['table']}"
-        multi_cols.append(expand_col)
-        sql_query.append(
-          f"LEFT JOIN {junction_table} " + 
-          f"ON {curr_db_table}.Id = {junction_table}.{curr_db_table}_pk " +
-          f"LEFT JOIN {lookup_table} " +
-          f"ON {junction_table}.{lookup_table}_pk = {lookup_table}.Id"
-        )
-
-    if params['filter_query']:
-      sql_query.append(f"WHERE {params['filter_query']}")
-
-    # Query database and process data
-    print("conn tr",conn_string)
-    with sqlite3.connect(conn_string) as conn:
-      print(' '.join(sql_query))
-      data = pd.read_sql(' '.join(sql_query), con=conn)
-    nested_cols = data.columns[data.columns.str.contains('__', regex=False)]
-    nested_cols = list(set([col.split('__')[0] for col in nested_cols]))
-    nested_cols = [col for col in nested_cols if not col in multi_cols]
-
-    # Function to handle Id and Title
-    def clean_id_and_title(value):
-      if pd.isnull(value) or value is None:
-        return ''
-      if type(value) in [float, int]:
-        return int(value)
-      if type(value) == str:
-        return str(value)
-
-    # Process multi-lookup columns first
-    if len(multi_cols) > 0:
-      for multi_col in multi_cols:
-        sub_cols = data.columns[data.columns.str.contains(multi_col + '__')]
-        data[multi_col] = data[sub_cols].apply(lambda x: {k.replace(f'{multi_col}__', ''): clean_id_and_title(v) for k, v in zip(x.index, x.values)}, axis=1)
-        data = data.drop(sub_cols, axis=1)
-    
-      # Merge multi-lookup values
-      merge_cols = [col for col in data.columns if not col in multi_cols]
-      data = data.groupby(merge_cols).agg(lambda x: x.tolist()).reset_index()
-      for multi_col in multi_cols:
-        data[multi_col] = data[multi_col].apply(lambda x: [] if all([elem['Id'] == '' for elem in x]) else x)
-    
-    # Process single lookup columns
-    for nested_col in nested_cols:
-      sub_cols = data.columns[data.columns.str.contains(nested_col + '__')]
-      data[nested_col] = data[sub_cols].apply(lambda x: {k.replace(f'{nested_col}__', ''): clean_id_and_title(v) for k, v in zip(x.index, x.values)}, axis=1)
-      data = data.drop(sub_cols, axis=1)
+      # Build SQL query
+      query = build_list_query(params, all_rships, curr_db_table, all_fields=all_fields)
+      top = parse_odata_top(params['top'])
+      sql_query = compile_list_query(query, top)
+
+      # Query database and process data; large results are left to a worker process
+      offload = should_offload(conn, query, top)
+      if not offload:
+        data = pd.read_sql(sql_query, con=conn)
+        expansions = fetch_expansions(conn, query, data)
+        if params['inlinecount'] == 'allpages':
+          count = conn.execute(compile_count_query(query)).fetchone()[0]
 
     # Update diagnostic params
-    params['sql_query'] = ' '.join(sql_query)
-    params['joins'] = joins
+    params['sql_query'] = sql_query
+    params['joins'] = query['joins']
+
+    if offload:
+      count_query = compile_count_query(query) if params['inlinecount'] == 'allpages' else None
+      body = offload_list_items(query, sql_query, {'diagnostics': params, 'value': None}, count_query)
+      return Response(body, mimetype='application/json')
+    data = process_list_data(data, expansions)
 
     # Allow cross-origin
     output = {
       'diagnostics': params,
       'value': data.replace({np.nan: None}).to_dict('records')
     }
+    if params['inlinecount'] == 'allpages':
+      output['__count'] = count
 
     return output
   
@@ -728,37 +808,16 @@ class ListByTitleItems(Resource):
     if check_reqs.get('BadRequest'):
       raise BadRequest(check_reqs.get('BadRequest'))
     
-    # Get data types
-    df = check_reqs['data']
-    df = df.drop('Id', axis=1)
-    dtypes_lookup = df.dtypes.astype(str).to_dict()
-
-    # Prepare INSERT query
-    colnames = []
-    values_clause = []
-    for k, v in data.items():
-      if k in ['Id', '__metadata']:
-        continue
-      # Convert implicit lookup column Id
-      if (len(k) > 2) and ('/' not in k) and (k[-2:] == 'Id') and (k != 'parentKrId'):
-        k = k[:-2]
-      data_type = dtypes_lookup.get(k, 'object')
-      colnames.append(k)
-      values_clause.append(f"{v}" if ('int' in data_type or 'float' in data_type) else f"'{v}'")
-    query = f'''INSERT INTO {check_reqs.get('table')} ({', '.join(colnames)}) \
-VALUES ({', '.join(values_clause)})'''
-
-    # Run update
-    with sqlite3.connect(conn_string) as conn:
-      cursor = conn.cursor()
+    # Coerce values to the registered field types
+    colnames, values = parse_item_values(data, check_reqs['fields'])
+
+    # Run insert; the item is stamped and the change logged in the same transaction
+    with get_connection() as conn:
       try:
-        cursor.execute(query)
-        Id = cursor.lastrowid
-        conn.commit()
+        query, Id = write_list_item(conn, check_reqs.get('table'), 'Add', colnames, values)
         print(Id)
       except Exception as e:
         print(e)
-        conn.rollback()
         raise BadRequest(f'Invalid request - data does not match table schema: {e}')
     return {
     #  'data': data,
@@ -769,6 +828,39 @@ VALUES ({', '.join(values_clause)})'''
       'message': f'Successfully added item.',
     }
 
+@api_namespace.route(
+  "/web/lists/GetByTitle('<string:list_name>')/items/$count",
+  doc={'description': '''Endpoint for counting List items without retrieving them. \
+Use `$filter=<criteria>` (and `$expand=<lookup_table>` to filter on lookup columns) or \
+`$search=<terms>` to count matching items only. Returns the count as plain text.'''})
+@api_namespace.doc(params={'list_name': 'Simulated SP List Name'})
+class ListByTitleItemsCount(Resource):
+  @api_namespace.response(200, 'Success: Returns the number of matching list items.')
+  @api_namespace.response(400, 'Bad request: Invalid query.')
+  @api_namespace.response(500, 'Internal Server Error')
+  def get(self, list_name):
+    '''RavenPoint list item count endpoint'''
+    # Check for invalid keywords
+    request_keys = request.args.keys()
+    if any([key not in ['$filter', '$expand', '$search'] for key in request_keys]):
+      raise BadRequest('Invalid keyword(s). Use only $filter, $expand or $search.')
+    params = parse_odata_query(request.args)
+
+    with read_snapshot() as conn:
+      # Check if list exists; get all relationships
+      all_tables = get_all_table_names(conn)
+      all_rships = get_all_relationships(conn)
+      all_fields = get_all_fields(conn)
+      if list_name not in all_tables.table_name.tolist():
+        raise BadRequest('List does not exist.')
+      curr_table = all_tables.loc[all_tables.table_name.eq(list_name)].to_dict('records')[0]
+
+      # Count in SQL
+      query = build_list_query(params, all_rships, curr_table['table_db_name'], check_select=False,
+                               all_fields=all_fields)
+      count = conn.execute(compile_count_query(query)).fetchone()[0]
+    return Response(str(count), mimetype='text/plain')
+
 @api_namespace.route(
   "/web/lists/GetByTitle('<string:list_name>')/items(<string:item_id>)",
   doc={'description': '''Endpoint for updating List items.'''})
@@ -794,35 +886,15 @@ class UpdateListItems(Resource):
       if check_reqs.get('BadRequest'):
         raise BadRequest(check_reqs.get('BadRequest'))
       
-      # Get data types
-      df = check_reqs['data']
-      df = df.drop('Id', axis=1)
-      dtypes_lookup = df.dtypes.astype(str).to_dict()
-
-      # Prepare UPDATE query
-      set_clause = []
-      for k, v in data.items():
-        if k in ['Id', '__metadata']:
-          continue
-        # Convert implicit lookup column Id
-        if (len(k) > 2) and ('/' not in k) and (k[-2:] == 'Id') and (k != 'parentKrId'):
-          k = k[:-2]
-        data_type = dtypes_lookup.get(k, 'object')
-        set_clause.append(f"{k} = {v}" if ('int' in data_type or 'float' in data_type) else f"{k} = '{v}'")
-      query = f'''UPDATE {check_reqs.get('table')} \
-  SET {', '.join(set_clause)} \
-  WHERE Id = {item_id}'''
-
-      # Run update
-      with sqlite3.connect(conn_string) as conn:
-        cursor = conn.cursor()
+      # Coerce values to the registered field types
+      colnames, values = parse_item_values(data, check_reqs['fields'])
+
+      # Run update; the item is stamped and the change logged in the same transaction
+      with get_connection() as conn:
         try:
-          cursor.execute(query)
-          Id = cursor.lastrowid
-          conn.commit()
+          query, Id = write_list_item(conn, check_reqs.get('table'), 'Update', colnames, values, int(item_id))
 
         except Exception as e:
-          conn.rollback()
           raise BadRequest(f'Invalid request - data does not match table schema: {e}')
       return {
         # 'data': data,
@@ -838,16 +910,11 @@ class UpdateListItems(Resource):
       if check_reqs.get('BadRequest'):
         raise BadRequest(check_reqs.get('BadRequest'))
 
-      # Create query
-      query = f'''DELETE FROM {check_reqs.get('table')} WHERE Id = {item_id}'''
-      # Run update
-      with sqlite3.connect(conn_string) as conn:
-        cursor = conn.cursor()
+      # Run delete and log the change
+      with get_connection() as conn:
         try:
-          cursor.execute(query)
-          conn.commit()
+          query, _ = write_list_item(conn, check_reqs.get('table'), 'Delete', item_id=int(item_id))
         except Exception as e:
-          conn.rollback()
           raise BadRequest(f'Invalid request - could not delete item: {e}')
       return {
         # 'data': data,
@@ -858,8 +925,12 @@ class UpdateListItems(Resource):
       }
     
 
-@api_namespace.route("/web/GetFolderByServerRelativeUrl('Shared Documents')/Files('<string:file_name>')/$value",doc={"description":'''Endpoint for retrieving files form ravenpoint'''})
+@api_namespace.route(
+  "/web/GetFolderByServerRelativeUrl('<path:folder_url>')/Files('<string:file_name>')/$value",
+  "/web/GetFolderByServerRelativeUrl('/<path:folder_url>')/Files('<string:file_name>')/$value",
+  doc={"description":'''Endpoint for retrieving files form ravenpoint'''})
 @api_namespace.doc(params={
+  "folder_url":"Server relative URL of the folder, e.g. Shared Documents",
   "file_name":"Name of simulated file in ravenpoint"
 })
 
@@ -867,17 +938,124 @@ class GetFile(Resource):
 
 
   @api_namespace.doc(security='X-RequestDigest')
-  def get(self,file_name):
-    folder = "/project/data/documents"
-    curdir = os.path.abspath(os.getcwd())
-    fulldir = curdir.replace('''\\''',"/") + folder
+  def get(self,folder_url,file_name):
     headers = request.headers
-    check_reqs = validate_file_query(headers,file_name)
+    check_reqs = validate_file_query(headers,file_name,normalize_folder(folder_url))
     if check_reqs.get('BadRequest'):
       raise BadRequest(check_reqs.get('BadRequest'))
     else:
-       return send_from_directory(fulldir,file_name)
-  
+      # Conditional GET and Range requests are answered by send_file; the content
+      # hash from the document index is the ETag, and the file body is streamed
+      # through the server's file wrapper (sendfile where available)
+      document = check_reqs['document']
+      return send_file(
+        get_blob_path(document.hash),
+        download_name=document.name,
+        conditional=True,
+        etag=document.hash,
+        max_age=0
+      )
+
+
+@api_namespace.route(
+  "/web/GetFolderByServerRelativeUrl('<path:folder_url>')/Files",
+  "/web/GetFolderByServerRelativeUrl('/<path:folder_url>')/Files",
+  doc={"description":'''Endpoint for listing the files in a folder'''})
+@api_namespace.doc(params={"folder_url":"Server relative URL of the folder, e.g. Shared Documents"})
+class FolderFiles(Resource):
+  def get(self,folder_url):
+    '''RavenPoint folder files endpoint'''
+    documents, _ = list_folder(normalize_folder(folder_url))
+    return {'value': [get_file_metadata(document) for document in documents]}
+
+
+@api_namespace.route(
+  "/web/GetFolderByServerRelativeUrl('<path:folder_url>')/Folders",
+  "/web/GetFolderByServerRelativeUrl('/<path:folder_url>')/Folders",
+  doc={"description":'''Endpoint for listing the subfolders of a folder'''})
+@api_namespace.doc(params={"folder_url":"Server relative URL of the folder, e.g. Shared Documents"})
+class FolderFolders(Resource):
+  def get(self,folder_url):
+    '''RavenPoint folder subfolders endpoint'''
+    folder = normalize_folder(folder_url)
+    _, subfolders = list_folder(folder)
+    return {'value': [
+      {'Name': subfolder, 'ServerRelativeUrl': f'/{folder}/{subfolder}'} for subfolder in subfolders
+    ]}
+
+
+@api_namespace.route(
+  "/web/GetFolderByServerRelativeUrl('<path:folder_url>')/Files/add(url='<string:file_name>',overwrite=<string:overwrite>)",
+  "/web/GetFolderByServerRelativeUrl('/<path:folder_url>')/Files/add(url='<string:file_name>',overwrite=<string:overwrite>)",
+  "/web/GetFolderByServerRelativeUrl('<path:folder_url>')/Files/add(url='<string:file_name>')",
+  "/web/GetFolderByServerRelativeUrl('/<path:folder_url>')/Files/add(url='<string:file_name>')",
+  doc={"description":'''Endpoint for uploading a file into a folder. Send the file contents as the \
+request body. Existing files are only replaced when `overwrite=true`.'''})
+@api_namespace.doc(params={
+  "folder_url":"Server relative URL of the folder, e.g. Shared Documents",
+  "file_name":"Name of the file to create"
+})
+class AddFile(Resource):
+  @api_namespace.doc(security='X-RequestDigest')
+  def post(self,folder_url,file_name,overwrite='false'):
+    '''RavenPoint file upload endpoint'''
+    if request.headers.get('X-RequestDigest') is None:
+      raise BadRequest("No token provided. Unable to 'authenticate' request.")
+    folder = normalize_folder(folder_url)
+    if overwrite.lower() != 'true' and get_document(folder, file_name) is not None:
+      raise BadRequest(f'A file with the name {folder}/{file_name} already exists.')
+    document = store_document(folder, file_name, request.stream)
+    return {'d': get_file_metadata(document)}
+
+
+@api_namespace.route(
+  "/web/GetFileByServerRelativeUrl('<path:file_url>')/StartUpload(uploadId=guid'<string:upload_id>')",
+  "/web/GetFileByServerRelativeUrl('/<path:file_url>')/StartUpload(uploadId=guid'<string:upload_id>')",
+  doc={"description":'''Endpoint for starting a chunked file upload with the first chunk as the request body'''})
+@api_namespace.doc(params={"file_url":"Server relative URL of the file", "upload_id":"Upload session GUID"})
+class StartUpload(Resource):
+  @api_namespace.doc(security='X-RequestDigest')
+  def post(self,file_url,upload_id):
+    '''RavenPoint chunked upload endpoint (Start)'''
+    if request.headers.get('X-RequestDigest') is None:
+      raise BadRequest("No token provided. Unable to 'authenticate' request.")
+    return {'d': {'StartUpload': str(append_upload_chunk(upload_id, request.stream))}}
+
+
+@api_namespace.route(
+  "/web/GetFileByServerRelativeUrl('<path:file_url>')/ContinueUpload(uploadId=guid'<string:upload_id>',fileOffset=<int:file_offset>)",
+  "/web/GetFileByServerRelativeUrl('/<path:file_url>')/ContinueUpload(uploadId=guid'<string:upload_id>',fileOffset=<int:file_offset>)",
+  doc={"description":'''Endpoint for appending a chunk to a chunked file upload'''})
+@api_namespace.doc(params={"file_url":"Server relative URL of the file", "upload_id":"Upload session GUID",
+  "file_offset":"Number of bytes uploaded so far"})
+class ContinueUpload(Resource):
+  @api_namespace.doc(security='X-RequestDigest')
+  def post(self,file_url,upload_id,file_offset):
+    '''RavenPoint chunked upload endpoint (Continue)'''
+    if request.headers.get('X-RequestDigest') is None:
+      raise BadRequest("No token provided. Unable to 'authenticate' request.")
+    return {'d': {'ContinueUpload': str(append_upload_chunk(upload_id, request.stream, file_offset))}}
+
+
+@api_namespace.route(
+  "/web/GetFileByServerRelativeUrl('<path:file_url>')/FinishUpload(uploadId=guid'<string:upload_id>',fileOffset=<int:file_offset>)",
+  "/web/GetFileByServerRelativeUrl('/<path:file_url>')/FinishUpload(uploadId=guid'<string:upload_id>',fileOffset=<int:file_offset>)",
+  doc={"description":'''Endpoint for finishing a chunked file upload with the last chunk as the request body'''})
+@api_namespace.doc(params={"file_url":"Server relative URL of the file", "upload_id":"Upload session GUID",
+  "file_offset":"Number of bytes uploaded so far"})
+class FinishUpload(Resource):
+  @api_namespace.doc(security='X-RequestDigest')
+  def post(self,file_url,upload_id,file_offset):
+    '''RavenPoint chunked upload endpoint (Finish)'''
+    if request.headers.get('X-RequestDigest') is None:
+      raise BadRequest("No token provided. Unable to 'authenticate' request.")
+    file_url = normalize_folder(file_url)
+    if '/' not in file_url:
+      raise BadRequest('Invalid file URL. Use /<folder>/<file name>.')
+    folder, file_name = file_url.rsplit('/', 1)
+    document = finish_upload(upload_id, folder, file_name, request.stream, file_offset)
+    return {'d': get_file_metadata(document)}
+
 
 @api_namespace.route("/web/getuserbyid('<int:Id>')",doc={"description":'''Endpoint for retrieving simulated user by id from ravenpoint'''})
 @api_namespace.doc(params={
@@ -886,96 +1064,101 @@ class GetFile(Resource):
 class getuserbyid(Resource):
   @api_namespace.doc(security='X-RequestDigest')
   def get(self,Id):
-      with sqlite3.connect(conn_string) as conn:
+      with read_snapshot() as conn:
         try:
-          df = pd.read_sql_query("SELECT * FROM rpusers WHERE Id = {}".format(Id),conn)
-          data = df.to_dict('records')
-          if data == []:
-            raise BadRequest(f'User does not exist')
-          else:
-            return data[0]
+          user = get_user_by_id(conn, Id)
         except Exception as e:
-          conn.rollback()
           raise BadRequest(f'Error retrieving user {e}')
+      if user is None:
+        raise BadRequest(f'User does not exist')
+      return user
 
 
 @api_namespace.route("/web/currentUser",doc={"description":'''Endpoint for retrieving current simulated user from ravenpoint will return first user in rpusers table'''})
 class currentUser(Resource):
   @api_namespace.doc(security='X-RequestDigest')
   def get(self):
-      with sqlite3.connect(conn_string) as conn:
+      with read_snapshot() as conn:
         try:
-          df = pd.read_sql_query("SELECT * FROM rpusers WHERE Id = {}".format(1),conn)
-          data = df.to_dict('records')
-          if data == []:
-            raise BadRequest(f'No users exist in rpusers table please create a user')
-          else:
-            return data[0]
+          user = get_current_user(conn)
         except Exception as e:
-          conn.rollback()
           raise BadRequest(f'Error retrieving user {e}')
+      if user is None:
+        raise BadRequest(f'No users exist in rpusers table please create a user')
+      return user
         
 
-@api_namespace.route("/web/SiteUsers",doc={"description":'''Endpoint for retrieving all users in a sharepoint site'''})
-class currentUser(Resource):
+@api_namespace.route("/web/SiteUsers", "/web/siteusers",doc={"description":'''Endpoint for retrieving all users in a sharepoint site'''})
+class SiteUsers(Resource):
   @api_namespace.doc(security='X-RequestDigest')
   def get(self):
-      # Check for invalid keywords
-    list_name = "rpusers"
+    # Check for invalid keywords
+    list_name = users_table
     request_keys = request.args.keys()
-    if any([key not in ['$select', '$filter', '$expand', '$top'] for key in request_keys]):
-      raise BadRequest('Invalid keyword(s). Use only $select, $filter, or $expand.')
+    if any([key not in user_keywords for key in request_keys]):
+      raise BadRequest(f"Invalid keyword(s). Use only {', '.join(user_keywords)}.")
     
     params = parse_odata_query(request.args)
     if params:
-      params['listTitle'] = "rpusers"
-
-    # with sqlite3.connect(conn_string) as conn:
-    #   all_tables = get_all_table_names(conn)
-    #   all_rships = get_all_relationships(conn)
-    # print(curr_table['table_db_name'])
-    # if list_name not in all_tables.table_name.tolist():
-    #   raise BadRequest('List does not exist.')
-    # # Extract table metadata
-    # curr_table = all_tables.loc[all_tables.table_name.eq(list_name)].to_dict('records')[0]
-    # curr_db_table = curr_table['table_db_name']
-    with sqlite3.connect(conn_string) as conn:
+      params['listTitle'] = list_name
+
+    with read_snapshot() as conn:
       try:
-        df = pd.read_sql_query("SELECT * FROM rpusers",conn)
-        data = df.to_dict('records')
+        # If no params are given, return all users
+        if not any([key in request_keys for key in user_keywords]):
+          data = pd.read_sql_query(f"SELECT * FROM {users_table}", conn)
+        else:
+          query = build_list_query(params, get_all_relationships(conn), users_table)
+          top = parse_odata_top(params['top'])
+          data = pd.read_sql_query(compile_list_query(query, top), conn)
+      except BadRequest:
+        raise
       except Exception as e:
-          conn.rollback()
-          raise BadRequest(f'Error retrieving user infomation {e}')
-    
-    if '$select' not in request_keys and '$filter' not in request_keys and '$expand' not in request_keys:
-          return {
-        'listTitle': list_name,
-        'value': data
-      }
-    joins = {}
-     # Process filter
-    params['filter_query'] = parse_odata_filter(params['filter_query'], joins, list_name)
-    sql_query = []
-    sql_query.append(f"SELECT * ")
-    sql_query.append(f"FROM {list_name}")
-    if params['filter_query']:
-      sql_query.append(f"WHERE {params['filter_query']}")
-    print(" ".join(sql_query))
-    with sqlite3.connect(conn_string) as conn:
-     try:
-        df = pd.read_sql_query(" ".join(sql_query),conn)
-        data = df.to_dict('records')
-        return {
-        'listTitle': list_name,
-        'value': data
-      }
-     except Exception as e:
-          conn.rollback()
-          raise BadRequest(f'Error retrieving user infomation {e}')
+        raise BadRequest(f'Error retrieving user infomation {e}')
+    return {
+      'listTitle': list_name,
+      'value': data.replace({np.nan: None}).to_dict('records')
+    }
 
 
+@api_namespace.route("/web/siteusers/getbyemail('<string:email>')", "/web/SiteUsers/getByEmail('<string:email>')",
+  doc={"description":'''Endpoint for retrieving a simulated user by email'''})
+@api_namespace.doc(params={
+  "email":"Email of simulated user in ravenpoint"
+})
+class SiteUserByEmail(Resource):
+  @api_namespace.doc(security='X-RequestDigest')
+  def get(self, email):
+    with read_snapshot() as conn:
+      try:
+        user = get_user_by_email(conn, email)
+      except Exception as e:
+        raise BadRequest(f'Error retrieving user {e}')
+    if user is None:
+      raise BadRequest(f'User does not exist')
+    return user
 
 
+@api_namespace.route("/web/ensureuser", "/web/ensureuser('<string:logon_name>')",
+  doc={"description":'''Endpoint for resolving a logon name to a simulated user, creating the user if needed'''})
+class EnsureUser(Resource):
+  @api_namespace.doc(security='X-RequestDigest')
+  def post(self, logon_name=None):
+    if request.headers.get('X-RequestDigest') is None:
+      raise BadRequest("No token provided. Unable to 'authenticate' request.")
+    if logon_name is None:
+      data = request.get_json(silent=True) or {}
+      logon_name = data.get('logonName')
+    if not logon_name:
+      raise BadRequest('No logonName provided.')
+    with get_connection() as conn:
+      try:
+        return ensure_user(conn, logon_name)
+      except BadRequest:
+        raise
+      except Exception as e:
+        raise BadRequest(f'Error ensuring user {e}')
+
 
 @api_namespace.route("/SP.Utilities.Utility.SendEmail",doc={"description":'''Endpoint for simulating sending emails from ravenpoint'''})
 class currentUser(Resource):
@@ -987,13 +1170,9 @@ class currentUser(Resource):
      Email_To = data["properties"]["To"]["results"]
      Email_Body = data["properties"]["Body"]
      Email_Subject = data["properties"]["Subject"]
-     msg = Message(
-                  sender=Email_From,
-                  recipients=Email_To)
-     msg.body = Email_Body
-     msg.subject = Email_Subject
-     mail.send(msg)
-     return "email sent"
+     # Delivery happens on the outbox sender thread
+     email = enqueue_email(Email_From, Email_To, Email_Subject, Email_Body)
+     return "email queued (id {})".format(email.id)
      
      
 
@@ -0,0 +1,216 @@
+# RAVENPOINT ASGI APP
+# Usage: uvicorn project.asgi:application --host 0.0.0.0 --port 5000
+# Flask handlers run unchanged in a bounded thread pool, so SQLite and file I/O stay off the
+# event loop. Request bodies are read and responses are sent from the loop, one chunk at a
+# time, so slow clients hold no thread; event streams are served natively and hold none at all.
+# Performance profile delays (latency, bandwidth caps) are timers on the loop, not sleeping threads
+import asyncio
+import contextvars
+import json
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from project import app
+from project.api import ListSubscribe, ListByTitleSubscribe, open_subscription
+from project.database import split_site_path, use_site
+from project.events import stream_events_async
+from project.profiles import plan_request, get_resource_name
+from project.throttle import client_header, throttle
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RoutingException
+from werkzeug.wsgi import FileWrapper
+
+app.config.setdefault('ASGI_THREADS', 16)
+app.config.setdefault('ASGI_CHUNK_SIZE', 256 * 1024)
+app.config.setdefault('ASGI_SPOOL_SIZE', 1024 * 1024)
+
+_executor = ThreadPoolExecutor(max_workers=app.config['ASGI_THREADS'], thread_name_prefix='ravenpoint-asgi')
+
+# Function to run a blocking call in the thread pool, in the caller's context (e.g. its site)
+async def run_sync(func, *args):
+  context = contextvars.copy_context()
+  return await asyncio.get_running_loop().run_in_executor(_executor, context.run, func, *args)
+
+# Function to read the request body; large bodies spill to a temporary file
+async def read_body(receive):
+  body = tempfile.SpooledTemporaryFile(max_size=app.config['ASGI_SPOOL_SIZE'])
+  more_body = True
+  while more_body:
+    message = await receive()
+    if message['type'] == 'http.disconnect':
+      break
+    body.write(message.get('body', b''))
+    more_body = message.get('more_body', False)
+  body.seek(0)
+  return body
+
+# Function to build a WSGI environ from an ASGI scope
+def build_environ(scope, body):
+  server = scope.get('server') or ('localhost', 80)
+  environ = {
+    'REQUEST_METHOD': scope['method'],
+    'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+    'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+    'QUERY_STRING': scope['query_string'].decode('latin1'),
+    'SERVER_NAME': server[0],
+    'SERVER_PORT': str(server[1]),
+    'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+    'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+    'wsgi.version': (1, 0),
+    'wsgi.url_scheme': scope.get('scheme', 'http'),
+    'wsgi.input': body,
+    # The body is read in full, so chunked requests without a Content-Length are read to the end
+    'wsgi.input_terminated': True,
+    'wsgi.errors': sys.stderr,
+    'wsgi.multithread': True,
+    'wsgi.multiprocess': False,
+    'wsgi.run_once': False,
+    # Files are read in large blocks, one pool call per block
+    'wsgi.file_wrapper': lambda file, buffer_size=8192: FileWrapper(file, max(buffer_size, app.config['ASGI_CHUNK_SIZE']))
+  }
+  for name, value in scope['headers']:
+    name = name.decode('latin1').upper().replace('-', '_')
+    key = name if name in ['CONTENT_TYPE', 'CONTENT_LENGTH'] else f'HTTP_{name}'
+    environ[key] = f"{environ[key]},{value.decode('latin1')}" if key in environ else value.decode('latin1')
+  return environ
+
+# Function to serve a request with the Flask app, with the bandwidth cap of a profile plan
+# The handler and each response chunk are produced in the pool; sending happens on the loop
+async def serve_wsgi(scope, receive, send, plan=None):
+  body = await read_body(receive)
+  bandwidth = plan and plan['bandwidth']
+  response = {}
+
+  def start_response(status, headers, exc_info=None):
+    response['status'] = int(status.split(' ', 1)[0])
+    response['headers'] = [(key.lower().encode('latin1'), value.encode('latin1')) for key, value in headers]
+    return lambda data: None
+
+  async def send_chunk(chunk, more_body=True):
+    if 'started' not in response:
+      response['started'] = True
+      await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+    chunk_size = app.config['ASGI_CHUNK_SIZE']
+    for start in range(0, len(chunk), chunk_size):
+      await send({'type': 'http.response.body', 'body': chunk[start:start + chunk_size], 'more_body': True})
+      if bandwidth:
+        await asyncio.sleep(len(chunk[start:start + chunk_size]) / bandwidth)
+    if not more_body:
+      await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+  environ = build_environ(scope, body)
+  # The plan has been applied here; the WSGI profile middleware passes the request through
+  environ['ravenpoint.profile'] = plan
+  iterable = await run_sync(app, environ, start_response)
+  try:
+    iterator = iter(iterable)
+    while True:
+      chunk = await run_sync(next, iterator, None)
+      if chunk is None:
+        break
+      if chunk:
+        await send_chunk(chunk)
+    await send_chunk(b'', more_body=False)
+  finally:
+    if hasattr(iterable, 'close'):
+      await run_sync(iterable.close)
+    body.close()
+
+# Function to send a JSON error in the same shape as the API
+async def send_error(send, error):
+  body = json.dumps({'message': error.description}).encode()
+  headers = [(key.lower().encode('latin1'), value.encode('latin1')) for key, value in error.get_headers()
+             if key.lower() != 'content-type']
+  await send({'type': 'http.response.start', 'status': error.code, 'headers': [
+    (b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')] + headers})
+  await send({'type': 'http.response.body', 'body': body})
+
+# Function to serve a list change event stream without a thread per subscriber
+async def serve_subscribe(scope, receive, send, endpoint, values):
+  if 'list_id' in values:
+    match_table = lambda all_tables: all_tables.id.eq(values['list_id'])
+  else:
+    match_table = lambda all_tables: all_tables.table_name.eq(values['list_name'])
+  args = MultiDict(parse_qsl(scope['query_string'].decode('latin1'), keep_blank_values=True))
+  headers = Headers([(key.decode('latin1'), value.decode('latin1')) for key, value in scope['headers']])
+  try:
+    await run_sync(throttle, headers.get(client_header, (scope.get('client') or ('', 0))[0]), endpoint)
+    subscriber, replay, last_token = await run_sync(open_subscription, match_table, args, headers,
+                                                    asyncio.get_running_loop())
+  except HTTPException as e:
+    await send_error(send, e)
+    return
+
+  async def send_events():
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+      (b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+      (b'x-accel-buffering', b'no'), (b'access-control-allow-origin', b'*')]})
+    async for frame in stream_events_async(subscriber, replay, last_token):
+      await send({'type': 'http.response.body', 'body': frame.encode(), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+  async def wait_disconnect():
+    while (await receive())['type'] != 'http.disconnect':
+      pass
+
+  # Whichever finishes first cancels the other; cancelling the stream unsubscribes
+  tasks = [asyncio.ensure_future(send_events()), asyncio.ensure_future(wait_disconnect())]
+  try:
+    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+  finally:
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+# Routes served natively, by the Resource class that Flask would dispatch to
+native_routes = {
+  ListSubscribe: serve_subscribe,
+  ListByTitleSubscribe: serve_subscribe
+}
+
+# Function to find the endpoint of a request, and its native handler if any, using the Flask URL map
+# Site collections are matched on the path without their site, as the WSGI app does
+def match_native_route(scope):
+  site, path = split_site_path(scope['path'])
+  try:
+    endpoint, values = app.url_map.bind('localhost', script_name=scope.get('root_path') or None) \
+      .match(path, method=scope['method'])
+  except (HTTPException, RoutingException):
+    return None, None, None, None
+  view_class = getattr(app.view_functions.get(endpoint), 'view_class', None)
+  return native_routes.get(view_class), endpoint, values, site
+
+async def application(scope, receive, send):
+  if scope['type'] == 'lifespan':
+    while True:
+      message = await receive()
+      if message['type'] == 'lifespan.startup':
+        await send({'type': 'lifespan.startup.complete'})
+      elif message['type'] == 'lifespan.shutdown':
+        _executor.shutdown(wait=False)
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+  if scope['type'] != 'http':
+    return
+  handler, endpoint, values, site = match_native_route(scope)
+  # Apply the performance profile, if any, without holding a thread
+  profile_name = dict(scope['headers']).get(b'x-ravenpoint-profile', b'').decode('latin1') or None
+  try:
+    plan = plan_request(profile_name, get_resource_name(endpoint))
+  except HTTPException as e:
+    await send_error(send, e)
+    return
+  if plan is not None:
+    if plan['latency']:
+      await asyncio.sleep(plan['latency'])
+    if plan['error'] is not None:
+      await send_error(send, plan['error'])
+      return
+  if handler is not None:
+    with use_site(site):
+      await handler(scope, receive, send, endpoint, values)
+  else:
+    await serve_wsgi(scope, receive, send, plan)
@@ -0,0 +1,399 @@
+# RAVENPOINT CLI
+# Usage: flask ravenpoint seed --rows 1000000
+#        flask ravenpoint snapshot save fixtures.tar.gz
+#        flask ravenpoint snapshot restore fixtures.tar.gz
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+from flask.cli import AppGroup
+from project import app, db
+from project.models import Table, Relationship, Document
+from project.database import get_connection, use_site, site_pattern
+from project.utils import get_all_table_names, swap_shadow_table, build_junction_table, \
+  create_table_sql, register_fields, index_datetime_fields, build_search_index, record_change, users_table, \
+  get_blob_path, get_documents_folder, import_legacy_documents
+from werkzeug.utils import secure_filename
+
+ravenpoint_cli = AppGroup('ravenpoint', help='RavenPoint maintenance commands.')
+
+# Column types supported by the seed spec and their field types
+seed_column_types = {
+  'title': 'Text',
+  'text': 'Text',
+  'choice': 'Text',
+  'integer': 'Integer',
+  'float': 'Number',
+  'boolean': 'Boolean',
+  'datetime': 'DateTime'
+}
+
+# Default spec: objectives -> key results -> tags, scaled by the CLI options
+def default_seed_spec(rows, fanout, multi_min, multi_max):
+  return {
+    'lists': [
+      {
+        'name': 'Seed Objectives',
+        'rows': max(rows // fanout, 1),
+        'columns': [
+          {'name': 'Title', 'type': 'title'},
+          {'name': 'owner', 'type': 'choice', 'choices': ['Ops', 'Manpower', 'Training', 'Intel', 'Engineering', 'Safety']},
+          {'name': 'dueDate', 'type': 'datetime'}
+        ]
+      },
+      {
+        'name': 'Seed Tags',
+        'rows': 50,
+        'columns': [{'name': 'Title', 'type': 'title'}]
+      },
+      {
+        'name': 'Seed Key Results',
+        'rows': rows,
+        'columns': [
+          {'name': 'Title', 'type': 'title'},
+          {'name': 'description', 'type': 'text', 'search': True},
+          {'name': 'target', 'type': 'integer', 'min': 1, 'max': 1000},
+          {'name': 'progress', 'type': 'float', 'min': 0, 'max': 1},
+          {'name': 'isComplete', 'type': 'boolean'},
+          {'name': 'dueDate', 'type': 'datetime'}
+        ],
+        'lookups': [
+          {'name': 'parentObjective', 'list': 'Seed Objectives'},
+          {'name': 'tags', 'list': 'Seed Tags', 'multi': True, 'min': multi_min, 'max': multi_max}
+        ]
+      }
+    ]
+  }
+
+# Function to order lists so that lookup targets are generated first
+def sort_seed_lists(lists):
+  names = [item['name'] for item in lists]
+  ordered, pending = [], list(lists)
+  while pending:
+    ready = [item for item in pending if all([lookup['list'] not in names or \
+      lookup['list'] in [done['name'] for done in ordered] for lookup in item.get('lookups', [])])]
+    if not ready:
+      raise click.ClickException('Lookups in the seed spec form a cycle.')
+    ordered.extend(ready)
+    pending = [item for item in pending if item not in ready]
+  return ordered
+
+# Function to generate values for one column
+def generate_column(rng, column, ids, list_name):
+  n = len(ids)
+  col_type = column.get('type', 'text')
+  if col_type == 'title':
+    prefix = column.get('prefix', list_name)
+    return pd.Series(ids).astype(str).radd(f'{prefix} ').values
+  if col_type == 'text':
+    words = np.array(column.get('words', ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel']))
+    text = pd.Series(words[rng.integers(0, len(words), n)])
+    for _ in range(column.get('length', 4) - 1):
+      text = text + ' ' + words[rng.integers(0, len(words), n)]
+    return text.values
+  if col_type == 'choice':
+    choices = np.array(column['choices'])
+    return choices[rng.integers(0, len(choices), n)]
+  if col_type == 'integer':
+    return rng.integers(column.get('min', 0), column.get('max', 1000) + 1, n)
+  if col_type == 'float':
+    low, high = column.get('min', 0), column.get('max', 100)
+    return np.round(rng.random(n) * (high - low) + low, 4)
+  if col_type == 'boolean':
+    return rng.integers(0, 2, n)
+  if col_type == 'datetime':
+    start = np.datetime64(column.get('start', '2020-01-01'), 's')
+    end = np.datetime64(column.get('end', '2025-12-31'), 's')
+    offsets = rng.integers(0, int((end - start).astype(np.int64)), n)
+    return np.datetime_as_string(start + offsets.astype('timedelta64[s]'), unit='s', timezone='UTC')
+  raise click.ClickException(f"Unknown column type '{col_type}'.")
+
+# Function to generate comma-separated multi-lookup Ids
+# Per-row counts are drawn at once, then values are sorted, de-duplicated and joined per row
+# with reduceat instead of a Python loop over rows
+def generate_multi_lookup(rng, n, n_lookup, min_count, max_count):
+  counts = rng.integers(min_count, max_count + 1, n)
+  rows = np.repeat(np.arange(n), counts)
+  values = rng.integers(1, n_lookup + 1, len(rows))
+  order = np.lexsort((values, rows))
+  rows, values = rows[order], values[order]
+  keep = np.ones(len(rows), dtype=bool)
+  keep[1:] = (rows[1:] != rows[:-1]) | (values[1:] != values[:-1])
+  rows, values = rows[keep], values[keep]
+
+  output = np.full(n, None, dtype=object)
+  if len(rows) > 0:
+    tokens = (values.astype(str).astype(object) + ',')
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    output[rows[starts]] = pd.Series(np.add.reduceat(tokens, starts)).str[:-1].values
+  return output
+
+# Function to check a --site option
+def validate_site(ctx, param, value):
+  if value is not None and not re.fullmatch(site_pattern, value):
+    raise click.BadParameter('Use letters, digits, hyphens and underscores only.')
+  return value
+
+# Function to get the field types of a list in the spec
+def get_seed_fields(spec, lookup_db_names):
+  fields = {'Id': 'Counter'}
+  for column in spec.get('columns', []):
+    if column.get('type', 'text') not in seed_column_types:
+      raise click.ClickException(f"Unknown column type '{column.get('type')}'. Use one of {', '.join(seed_column_types)}.")
+    fields[column['name']] = seed_column_types[column.get('type', 'text')]
+  for lookup in spec.get('lookups', []):
+    fields[lookup['name']] = 'LookupMulti' if lookup.get('multi', False) else \
+      'User' if lookup_db_names.get(lookup['list']) == users_table else 'Lookup'
+  return fields
+
+# Function to generate one chunk of a list
+def generate_chunk(rng, spec, start, n, lookup_rows):
+  ids = np.arange(start + 1, start + n + 1)
+  data = {'Id': ids}
+  for column in spec.get('columns', []):
+    data[column['name']] = generate_column(rng, column, ids, spec['name'])
+  for lookup in spec.get('lookups', []):
+    n_lookup = lookup_rows[lookup['list']]
+    if lookup.get('multi', False):
+      data[lookup['name']] = generate_multi_lookup(rng, n, n_lookup, lookup.get('min', 0), lookup.get('max', 3))
+    else:
+      data[lookup['name']] = rng.integers(1, n_lookup + 1, n)
+  return pd.DataFrame(data)
+
+# Function to generate the lists of a seed spec and load them into the database
+def seed_lists(spec, chunk_size=500000, random_seed=None):
+  rng = np.random.default_rng(random_seed)
+  lists = sort_seed_lists(spec['lists'])
+
+  with get_connection() as conn:
+    conn.execute('PRAGMA synchronous=NORMAL')
+
+    # Row counts of lookup targets; lists outside the spec must already be registered
+    all_tables = get_all_table_names(conn)
+    lookup_rows = {item['name']: item['rows'] for item in lists}
+    for lookup in [lookup for item in lists for lookup in item.get('lookups', [])]:
+      if lookup['list'] in lookup_rows:
+        continue
+      existing = all_tables.loc[all_tables.table_name.eq(lookup['list'])].to_dict('records')
+      if len(existing) == 0:
+        raise click.ClickException(f"Lookup list '{lookup['list']}' is not in the spec or the database.")
+      lookup_rows[lookup['list']] = conn.execute(f"SELECT MAX(Id) FROM {existing[0]['table_db_name']}").fetchone()[0] or 1
+
+    # Write each list to a shadow table in bulk, then swap it in
+    db_names = {item['name']: secure_filename(item['name']).lower() for item in lists}
+    lookup_db_names = {**dict(zip(all_tables.table_name, all_tables.table_db_name)), **db_names}
+    for item in lists:
+      started = time.time()
+      table_db_name = db_names[item['name']]
+      shadow_table = f'{table_db_name}__shadow'
+      fields = get_seed_fields(item, lookup_db_names)
+      conn.execute(f'DROP TABLE IF EXISTS {shadow_table}')
+      conn.execute(create_table_sql(shadow_table, fields))
+      for start in range(0, item['rows'], chunk_size):
+        df = generate_chunk(rng, item, start, min(chunk_size, item['rows'] - start), lookup_rows)
+        df.to_sql(shadow_table, con=conn, if_exists='append', index=False)
+      conn.commit()
+      swap_shadow_table(conn, table_db_name)
+      record_change(conn, table_db_name, None, 'Reset')
+      register_fields(conn, table_db_name, fields)
+      index_datetime_fields(conn, table_db_name, fields)
+      search_columns = [column['name'] for column in item.get('columns', []) if column.get('search', False)]
+      if search_columns:
+        conn.execute(f"UPDATE columns SET searchable = 1 WHERE table_db_name = ? \
+AND column_name IN ({', '.join(['?'] * len(search_columns))})", (table_db_name, *search_columns))
+        conn.commit()
+      build_search_index(conn, table_db_name)
+      db.session.merge(Table(item['name'], table_db_name))
+      db.session.commit()
+      elapsed = time.time() - started
+      click.echo(f"{item['name']}: {item['rows']} rows in {elapsed:.1f}s ({item['rows'] / max(elapsed, 1e-6):,.0f} rows/s)")
+
+    # Register relationships
+    for item in lists:
+      for lookup in item.get('lookups', []):
+        table_lookup = lookup_db_names[lookup['list']]
+        Relationship.query.filter_by(table_left=db_names[item['name']], table_left_on=lookup['name']).delete()
+        db.session.add(Relationship(db_names[item['name']], lookup['name'], table_lookup, 'Id',
+                                    lookup.get('multi', False), 'Generated by ravenpoint seed'))
+    db.session.commit()
+
+    # Rebuild junction tables for multi-lookups on the seeded lists
+    for table_db_name in db_names.values():
+      for rship in Relationship.query.filter_by(table_left=table_db_name, is_multi=True).all():
+        started = time.time()
+        build_junction_table(conn, rship.table_left, rship.table_left_on, rship.table_lookup)
+        click.echo(f'{rship.table_left}_{rship.table_lookup}: junction table built in {time.time() - started:.1f}s')
+
+
+@ravenpoint_cli.command('seed')
+@click.option('--spec', 'spec_file', type=click.Path(exists=True, dir_okay=False), help='JSON file describing the lists to generate.')
+@click.option('--rows', default=100000, show_default=True, help='Rows in the largest list (default spec only).')
+@click.option('--fanout', default=10, show_default=True, help='Child rows per lookup row (default spec only).')
+@click.option('--multi-min', default=0, show_default=True, help='Minimum multi-lookup values per row (default spec only).')
+@click.option('--multi-max', default=3, show_default=True, help='Maximum multi-lookup values per row (default spec only).')
+@click.option('--chunk-size', default=500000, show_default=True, help='Rows generated and written per batch.')
+@click.option('--seed', 'random_seed', default=None, type=int, help='Random seed for reproducible data.')
+@click.option('--site', default=None, callback=validate_site, help='Site collection to seed (default site if omitted).')
+def seed(spec_file, rows, fanout, multi_min, multi_max, chunk_size, random_seed, site):
+  '''Generate synthetic lists and load them into the database.'''
+  if spec_file:
+    with open(spec_file) as f:
+      spec = json.load(f)
+  else:
+    spec = default_seed_spec(rows, fanout, multi_min, multi_max)
+  with use_site(site):
+    seed_lists(spec, chunk_size, random_seed)
+
+
+# Snapshot archive layout: the database (lists, relationships, fields, users, change log and
+# document metadata) as one SQLite file, plus each document blob once by content hash
+snapshot_version = 1
+snapshot_database = 'data.sqlite'
+snapshot_manifest = 'snapshot.json'
+
+snapshot_cli = AppGroup('snapshot', help='Save and restore the whole RavenPoint environment.')
+ravenpoint_cli.add_command(snapshot_cli)
+
+# Function to get the last change token, or 0 if no change was ever logged
+def get_change_sequence(conn):
+  row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+  return row[0] if row else 0
+
+# Function to save the database and documents to a snapshot archive
+def save_snapshot(path, compress_level=6):
+  started = time.time()
+  # Files dropped into the documents folder are only registered on first access
+  import_legacy_documents()
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    # The backup API copies a consistent snapshot of the database page by page, without
+    # blocking writers for the whole copy
+    database_path = os.path.join(tmp_dir, snapshot_database)
+    with get_connection() as conn, sqlite3.connect(database_path) as snapshot:
+      conn.backup(snapshot)
+      snapshot.execute('PRAGMA journal_mode=DELETE')
+      snapshot.execute('VACUUM')
+      lists = [row[0] for row in snapshot.execute('SELECT table_name FROM tables ORDER BY table_name')]
+      hashes = [row[0] for row in snapshot.execute('SELECT DISTINCT hash FROM documents')]
+    manifest = {'version': snapshot_version, 'created': time.time(), 'lists': lists, 'documents': len(hashes)}
+
+    mode = 'w:gz' if compress_level > 0 else 'w'
+    kwargs = {'compresslevel': compress_level} if compress_level > 0 else {}
+    with tarfile.open(path, mode, **kwargs) as archive:
+      manifest_path = os.path.join(tmp_dir, snapshot_manifest)
+      with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+      archive.add(manifest_path, arcname=snapshot_manifest)
+      archive.add(database_path, arcname=snapshot_database)
+      missing = 0
+      for hash in hashes:
+        if os.path.exists(get_blob_path(hash)):
+          archive.add(get_blob_path(hash), arcname=f'documents/{hash}')
+        else:
+          missing += 1
+  if missing:
+    click.echo(f'Warning: {missing} document blob(s) are missing from the store and were not saved.', err=True)
+  click.echo(f"Saved {len(lists)} list(s) and {len(hashes)} document blob(s) to {path} " + \
+    f"({os.path.getsize(path) / 1024 / 1024:,.1f} MB) in {time.time() - started:.1f}s")
+
+# Function to replace the database and documents with a snapshot archive
+def restore_snapshot(path):
+  started = time.time()
+  with tempfile.TemporaryDirectory() as tmp_dir, tarfile.open(path) as archive:
+    try:
+      manifest = json.load(archive.extractfile(snapshot_manifest))
+    except KeyError:
+      raise click.ClickException(f'{path} is not a RavenPoint snapshot.')
+    if manifest.get('version') != snapshot_version:
+      raise click.ClickException(f"Unsupported snapshot version {manifest.get('version')}.")
+    database_path = os.path.join(tmp_dir, snapshot_database)
+    with open(database_path, 'wb') as f:
+      shutil.copyfileobj(archive.extractfile(snapshot_database), f)
+
+    # Copy the snapshot over the live database in place, so that running servers keep
+    # their connections and see the restored data on their next read
+    with sqlite3.connect(database_path) as snapshot, get_connection() as conn:
+      change_sequence = get_change_sequence(conn)
+      snapshot.backup(conn)
+      conn.execute('PRAGMA journal_mode=WAL')
+
+      # Change tokens keep increasing across restores, and every list is reset, so that
+      # clients holding a token from before the restore resync in full
+      if get_change_sequence(conn) < change_sequence:
+        conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'changes'", (change_sequence,))
+      for table_db_name in get_all_table_names(conn).table_db_name:
+        record_change(conn, table_db_name, None, 'Reset')
+      conn.commit()
+    db.session.remove()
+
+    # Blobs are content-addressed: extract the missing ones, then drop the ones no document uses
+    hashes = set([document.hash for document in Document.query.all()])
+    for member in archive:
+      if not member.name.startswith('documents/'):
+        continue
+      hash = member.name.split('/', 1)[1]
+      if not re.fullmatch(r'[0-9a-f]{64}', hash):
+        continue
+      if hash in hashes and not os.path.exists(get_blob_path(hash)):
+        os.makedirs(os.path.dirname(get_blob_path(hash)), exist_ok=True)
+        with open(get_blob_path(hash) + '.restore', 'wb') as f:
+          shutil.copyfileobj(archive.extractfile(member), f)
+        os.replace(get_blob_path(hash) + '.restore', get_blob_path(hash))
+    store_dir = os.path.join(get_documents_folder(), '.store')
+    removed = 0
+    for prefix in os.scandir(store_dir) if os.path.isdir(store_dir) else []:
+      if not prefix.is_dir() or prefix.name == 'tmp':
+        continue
+      for blob in os.scandir(prefix.path):
+        if blob.name not in hashes:
+          os.remove(blob.path)
+          removed += 1
+  click.echo(f"Restored {len(manifest['lists'])} list(s) and {len(hashes)} document blob(s) from {path} " + \
+    f"in {time.time() - started:.1f}s ({removed} unused blob(s) removed)")
+
+# Function to create the in-memory database, then load DATABASE_LOAD into it: a snapshot
+# archive, or a seed spec (.json)
+def load_database():
+  with app.app_context():
+    db.create_all()
+    path = app.config['DATABASE_LOAD']
+    if not path:
+      return
+    if path.endswith('.json'):
+      with open(path) as f:
+        seed_lists(json.load(f))
+    else:
+      restore_snapshot(path)
+
+# Function to save the in-memory database to DATABASE_PERSIST on shutdown
+def persist_database():
+  with app.app_context():
+    save_snapshot(app.config['DATABASE_PERSIST'])
+
+
+@snapshot_cli.command('save')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--compress-level', default=6, show_default=True, type=click.IntRange(0, 9), help='gzip level; 0 writes an uncompressed archive.')
+@click.option('--site', default=None, callback=validate_site, help='Site collection to save (default site if omitted).')
+def snapshot_save(path, compress_level, site):
+  '''Save lists, relationships, users and documents to a snapshot archive.'''
+  with use_site(site):
+    save_snapshot(path, compress_level)
+
+
+@snapshot_cli.command('restore')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--site', default=None, callback=validate_site, help='Site collection to restore (default site if omitted).')
+def snapshot_restore(path, site):
+  '''Replace all lists, relationships, users and documents with a snapshot.'''
+  with use_site(site):
+    restore_snapshot(path)
@@ -0,0 +1,166 @@
+# RAVENPOINT DATABASE
+# Every connection to the RavenPoint database, from the raw sqlite3 handlers and from
+# Flask-SQLAlchemy alike, is opened here. DATABASE is a file path (default), or `:memory:`
+# for an in-memory database that lives as long as the process and never touches the disk.
+# Site collections (`/ravenpoint/sites/<site>/_api/...`) each get their own database, with
+# their own lists, registry, users and documents, so sites never contend for one writer lock
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from project import app
+
+app.config.setdefault('SITES_FOLDER', os.path.join(app.root_path, 'data', 'sites'))
+app.config.setdefault('SITES_MAX_OPEN', 64)
+
+memory_database = ':memory:'
+
+# In-memory databases are shared between connections by name. The memdb VFS (SQLite 3.36+)
+# locks like a file database; older versions fall back to a shared cache, which locks per table
+memdb_vfs = sqlite3.sqlite_version_info >= (3, 36, 0)
+
+# One connection per in-memory database stays open, so that it outlives every request
+_keepers = {}
+_keepers_lock = threading.Lock()
+
+# Function to check if a database path is in memory
+def is_memory_database(path=None):
+  return (path or app.config['DATABASE']) == memory_database
+
+# Function to get the URI of an in-memory database
+def get_memory_uri(name='ravenpoint'):
+  if memdb_vfs:
+    return f'file:/{name}?vfs=memdb'
+  return f'file:{name}?mode=memory&cache=shared'
+
+# Function to get the SQLAlchemy URI of a database; connections come from get_connection
+def get_sqlalchemy_uri(path=None):
+  path = path or app.config['DATABASE']
+  if is_memory_database(path):
+    return f"sqlite:///{get_memory_uri()}&uri=true"
+  return f'sqlite:///{path}'
+
+# Function to open a connection to a database
+def connect_database(path, name='ravenpoint'):
+  if not is_memory_database(path):
+    return sqlite3.connect(path)
+  uri = get_memory_uri(name)
+  with _keepers_lock:
+    if uri not in _keepers:
+      _keepers[uri] = sqlite3.connect(uri, uri=True, check_same_thread=False)
+  return sqlite3.connect(uri, uri=True)
+
+# Site of the current request; None is the default site (`/ravenpoint/_api/...`)
+current_site = ContextVar('current_site', default=None)
+site_pattern = r'[A-Za-z0-9_-]+'
+
+# Open sites, least recently used first, with the connection that keeps each one open
+_sites = OrderedDict()
+_sites_opening = set()
+_sites_lock = threading.RLock()
+
+# Function to get the site of the current request
+def get_site():
+  return current_site.get()
+
+# Function to run code against the database of a site
+@contextmanager
+def use_site(site):
+  token = current_site.set(site)
+  try:
+    yield
+  finally:
+    current_site.reset(token)
+
+# Function to get the database path of a site
+def get_site_path(site):
+  if is_memory_database():
+    return memory_database
+  return os.path.join(app.config['SITES_FOLDER'], f'{site}.sqlite')
+
+# Function to split a site from a request path, e.g. `/ravenpoint/sites/hr/_api/web` ->
+# ('hr', '/ravenpoint/_api/web'); paths outside a site are returned as they are
+def split_site_path(path):
+  match = re.fullmatch(rf'/ravenpoint/sites/({site_pattern})(/.*)', path)
+  if match is None:
+    return None, path
+  return match.group(1), '/ravenpoint' + match.group(2)
+
+# Function to open a site's database on first use: create its schema, then keep one connection
+# open so that the database (or its WAL index) stays ready between requests. Beyond
+# SITES_MAX_OPEN, the least recently used file databases are closed; in-memory sites stay open
+def open_site(site):
+  with _sites_lock:
+    if site in _sites:
+      _sites.move_to_end(site)
+      return
+    # Initializers connect to the site while it is being opened
+    if site in _sites_opening:
+      return
+    path = get_site_path(site)
+    if not is_memory_database(path):
+      os.makedirs(app.config['SITES_FOLDER'], exist_ok=True)
+    keeper = connect_database(path, f'ravenpoint-{site}')
+    if not is_memory_database(path):
+      keeper.execute('PRAGMA journal_mode=WAL')
+    _sites_opening.add(site)
+    try:
+      with use_site(site):
+        for initializer in site_initializers:
+          initializer()
+    except Exception:
+      keeper.close()
+      raise
+    finally:
+      _sites_opening.discard(site)
+    _sites[site] = keeper
+    open_file_sites = [key for key in _sites if not is_memory_database(get_site_path(key))]
+    for key in open_file_sites[:max(len(open_file_sites) - app.config['SITES_MAX_OPEN'], 0)]:
+      _sites.pop(key).close()
+
+# Functions that prepare the schema of a new site, run by open_site with the site in use
+site_initializers = []
+
+# Function to get the database path of the current site
+def get_database_path():
+  site = get_site()
+  if site is None:
+    return app.config['DATABASE']
+  return get_site_path(site)
+
+# Function to open a connection to the database of the current site
+def get_connection():
+  site = get_site()
+  if site is None:
+    return connect_database(app.config['DATABASE'])
+  if site not in _sites:
+    open_site(site)
+  return connect_database(get_site_path(site), f'ravenpoint-{site}')
+
+# WSGI middleware to serve site collections: the site is taken off the path, so that the
+# same routes serve every site, and connections in the request go to the site's database
+class SiteMiddleware:
+  def __init__(self, wsgi_app):
+    self.wsgi_app = wsgi_app
+
+  def __call__(self, environ, start_response):
+    site, path = split_site_path(environ.get('PATH_INFO', ''))
+    if site is None:
+      return self.wsgi_app(environ, start_response)
+    environ['PATH_INFO'] = path
+    environ['ravenpoint.site'] = site
+    with use_site(site):
+      return self.wsgi_app(environ, start_response)
+
+# Function to prepare the database for concurrent use
+# Write-ahead logging lets API reads see a consistent snapshot without being blocked while the
+# admin panel rewrites tables; in-memory databases keep their own journal
+def prepare_database():
+  if is_memory_database():
+    return
+  with get_connection() as conn:
+    conn.execute('PRAGMA journal_mode=WAL')
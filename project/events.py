@@ -0,0 +1,154 @@
+# RAVENPOINT LIST EVENTS
+# In-process pub/sub for list item changes, streamed to clients as Server-Sent Events.
+# Every subscriber has a bounded queue: a client that falls behind is disconnected and
+# catches up from its Last-Event-ID on reconnect, instead of growing server memory
+import asyncio
+import json
+import queue
+import threading
+
+from project import app
+from project.database import get_site
+
+app.config.setdefault('EVENTS_QUEUE_SIZE', 256)
+app.config.setdefault('EVENTS_HEARTBEAT_SECONDS', 15)
+app.config.setdefault('EVENTS_MAX_SUBSCRIBERS', 10000)
+
+# Subscribers by site and list
+_subscribers = {}
+_subscribers_lock = threading.Lock()
+
+class Subscriber:
+  def __init__(self, key, maxsize):
+    self.key = key
+    self.queue = queue.Queue(maxsize)
+    self.overflowed = False
+
+  # Queue an event without blocking the publisher
+  def put(self, event):
+    try:
+      self.queue.put_nowait(event)
+    except queue.Full:
+      self.overflowed = True
+
+# Subscriber served from an event loop (ASGI mode); publishers hand events over thread-safely
+class AsyncSubscriber:
+  def __init__(self, key, maxsize, loop):
+    self.key = key
+    self.queue = asyncio.Queue(maxsize)
+    self.loop = loop
+    self.overflowed = False
+
+  # Queue an event from any thread without blocking the publisher
+  def put(self, event):
+    try:
+      self.loop.call_soon_threadsafe(self._put, event)
+    except RuntimeError:
+      # The loop has closed
+      self.overflowed = True
+
+  def _put(self, event):
+    try:
+      self.queue.put_nowait(event)
+    except asyncio.QueueFull:
+      self.overflowed = True
+
+# Function to subscribe to the changes of a list in the current site; pass the event loop for
+# async streams. Returns None when the subscriber limit is reached
+def subscribe(table_db_name, loop=None):
+  key = (get_site(), table_db_name)
+  with _subscribers_lock:
+    if sum([len(subs) for subs in _subscribers.values()]) >= app.config['EVENTS_MAX_SUBSCRIBERS']:
+      return None
+    if loop is None:
+      subscriber = Subscriber(key, app.config['EVENTS_QUEUE_SIZE'])
+    else:
+      subscriber = AsyncSubscriber(key, app.config['EVENTS_QUEUE_SIZE'], loop)
+    _subscribers.setdefault(key, set()).add(subscriber)
+  return subscriber
+
+# Function to remove a subscriber
+def unsubscribe(subscriber):
+  with _subscribers_lock:
+    subs = _subscribers.get(subscriber.key, set())
+    subs.discard(subscriber)
+    if not subs:
+      _subscribers.pop(subscriber.key, None)
+
+# Function to count subscribers, optionally for one list in the current site
+def count_subscribers(table_db_name=None):
+  with _subscribers_lock:
+    if table_db_name is not None:
+      return len(_subscribers.get((get_site(), table_db_name), ()))
+    return sum([len(subs) for subs in _subscribers.values()])
+
+# Function to publish a change to the subscribers of a list in the current site
+# Call after the change is committed, so that subscribers can read it
+def publish_change(table_db_name, change_token, item_id, change_type, fields=None):
+  event = {'changeToken': str(change_token), 'changeType': change_type, 'Id': item_id}
+  if fields is not None:
+    event['fields'] = fields
+  with _subscribers_lock:
+    subs = list(_subscribers.get((get_site(), table_db_name), ()))
+  for subscriber in subs:
+    subscriber.put(event)
+
+# Function to format an event for the stream
+# The change token is the event id, so reconnecting clients resume from Last-Event-ID
+def format_event(event):
+  return f"id: {event['changeToken']}\nevent: {event['changeType']}\ndata: {json.dumps(event)}\n\n"
+
+# Function to stream events to a subscriber until it disconnects or falls behind
+# Missed changes (from Last-Event-ID) are replayed first; live events at or below the
+# last replayed token are skipped. A `Reset` event means the client must sync in full
+def stream_events(subscriber, replay=(), last_token=0):
+  try:
+    yield 'retry: 1000\n\n'
+    for event in replay:
+      last_token = int(event['changeToken'])
+      yield format_event(event)
+      if event['changeType'] == 'Reset':
+        return
+    while True:
+      try:
+        event = subscriber.queue.get(timeout=app.config['EVENTS_HEARTBEAT_SECONDS'])
+      except queue.Empty:
+        # Comments keep proxies from closing the connection and detect dead clients
+        yield ': keepalive\n\n'
+        continue
+      if subscriber.overflowed:
+        return
+      if int(event['changeToken']) <= last_token:
+        continue
+      last_token = int(event['changeToken'])
+      yield format_event(event)
+      if event['changeType'] == 'Reset':
+        return
+  finally:
+    unsubscribe(subscriber)
+
+# Async version of stream_events for AsyncSubscriber; cancel it when the client disconnects
+async def stream_events_async(subscriber, replay=(), last_token=0):
+  try:
+    yield 'retry: 1000\n\n'
+    for event in replay:
+      last_token = int(event['changeToken'])
+      yield format_event(event)
+      if event['changeType'] == 'Reset':
+        return
+    while True:
+      try:
+        event = await asyncio.wait_for(subscriber.queue.get(), app.config['EVENTS_HEARTBEAT_SECONDS'])
+      except asyncio.TimeoutError:
+        yield ': keepalive\n\n'
+        continue
+      if subscriber.overflowed:
+        return
+      if int(event['changeToken']) <= last_token:
+        continue
+      last_token = int(event['changeToken'])
+      yield format_event(event)
+      if event['changeType'] == 'Reset':
+        return
+  finally:
+    unsubscribe(subscriber)
@@ -32,4 +32,79 @@ class Relationship(db.Model):
     self.table_lookup = table_lookup
     self.table_lookup_on = table_lookup_on
     self.is_multi = is_multi
-    self.description = description
\ No newline at end of file
+    self.description = description
+
+class Document(db.Model):
+  __tablename__ = 'documents'
+  id = db.Column(db.String(128), primary_key=True)
+  folder = db.Column(db.String(256), index=True)
+  name = db.Column(db.String(256))
+  size = db.Column(db.Integer)
+  hash = db.Column(db.String(64), index=True)
+  mtime = db.Column(db.Float)
+
+  def __init__(self, folder, name, size, hash, mtime):
+    hashed = md5(f'{folder}/{name}'.encode())
+    self.id = hashed.hexdigest()
+    self.folder = folder
+    self.name = name
+    self.size = size
+    self.hash = hash
+    self.mtime = mtime
+
+class OutboxEmail(db.Model):
+  __tablename__ = 'outbox'
+  id = db.Column(db.Integer, primary_key=True)
+  sender = db.Column(db.String(256))
+  recipients = db.Column(db.Text)
+  subject = db.Column(db.Text)
+  body = db.Column(db.Text)
+  status = db.Column(db.String(16), default='queued', index=True)
+  attempts = db.Column(db.Integer, default=0)
+  last_error = db.Column(db.Text)
+  queued_at = db.Column(db.Float)
+  next_attempt_at = db.Column(db.Float, index=True)
+  sent_at = db.Column(db.Float)
+
+  def __init__(self, sender, recipients, subject, body, queued_at):
+    self.sender = sender
+    self.recipients = ','.join(recipients)
+    self.subject = subject
+    self.body = body
+    self.status = 'queued'
+    self.attempts = 0
+    self.queued_at = queued_at
+    self.next_attempt_at = queued_at
+
+class Field(db.Model):
+  __tablename__ = 'columns'
+  id = db.Column(db.String(128), primary_key=True)
+  table_db_name = db.Column(db.String(256), index=True)
+  column_name = db.Column(db.String(256))
+  field_type = db.Column(db.String(32))
+  position = db.Column(db.Integer)
+  searchable = db.Column(db.Boolean, default=False)
+
+  def __init__(self, table_db_name, column_name, field_type, position, searchable=False):
+    hashed = md5(f'{table_db_name}.{column_name}'.encode())
+    self.id = hashed.hexdigest()
+    self.table_db_name = table_db_name
+    self.column_name = column_name
+    self.field_type = field_type
+    self.position = position
+    self.searchable = searchable
+
+class Change(db.Model):
+  __tablename__ = 'changes'
+  __table_args__ = {'sqlite_autoincrement': True}
+  id = db.Column(db.Integer, primary_key=True)
+  table_db_name = db.Column(db.String(256), index=True)
+  item_id = db.Column(db.Integer)
+  change_type = db.Column(db.String(16))
+  changed_at = db.Column(db.String(32))
+
+  def __init__(self, table_db_name, item_id, change_type, changed_at):
+    self.table_db_name = table_db_name
+    self.item_id = item_id
+    self.change_type = change_type
+    self.changed_at = changed_at
@@ -0,0 +1,63 @@
+# RAVENPOINT OFFLOAD
+# Shaping list query results with pandas is CPU-bound and holds the GIL, so one large query
+# stalls every other request in the process. Large queries are run and shaped in a process
+# pool instead, which sends back the response as JSON bytes; small queries stay inline,
+# where a round trip to a worker would cost more than it saves
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from listdata import render_list_items
+from project import app
+from project.database import get_database_path, is_memory_database
+from project.utils import compile_count_query, get_table_fields
+
+# Worker processes (0 keeps every query inline), and the estimated number of cells (rows times
+# columns) from which a query is offloaded
+app.config.setdefault('OFFLOAD_WORKERS', 0)
+app.config.setdefault('OFFLOAD_MIN_CELLS', 200000)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Function to get the process pool, started on first use
+# Workers are spawned rather than forked, as the server process runs threads
+def get_pool():
+  global _pool
+  with _pool_lock:
+    if _pool is None:
+      _pool = ProcessPoolExecutor(max_workers=app.config['OFFLOAD_WORKERS'],
+                                  mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+# Function to estimate the cells a list query returns, from the largest Id in the list (or
+# `rows`, when the items are known, e.g. changed items); columns of `list.*` are counted from
+# the list's fields. Filters are not taken into account, so this is an upper bound
+def estimate_cells(conn, query, top=None, rows=None):
+  if rows is None:
+    rows = conn.execute(f"SELECT MAX(rowid) FROM {query['table']}").fetchone()[0] or 0
+  if top is not None:
+    rows = min(rows, top)
+  cols = len(query['select']) + len(query['secondary'])
+  if f"{query['table']}.*" in query['select']:
+    cols += len(get_table_fields(conn, query['table'])) - 1
+  return rows * cols
+
+# Function to check if a list query should run in the process pool
+# In-memory databases cannot be opened from another process. A filtered query that may be
+# large is counted first (through an index or the search index, where one applies), so that
+# a selective filter on a large list stays inline
+def should_offload(conn, query, top=None, rows=None):
+  if app.config['OFFLOAD_WORKERS'] <= 0 or query['aggregate'] or is_memory_database(get_database_path()):
+    return False
+  if estimate_cells(conn, query, top, rows) < app.config['OFFLOAD_MIN_CELLS']:
+    return False
+  if query['where'] and rows is None:
+    rows = conn.execute(compile_count_query(query)).fetchone()[0]
+    return estimate_cells(conn, query, top, rows) >= app.config['OFFLOAD_MIN_CELLS']
+  return True
+
+# Function to run a list query of the current site in the process pool; returns JSON bytes
+# Workers run listdata.render_list_items, which does not import the app
+def offload_list_items(query, sql_query, output, count_query=None):
+  return get_pool().submit(render_list_items, get_database_path(), query, sql_query, count_query, output).result()
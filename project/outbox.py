@@ -0,0 +1,129 @@
+# RAVENPOINT EMAIL OUTBOX
+# Emails are written to the `outbox` table and delivered by a background sender thread,
+# so SendEmail returns immediately and survives a slow or unavailable SMTP server
+import threading
+import time
+
+from flask_mail import Mail, Message
+from project import app, db
+from project.database import use_site
+from project.models import OutboxEmail
+
+app.config['MAIL_SERVER']='localhost'
+app.config['MAIL_PORT'] = 1025
+app.config.setdefault('OUTBOX_BATCH_SIZE', 50)
+app.config.setdefault('OUTBOX_MAX_ATTEMPTS', 8)
+app.config.setdefault('OUTBOX_RETRY_BASE_SECONDS', 2)
+app.config.setdefault('OUTBOX_RETRY_MAX_SECONDS', 300)
+app.config.setdefault('OUTBOX_IDLE_SECONDS', 30)
+
+mail = Mail(app)
+
+_wakeup = threading.Event()
+_sender_lock = threading.Lock()
+_sender = None
+
+# Function to add an email to the outbox
+# Every site collection sends through the outbox of the default site, which the sender polls
+def enqueue_email(sender, recipients, subject, body):
+  with use_site(None):
+    email = OutboxEmail(sender, recipients, subject, body, time.time())
+    db.session.add(email)
+    db.session.commit()
+  start_sender()
+  _wakeup.set()
+  return email
+
+# Function to start the background sender (once per process)
+def start_sender():
+  global _sender
+  with _sender_lock:
+    if _sender is None or not _sender.is_alive():
+      _sender = threading.Thread(target=_run_sender, name='outbox-sender', daemon=True)
+      _sender.start()
+
+# Function to claim the next batch of due emails
+# Claiming flips the status with a conditional UPDATE, so concurrent senders (e.g. under
+# the reloader) never deliver the same email twice
+def _claim_batch():
+  now = time.time()
+  due = OutboxEmail.query.filter(OutboxEmail.status == 'queued', OutboxEmail.next_attempt_at <= now) \
+    .order_by(OutboxEmail.next_attempt_at).limit(app.config['OUTBOX_BATCH_SIZE']).all()
+  claimed = []
+  for email in due:
+    updated = OutboxEmail.query.filter_by(id=email.id, status='queued').update({'status': 'sending'})
+    if updated:
+      claimed.append(email)
+  db.session.commit()
+  return claimed
+
+# Function to schedule a retry with exponential backoff, or give up
+def _retry_later(email, error):
+  email.attempts += 1
+  email.last_error = str(error)
+  if email.attempts >= app.config['OUTBOX_MAX_ATTEMPTS']:
+    email.status = 'failed'
+  else:
+    delay = min(app.config['OUTBOX_RETRY_BASE_SECONDS'] * 2 ** (email.attempts - 1),
+                app.config['OUTBOX_RETRY_MAX_SECONDS'])
+    email.status = 'queued'
+    email.next_attempt_at = time.time() + delay
+
+# Function to get the number of seconds until the next retry is due
+def _seconds_until_next_attempt():
+  email = OutboxEmail.query.filter_by(status='queued').order_by(OutboxEmail.next_attempt_at).first()
+  if email is None:
+    return None
+  return max(email.next_attempt_at - time.time(), 0)
+
+# Background sender loop
+# One SMTP connection is kept open while there is mail to deliver and closed after
+# OUTBOX_IDLE_SECONDS without any
+def _run_sender():
+  connection = None
+  last_sent = time.time()
+  with app.app_context():
+    # Requeue emails left mid-delivery by a previous process
+    OutboxEmail.query.filter_by(status='sending').update({'status': 'queued'})
+    db.session.commit()
+    while True:
+      batch = _claim_batch()
+      for email in batch:
+        try:
+          if connection is None:
+            connection = mail.connect()
+            connection.__enter__()
+          msg = Message(sender=email.sender, recipients=email.recipients.split(','))
+          msg.body = email.body
+          msg.subject = email.subject
+          connection.send(msg)
+          email.status = 'sent'
+          email.sent_at = time.time()
+          email.attempts += 1
+          last_sent = email.sent_at
+        except Exception as e:
+          print('outbox send error:', e)
+          _retry_later(email, e)
+          if connection is not None:
+            try:
+              connection.__exit__(None, None, None)
+            except Exception:
+              pass
+            connection = None
+        db.session.commit()
+      if batch:
+        continue
+
+      # Close the connection when idle; sleep until woken or a retry is due
+      if connection is not None and time.time() - last_sent > app.config['OUTBOX_IDLE_SECONDS']:
+        try:
+          connection.__exit__(None, None, None)
+        except Exception:
+          pass
+        connection = None
+      timeout = _seconds_until_next_attempt()
+      db.session.remove()
+      idle_timeout = app.config['OUTBOX_IDLE_SECONDS'] if connection is not None else None
+      timeouts = [t for t in [timeout, idle_timeout] if t is not None]
+      _wakeup.wait(min(timeouts) if timeouts else None)
+      _wakeup.clear()
@@ -0,0 +1,173 @@
+# RAVENPOINT PERFORMANCE PROFILES
+# Named profiles make the REST API behave like a given SharePoint: latency drawn from
+# percentiles, a bandwidth cap on responses, and a rate of injected errors, each optionally
+# overridden per endpoint. A request picks a profile with the X-RavenPoint-Profile header;
+# otherwise the profile switched on in the admin panel (if any) applies.
+# In ASGI mode, delays are timers on the event loop and hold no worker thread; the WSGI
+# middleware (development server) has to sleep in the request's thread, so it delays at most
+# PROFILE_WSGI_MAX_DELAYED requests at once and serves the rest without delay (best-effort)
+import json
+import random
+import threading
+import time
+
+from project import app
+from project.api import api_namespace
+from werkzeug.exceptions import BadRequest, HTTPException, default_exceptions
+from werkzeug.routing import RoutingException
+from werkzeug.wrappers import Response
+
+app.config.setdefault('PROFILES', {
+  # A busy on-premises farm: slow tail, 4 MB/s to the client
+  'on-prem': {
+    'latency': {'p50': 0.15, 'p95': 0.6, 'p99': 1.5, 'max': 4},
+    'bandwidth': 4 * 1024 * 1024
+  },
+  # SharePoint Online under throttling: one request in five gets 429 with Retry-After
+  'throttled': {
+    'latency': {'p50': 0.3, 'p95': 1.5, 'p99': 3, 'max': 6},
+    'error_rate': 0.2,
+    'errors': [429],
+    'retry_after': 5
+  },
+  # An unreliable network: occasional long stalls, and server errors, more so on item updates
+  'flaky': {
+    'latency': {'p50': 0.1, 'p95': 2, 'p99': 8, 'max': 20},
+    'bandwidth': 512 * 1024,
+    'error_rate': 0.05,
+    'errors': [500, 502, 503],
+    'endpoints': {
+      'UpdateListItems': {'error_rate': 0.15}
+    }
+  }
+})
+# Profile for requests without the header, switched in the admin panel; None applies no profile
+app.config.setdefault('PROFILE', None)
+# WSGI threads that may be sleeping for a profile at once; further delays are skipped
+app.config.setdefault('PROFILE_WSGI_MAX_DELAYED', 4)
+
+_delay_slots = None
+_delay_slots_lock = threading.Lock()
+
+# Header that picks a profile for one request; `none` turns the active profile off
+profile_header = 'X-RavenPoint-Profile'
+
+# Function to get the name of the API resource (e.g. `ListItems`) an endpoint serves
+# Returns None for endpoints outside the API namespace, e.g. the Swagger docs
+def get_resource_name(endpoint):
+  view_class = getattr(app.view_functions.get(endpoint), 'view_class', None)
+  if view_class not in [resource.resource for resource in api_namespace.resources]:
+    return None
+  return view_class.__name__
+
+# Function to get the settings of a profile for a resource
+# Raises BadRequest for an unknown profile; returns None when no profile applies
+def get_profile_settings(profile_name, resource_name):
+  profile_name = profile_name or app.config['PROFILE']
+  if not profile_name or profile_name == 'none' or resource_name is None:
+    return None
+  profiles = app.config['PROFILES']
+  if profile_name not in profiles:
+    raise BadRequest(f"Profile '{profile_name}' does not exist. Use one of {', '.join(profiles)} or none.")
+  profile = profiles[profile_name]
+  return {**profile, **profile.get('endpoints', {}).get(resource_name, {})}
+
+# Function to draw a latency in seconds from percentiles, e.g. {'p50': 0.1, 'p99': 2, 'max': 5}
+# The inverse distribution is interpolated linearly between the percentiles, from `min`
+# (default 0) to `max` (default the highest percentile)
+def sample_latency(latency):
+  points = sorted([(float(key[1:]) / 100, value) for key, value in latency.items() if key.startswith('p')])
+  if not points:
+    return latency.get('min', 0)
+  points = [(0, latency.get('min', 0))] + points + [(1, latency.get('max', points[-1][1]))]
+  u = random.random()
+  for (u0, s0), (u1, s1) in zip(points, points[1:]):
+    if u <= u1:
+      return s0 + (s1 - s0) * (u - u0) / (u1 - u0) if u1 > u0 else s1
+  return points[-1][1]
+
+# Function to build an injected error, with Retry-After on 429 and 503 as SharePoint sends
+def make_error(code, retry_after):
+  error_class = default_exceptions[code]
+  if code in [429, 503]:
+    return error_class('The server is busy. Injected by the performance profile.', retry_after=retry_after)
+  return error_class('Injected by the performance profile.')
+
+# Function to plan what a profile does to a request: seconds of latency, an error to return
+# instead of the response (or None) and a bandwidth cap in bytes per second (or None)
+def plan_request(profile_name, resource_name):
+  settings = get_profile_settings(profile_name, resource_name)
+  if settings is None:
+    return None
+  error = None
+  if settings.get('errors') and random.random() < settings.get('error_rate', 0):
+    error = make_error(random.choice(settings['errors']), settings.get('retry_after', 1))
+  return {
+    'latency': sample_latency(settings.get('latency', {})),
+    'error': error,
+    'bandwidth': settings.get('bandwidth')
+  }
+
+# Function to format an error in the same shape as the API
+def get_error_response(error):
+  headers = [(key, value) for key, value in error.get_headers() if key.lower() != 'content-type']
+  headers.append(('Access-Control-Allow-Origin', '*'))
+  return Response(json.dumps({'message': error.description}), error.code, headers, mimetype='application/json')
+
+# Function to get the slots for sleeping WSGI threads, created on first use
+def get_delay_slots():
+  global _delay_slots
+  with _delay_slots_lock:
+    if _delay_slots is None:
+      _delay_slots = threading.BoundedSemaphore(app.config['PROFILE_WSGI_MAX_DELAYED'])
+    return _delay_slots
+
+# Function to sleep in a WSGI thread if a slot is free; returns False if the delay is skipped
+def delay_thread(seconds):
+  slots = get_delay_slots()
+  if not slots.acquire(blocking=False):
+    return False
+  try:
+    time.sleep(seconds)
+  finally:
+    slots.release()
+  return True
+
+# Function to send a response body at most `bandwidth` bytes per second, blocking the thread
+# Chunks are sent without delay while every slot is taken
+def throttle_body(iterable, bandwidth):
+  try:
+    for chunk in iterable:
+      yield chunk
+      delay_thread(len(chunk) / bandwidth)
+  finally:
+    if hasattr(iterable, 'close'):
+      iterable.close()
+
+# WSGI middleware to apply profiles; requests already planned by the ASGI app pass through
+class ProfileMiddleware:
+  def __init__(self, wsgi_app):
+    self.wsgi_app = wsgi_app
+
+  def __call__(self, environ, start_response):
+    if 'ravenpoint.profile' in environ:
+      return self.wsgi_app(environ, start_response)
+    try:
+      endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except (HTTPException, RoutingException):
+      # Unmatched routes are left to Flask
+      endpoint = None
+    try:
+      plan = plan_request(environ.get('HTTP_X_RAVENPOINT_PROFILE'), get_resource_name(endpoint))
+    except BadRequest as e:
+      return get_error_response(e)(environ, start_response)
+    environ['ravenpoint.profile'] = plan
+    if plan is None:
+      return self.wsgi_app(environ, start_response)
+    if plan['latency']:
+      delay_thread(plan['latency'])
+    if plan['error'] is not None:
+      return get_error_response(plan['error'])(environ, start_response)
+    if plan['bandwidth']:
+      return throttle_body(self.wsgi_app(environ, start_response), plan['bandwidth'])
+    return self.wsgi_app(environ, start_response)
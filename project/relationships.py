@@ -0,0 +1,112 @@
+# RAVENPOINT RELATIONSHIP MIGRATIONS
+# Adding, editing or deleting a relationship in the admin panel queues a migration; the data
+# and the registry change in the background. Junction tables are filled first, then swapped in
+# or dropped together with their triggers in the transaction that changes the registry, so
+# reads never see a relationship without its junction table. Lookup field types are synced
+# afterwards, and the relationship is checked for orphaned rows
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from project.database import get_connection
+from project.utils import sync_lookup_fields, plan_junction_migration, fill_junction_shadow, \
+  drop_junction_shadow, swap_junction_table, drop_junction_table, count_orphans
+
+# Migrations run one at a time, in the order they were requested
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ravenpoint-migrations')
+
+# Latest migration of each relationship, by relationship ID
+_migrations = {}
+_migrations_lock = threading.Lock()
+
+# Registry columns of a relationship
+relationship_columns = ['table_left', 'table_left_on', 'table_lookup', 'table_lookup_on', 'is_multi', 'description']
+
+# Function to get the parts of a relationship that its junction table and fields depend on
+def get_relationship_spec(values):
+  return {
+    'table_left': values['table_left'],
+    'table_left_on': values['table_left_on'],
+    'table_lookup': values['table_lookup'],
+    'is_multi': bool(values['is_multi'])
+  }
+
+# Function to read a relationship's registry values; None if it does not exist
+def read_relationship(conn, rship_id):
+  row = conn.execute(f"SELECT {', '.join(relationship_columns)} FROM relationships WHERE rship_id = ?",
+                     (rship_id,)).fetchone()
+  return dict(zip(relationship_columns, row)) if row is not None else None
+
+# Function to write a relationship to the registry (None deletes it); the caller commits
+def write_relationship(conn, rship_id, values):
+  if values is None:
+    conn.execute('DELETE FROM relationships WHERE rship_id = ?', (rship_id,))
+    return
+  values = {**values, 'is_multi': bool(values['is_multi'])}
+  conn.execute(f"INSERT OR REPLACE INTO relationships (rship_id, {', '.join(relationship_columns)}) \
+VALUES (?, {', '.join(['?'] * len(relationship_columns))})", (rship_id, *[values[col] for col in relationship_columns]))
+
+# Function to get the latest migration of each relationship
+def get_migrations():
+  with _migrations_lock:
+    return {rship_id: dict(migration) for rship_id, migration in _migrations.items()}
+
+# Function to update the status of a migration
+def set_migration(rship_id, **values):
+  with _migrations_lock:
+    _migrations.setdefault(rship_id, {}).update(values)
+
+# Function to migrate a relationship in the background
+# `values` are its registry values after the change (None deletes it); a new relationship
+# (`rship_id` None) gets the next free ID. Returns the ID and the steps planned so far, which
+# are planned again against the registry when the migration runs
+def migrate_relationship(rship_id, values):
+  with get_connection() as conn:
+    old = read_relationship(conn, rship_id) if rship_id is not None else None
+    steps = plan_junction_migration(old and get_relationship_spec(old), values and get_relationship_spec(values))
+    with _migrations_lock:
+      if rship_id is None:
+        # Relationships queued for creation are not in the registry yet
+        max_id = conn.execute('SELECT MAX(rship_id) FROM relationships').fetchone()[0] or 0
+        rship_id = max([max_id, *_migrations]) + 1
+      _migrations[rship_id] = {'status': 'queued', 'values': values, 'steps': steps, 'orphans': None,
+                               'error': None, 'queued_at': time.time(), 'finished_at': None}
+  context = contextvars.copy_context()
+  _executor.submit(context.run, run_migration, rship_id, values)
+  return rship_id, steps
+
+# Function to run a migration
+def run_migration(rship_id, values):
+  set_migration(rship_id, status='running')
+  try:
+    with get_connection() as conn:
+      old = read_relationship(conn, rship_id)
+      new = values and get_relationship_spec(values)
+      steps = plan_junction_migration(old and get_relationship_spec(old), new)
+      set_migration(rship_id, steps=steps)
+      builds = [step[1:] for step in steps if step[0] == 'build']
+      for build in builds:
+        fill_junction_shadow(conn, *build)
+      # Junction tables and triggers switch with the registry, in one transaction
+      try:
+        conn.execute('BEGIN IMMEDIATE')
+        for step in steps:
+          if step[0] == 'drop':
+            drop_junction_table(conn, step[1], step[2])
+          else:
+            swap_junction_table(conn, *step[1:])
+        write_relationship(conn, rship_id, values)
+        conn.commit()
+      except Exception:
+        conn.rollback()
+        for table_left, _, table_lookup in builds:
+          drop_junction_shadow(conn, table_left, table_lookup)
+        raise
+      # Lookup field types follow the registry; a rebuilt table gets its junction tables again
+      for table_left in set([rship['table_left'] for rship in [old, values] if rship is not None]):
+        sync_lookup_fields(conn, table_left)
+      orphans = count_orphans(conn, **new) if new is not None else None
+    set_migration(rship_id, status='done', orphans=orphans, finished_at=time.time())
+  except Exception as e:
+    set_migration(rship_id, status='failed', error=str(e), finished_at=time.time())
@@ -0,0 +1,69 @@
+# RAVENPOINT THROTTLING
+# Token buckets in front of the REST API, to test client back-off the way SharePoint throttles
+# (`429 Too Many Requests` with `Retry-After`), and to keep one runaway client from starving
+# a shared instance. Buckets live in process memory and are shared by all worker threads
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from project import app
+from project.database import get_site
+from werkzeug.exceptions import TooManyRequests
+
+# Requests per second refilled into each bucket (0 turns throttling off), and the bucket size
+app.config.setdefault('THROTTLE_RATE', 0)
+app.config.setdefault('THROTTLE_BURST', 60)
+# What a bucket is kept per: any of 'client', 'site' and 'endpoint'
+app.config.setdefault('THROTTLE_SCOPE', ('client', 'site', 'endpoint'))
+# Buckets kept at most; the least recently used are dropped (a dropped bucket starts full)
+app.config.setdefault('THROTTLE_MAX_BUCKETS', 10000)
+
+# Header that names a client; requests without it are keyed by remote address
+client_header = 'X-RavenPoint-Client'
+
+# Buckets by key, least recently used first: [tokens, time of last refill]
+_buckets = OrderedDict()
+_buckets_lock = threading.Lock()
+
+# Function to get the bucket key of a request
+def get_bucket_key(client, endpoint):
+  scope = app.config['THROTTLE_SCOPE']
+  return (
+    client if 'client' in scope else None,
+    get_site() if 'site' in scope else None,
+    endpoint if 'endpoint' in scope else None
+  )
+
+# Function to take a token from a bucket
+# Returns 0 if the request is admitted, otherwise the seconds until a token is available
+def take_token(key):
+  rate = app.config['THROTTLE_RATE']
+  burst = app.config['THROTTLE_BURST']
+  now = time.monotonic()
+  with _buckets_lock:
+    bucket = _buckets.get(key)
+    if bucket is None:
+      bucket = _buckets[key] = [burst, now]
+      if len(_buckets) > app.config['THROTTLE_MAX_BUCKETS']:
+        _buckets.popitem(last=False)
+    else:
+      _buckets.move_to_end(key)
+      bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+      bucket[1] = now
+    if bucket[0] >= 1:
+      bucket[0] -= 1
+      return 0
+    return (1 - bucket[0]) / rate
+
+# Function to throttle a request from a client to an endpoint
+# Raises 429 with a whole number of seconds in Retry-After, as SharePoint does
+def throttle(client, endpoint):
+  if app.config['THROTTLE_RATE'] <= 0:
+    return
+  retry_after = take_token(get_bucket_key(client, endpoint))
+  if retry_after:
+    raise TooManyRequests(
+      'The request has been throttled. Wait for the time in the Retry-After header and try again.',
+      retry_after=math.ceil(retry_after)
+    )
@@ -1,9 +1,22 @@
 # RAVENPOINT UTILITIES
+import json
+import numpy as np
 import pandas as pd
 import re
 import sqlite3
 import os
-from project import app
+import hashlib
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from project import app, db
+from project.database import get_connection, get_site
+from project.models import Document
+from project.events import publish_change
+from listdata import fetch_expansions, process_list_data
+from werkzeug.exceptions import BadRequest
+from werkzeug.security import safe_join
 from wtforms import ValidationError
 
 # Get all tables in database
@@ -20,7 +33,7 @@ def get_all_table_metadata(conn, tables):
   all_columns = []
   for table_name in tables.table_db_name:
       # Get columns
-      cursor = conn.execute(f"SELECT * FROM {table_name}")
+      cursor = conn.execute(f"SELECT * FROM {table_name} LIMIT 0")
       columns = ', '.join(list(map(lambda x: x[0], cursor.description)))
       all_columns.append(columns)
 
@@ -41,6 +54,295 @@ def get_all_relationships(conn):
   )
   return df
 
+# SCHEMA REGISTRY
+# Field types are recorded per column in the `columns` table when data is ingested, so
+# requests never have to read data to discover a list's schema.
+# SharePoint field types, their FieldTypeKind and the SQLite type used in STRICT tables
+field_types = {
+  'Counter': {'kind': 5, 'sql': 'INTEGER'},
+  'Integer': {'kind': 1, 'sql': 'INTEGER'},
+  'Number': {'kind': 9, 'sql': 'REAL'},
+  'Text': {'kind': 2, 'sql': 'TEXT'},
+  'DateTime': {'kind': 4, 'sql': 'TEXT'},
+  'Boolean': {'kind': 8, 'sql': 'INTEGER'},
+  'Lookup': {'kind': 7, 'sql': 'INTEGER'},
+  'LookupMulti': {'kind': 7, 'sql': 'TEXT'},
+  'User': {'kind': 20, 'sql': 'INTEGER'}
+}
+numeric_field_types = ['Counter', 'Integer', 'Number', 'Lookup', 'User']
+strict_tables = sqlite3.sqlite_version_info >= (3, 37, 0)
+datetime_pattern = r'^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?$'
+# Format of stored DateTime values (UTC); ISO-8601 strings in one format sort by time
+datetime_format = '%Y-%m-%dT%H:%M:%SZ'
+
+# Function to infer field types from a DataFrame at ingest
+def infer_field_types(df):
+  output = {}
+  for col in df.columns:
+    values = df[col].dropna()
+    if col == 'Id':
+      output[col] = 'Counter'
+    elif len(values) == 0:
+      output[col] = 'Text'
+    elif pd.api.types.is_bool_dtype(df[col]):
+      output[col] = 'Boolean'
+    elif pd.api.types.is_numeric_dtype(df[col]):
+      # Integer columns with blanks are read as floats
+      output[col] = 'Integer' if (values % 1 == 0).all() else 'Number'
+    elif pd.api.types.is_datetime64_any_dtype(df[col]) or \
+      values.astype(str).str.match(datetime_pattern).all():
+      output[col] = 'DateTime'
+    else:
+      output[col] = 'Text'
+  return output
+
+# Function to format a datetime value as stored; timezone-less values are UTC
+def format_datetime(value):
+  timestamp = pd.Timestamp(value)
+  if timestamp.tzinfo is not None:
+    timestamp = timestamp.tz_convert('UTC').tz_localize(None)
+  return timestamp.strftime(datetime_format)
+
+# Function to convert DateTime values at ingest (e.g. `2022-03-01 10:30`) to the stored format
+def normalize_datetime_values(values):
+  return values.map(lambda value: None if pd.isnull(value) else format_datetime(value))
+
+# Function to set lookup field types from the relationships of a table
+def apply_lookup_fields(fields, table_db_name, all_rships):
+  rships = all_rships.loc[all_rships.table_left.eq(table_db_name)].to_dict('records')
+  lookups = {rship['table_left_on']: 'User' if rship['table_lookup'] == users_table else \
+    'LookupMulti' if rship['is_multi'] else 'Lookup' for rship in rships}
+  output = {}
+  for col, field_type in fields.items():
+    if col in lookups:
+      output[col] = lookups[col]
+    elif field_type in ['Lookup', 'User']:
+      output[col] = 'Integer'
+    elif field_type == 'LookupMulti':
+      output[col] = 'Text'
+    else:
+      output[col] = field_type
+  return output
+
+# Function to build the DDL for a table from its field types
+def create_table_sql(table_name, fields, primary_key='Id'):
+  columns = []
+  for col, field_type in fields.items():
+    sql_type = 'INTEGER PRIMARY KEY' if col == primary_key else field_types[field_type]['sql']
+    columns.append(f'"{col}" {sql_type}')
+  return f"CREATE TABLE {table_name} ({', '.join(columns)}){' STRICT' if strict_tables else ''}"
+
+# Function to save the field types of a table
+# Text fields keep their search index setting
+def register_fields(conn, table_db_name, fields):
+  searchable = [row[0] for row in conn.execute(
+    'SELECT column_name FROM columns WHERE table_db_name = ? AND searchable', (table_db_name,)).fetchall()]
+  conn.execute('DELETE FROM columns WHERE table_db_name = ?', (table_db_name,))
+  conn.executemany(
+    '''INSERT INTO columns (id, table_db_name, column_name, field_type, position, searchable) \
+VALUES (?, ?, ?, ?, ?, ?)''',
+    [(hashlib.md5(f'{table_db_name}.{col}'.encode()).hexdigest(), table_db_name, col, field_type, i,
+      col in searchable and field_type == 'Text') for i, (col, field_type) in enumerate(fields.items())]
+  )
+  conn.commit()
+
+# Function to index the DateTime fields of a table so that date range filters can use them
+def index_datetime_fields(conn, table_db_name, fields):
+  for col, field_type in fields.items():
+    if field_type == 'DateTime':
+      conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{table_db_name}_{col}" ON {table_db_name} ("{col}")')
+  conn.commit()
+
+# Function to remove the field types of a table
+def unregister_fields(conn, table_db_name):
+  conn.execute('DELETE FROM columns WHERE table_db_name = ?', (table_db_name,))
+
+# Get all field types in database
+def get_all_fields(conn):
+  try:
+    return pd.read_sql('SELECT * FROM columns ORDER BY table_db_name, position', conn)
+  except pd.io.sql.DatabaseError:
+    # The registry has not been migrated yet
+    return pd.DataFrame(columns=['id', 'table_db_name', 'column_name', 'field_type', 'position', 'searchable'])
+
+# Function to get field types as {table: {column: field type}}
+def get_fields_by_table(all_fields):
+  output = {}
+  for row in all_fields.to_dict('records'):
+    output.setdefault(row['table_db_name'], {})[row['column_name']] = row['field_type']
+  return output
+
+# Function to get search-indexed columns as {table: [columns]}
+def get_search_columns(all_fields):
+  output = {}
+  for row in all_fields.loc[all_fields.searchable.fillna(False).astype(bool)].to_dict('records'):
+    output.setdefault(row['table_db_name'], []).append(row['column_name'])
+  return output
+
+# Function to get the field types of a table
+# Tables without registry entries fall back to their declared column types
+def get_table_fields(conn, table_db_name, all_fields=None):
+  if all_fields is None:
+    all_fields = get_all_fields(conn)
+  fields = get_fields_by_table(all_fields).get(table_db_name)
+  if fields:
+    return fields
+  fields = {}
+  for _, col, sql_type, _, _, pk in conn.execute(f'PRAGMA table_info({table_db_name})').fetchall():
+    sql_type = sql_type.upper()
+    if pk and col == 'Id':
+      fields[col] = 'Counter'
+    elif 'INT' in sql_type:
+      fields[col] = 'Integer'
+    elif any([t in sql_type for t in ['REAL', 'FLOA', 'DOUB']]):
+      fields[col] = 'Number'
+    else:
+      fields[col] = 'Text'
+  return fields
+
+# Function to copy a table into a new table built from its registered field types
+# Used when a field type change no longer fits the declared column type of a STRICT table
+def rebuild_table(conn, table_db_name, fields):
+  table_info = conn.execute(f'PRAGMA table_info({table_db_name})').fetchall()
+  primary_key = [col[1] for col in table_info if col[5]][0]
+  declared = {col[1]: col[2].upper() for col in table_info}
+  select_cols = []
+  for col, field_type in fields.items():
+    sql_type = field_types[field_type]['sql']
+    if col == primary_key or declared.get(col) == sql_type:
+      select_cols.append(f'"{col}"')
+    elif sql_type == 'TEXT':
+      # Whole-number floats are copied as '3' rather than '3.0'
+      select_cols.append(f'''CASE WHEN typeof("{col}") = 'real' AND "{col}" = CAST("{col}" AS INTEGER) \
+THEN CAST(CAST("{col}" AS INTEGER) AS TEXT) ELSE CAST("{col}" AS TEXT) END''')
+    else:
+      select_cols.append(f'CAST("{col}" AS {sql_type})')
+  shadow_table = f'{table_db_name}__shadow'
+  conn.execute(f'DROP TABLE IF EXISTS {shadow_table}')
+  conn.execute(create_table_sql(shadow_table, fields, primary_key))
+  conn.execute(f'''INSERT INTO {shadow_table} ({', '.join([f'"{col}"' for col in fields])}) \
+SELECT {', '.join(select_cols)} FROM {table_db_name}''')
+  conn.commit()
+  swap_shadow_table(conn, table_db_name)
+  index_datetime_fields(conn, table_db_name, fields)
+
+  # Dropping the old table dropped its triggers; rebuild the junction tables
+  all_rships = get_all_relationships(conn)
+  for rship in all_rships.loc[all_rships.table_left.eq(table_db_name) & all_rships.is_multi.astype(bool)].to_dict('records'):
+    build_junction_table(conn, rship['table_left'], rship['table_left_on'], rship['table_lookup'])
+  build_search_index(conn, table_db_name)
+
+# Function to update lookup field types after relationships change
+# Returns True if the table had to be rebuilt
+def sync_lookup_fields(conn, table_db_name):
+  fields = get_table_fields(conn, table_db_name)
+  new_fields = apply_lookup_fields(fields, table_db_name, get_all_relationships(conn))
+  if new_fields == fields:
+    return False
+  register_fields(conn, table_db_name, new_fields)
+  table_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                           (table_db_name,)).fetchone()
+  declared = {col[1]: col[2].upper() for col in conn.execute(f'PRAGMA table_info({table_db_name})').fetchall() if not col[5]}
+  if table_sql is not None and table_sql[0].rstrip().upper().endswith('STRICT') and \
+    any([declared[col] != field_types[field_type]['sql'] for col, field_type in new_fields.items() if col in declared]):
+    rebuild_table(conn, table_db_name, new_fields)
+    return True
+  # Lookup fields are not searchable
+  build_search_index(conn, table_db_name)
+  return False
+
+# Function to register field types for tables ingested before the registry existed
+def backfill_fields(conn):
+  if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'columns'").fetchone() is None:
+    return
+  all_tables = get_all_table_names(conn)
+  all_rships = get_all_relationships(conn)
+  registered = get_fields_by_table(get_all_fields(conn))
+  for table_db_name in all_tables.table_db_name:
+    if table_db_name in registered:
+      continue
+    # One-off scan of the data; later requests only read the registry
+    df = pd.read_sql(f'SELECT * FROM {table_db_name}', conn)
+    fields = apply_lookup_fields(infer_field_types(df), table_db_name, all_rships)
+    register_fields(conn, table_db_name, fields)
+    index_datetime_fields(conn, table_db_name, fields)
+
+# Function to convert a value to the storage format of a field
+def coerce_field_value(column, field_type, value):
+  if value is None or (isinstance(value, str) and value == '' and field_type != 'Text'):
+    return None
+  try:
+    if field_type == 'Counter':
+      raise ValueError('read-only field')
+    if field_type in ['Integer', 'Lookup', 'User']:
+      if isinstance(value, bool) or float(value) % 1 != 0:
+        raise ValueError('not a whole number')
+      return int(float(value))
+    if field_type == 'Number':
+      if isinstance(value, bool):
+        raise ValueError('not a number')
+      return float(value)
+    if field_type == 'Boolean':
+      if str(value).lower() in ['true', '1']:
+        return 1
+      if str(value).lower() in ['false', '0']:
+        return 0
+      raise ValueError('not a boolean')
+    if field_type == 'DateTime':
+      return format_datetime(value)
+    if field_type == 'LookupMulti':
+      if isinstance(value, dict) and 'results' in value:
+        value = value['results']
+      if isinstance(value, str):
+        value = [elem for elem in value.split(',') if elem.strip()]
+      if not isinstance(value, list):
+        value = [value]
+      return ','.join([str(coerce_field_value(column, 'Lookup', elem)) for elem in value])
+    if isinstance(value, (dict, list)):
+      raise ValueError('not a text value')
+    return str(value)
+  except (TypeError, ValueError) as e:
+    raise BadRequest(f"Invalid value {json.dumps(value)} for {field_type} field '{column}': {e}.")
+
+# Function to map a create/update payload to columns and coerced values
+def parse_item_values(data, fields):
+  colnames = []
+  values = []
+  for k, v in data.items():
+    if k in ['Id', '__metadata']:
+      continue
+    # Convert implicit lookup column Id (e.g. parentObjectiveId)
+    if k not in fields and len(k) > 2 and k.endswith('Id') and k[:-2] in fields:
+      k = k[:-2]
+    if k not in fields:
+      raise BadRequest(f"Field '{k}' does not exist.")
+    colnames.append(k)
+    values.append(coerce_field_value(k, fields[k], v))
+  return colnames, values
+
+# Function to describe the fields of a list in SharePoint format
+def get_list_fields(table_db_name, fields, all_tables, all_rships):
+  output = []
+  for col, field_type in fields.items():
+    field = {
+      'InternalName': col,
+      'StaticName': col,
+      'Title': col,
+      'TypeAsString': field_type,
+      'FieldTypeKind': field_types[field_type]['kind'],
+      'ReadOnlyField': field_type == 'Counter'
+    }
+    if field_type in ['Lookup', 'LookupMulti', 'User']:
+      rship = all_rships.loc[all_rships.table_left.eq(table_db_name) & \
+        all_rships.table_left_on.eq(col)].to_dict('records')
+      if len(rship) > 0:
+        lookup_table = all_tables.loc[all_tables.table_db_name.eq(rship[0]['table_lookup'])].to_dict('records')
+        field['LookupList'] = lookup_table[0]['id'] if lookup_table else rship[0]['table_lookup']
+        field['LookupField'] = rship[0]['table_lookup_on']
+      field['AllowMultipleValues'] = field_type == 'LookupMulti'
+    output.append(field)
+  return output
+
 def translate_odata(database_uri, table_name, odata_query):
   from odata_query.sqlalchemy import apply_odata_query
   from sqlalchemy import create_engine, MetaData, Table
@@ -112,17 +414,120 @@ class NotEqualTo:
 
       raise ValidationError(message % d)
 
+# Function to type the literals that columns are compared with in a filter
+# Literals follow the registered field type of the column, so numeric fields compare as
+# numbers and text fields as quoted strings; `eq null` and `ne null` become IS (NOT) NULL
+def type_filter_literals(query, curr_db_table, fields):
+  literal_spans = [match.span() for match in re.finditer(r"'(?:[^']|'')*'", query)]
+
+  def type_comparison(match):
+    if any([start <= match.start() < end for start, end in literal_spans]):
+      return match.group(0)
+    column, op, literal = match.group(1), match.group(2), match.group(3)
+    table, col = column.split('.') if '.' in column else (curr_db_table, column)
+    table_fields = fields.get(table, {})
+    if literal.lower() == 'null':
+      if op in ['=', '!=']:
+        return f"{column} IS {'NOT ' if op == '!=' else ''}NULL"
+      return match.group(0)
+    field_type = table_fields.get(col)
+    # Leave untyped columns, datetime'' literals and column-to-column comparisons alone
+    if field_type is None or literal.lower().startswith('datetime') or \
+      literal in table_fields or literal.split('.')[-1] in fields.get(literal.split('.')[0], {}):
+      return match.group(0)
+    value = literal[1:-1].replace("''", "'") if literal.startswith("'") else literal
+    if field_type in numeric_field_types:
+      try:
+        number = float(value)
+        if not np.isfinite(number):
+          raise ValueError
+      except ValueError:
+        raise BadRequest(f"Invalid value {literal} for {field_type} field '{col}'.")
+      return f"{column} {op} {int(number) if number % 1 == 0 else number}"
+    if field_type == 'Boolean':
+      if value.lower() in ['true', '1']:
+        return f"{column} {op} 1"
+      if value.lower() in ['false', '0']:
+        return f"{column} {op} 0"
+      raise BadRequest(f"Invalid value {literal} for Boolean field '{col}'.")
+    return f"{column} {op} '{value.replace(chr(39), chr(39) * 2)}'"
+
+  return re.sub(r"(?<![\w'.])((?:\w+\.)?\w+)\s*(<=|>=|!=|=|<|>)\s*('(?:[^']|'')*'|[^\s()']+)",
+                type_comparison, query)
+
+# SQLite strftime formats for OData date functions
+date_functions = {
+  'year': '%Y',
+  'month': '%m',
+  'day': '%d',
+  'hour': '%H',
+  'minute': '%M',
+  'second': '%S'
+}
+
+# Function to convert an OData datetime literal to an ISO-8601 string
+# Literals use the stored format, e.g. `2022-03-01` -> `2022-03-01T00:00:00Z`
+def parse_odata_datetime(value):
+  # Same format as stored values, so that string comparisons order by time
+  try:
+    return format_datetime(value)
+  except ValueError:
+    raise BadRequest(f"Invalid datetime literal '{value}'.")
+
+# Function to compile a comparison between ISO-8601 prefixes into a range predicate
+# ISO-8601 strings sort by time, so every value in a period lies in [lower, upper)
+def compile_date_range(column, op, lower, upper):
+  return {
+    '=': f"({column} >= '{lower}' AND {column} < '{upper}')",
+    '!=': f"({column} < '{lower}' OR {column} >= '{upper}')",
+    '>': f"{column} >= '{upper}'",
+    '>=': f"{column} >= '{lower}'",
+    '<': f"{column} < '{lower}'",
+    '<=': f"{column} < '{upper}'"
+  }[op]
+
+# Function to compile OData date functions into SQL
+# year() comparisons, and year/month/day equality chains on one column, become range
+# predicates that can use an index on the column; other functions use strftime
+def parse_odata_date_functions(query):
+  # year(col) eq Y and month(col) eq M [and day(col) eq D]
+  def compile_date_chain(match):
+    column, year, month, day = match.group(1), int(match.group(2)), int(match.group(3)), match.group(4)
+    try:
+      if day is None:
+        lower = datetime(year, month, 1)
+        upper = datetime(year + month // 12, month % 12 + 1, 1)
+        return compile_date_range(column, '=', lower.strftime('%Y-%m'), upper.strftime('%Y-%m'))
+      lower = datetime(year, month, int(day))
+      upper = lower + timedelta(days=1)
+    except ValueError:
+      raise BadRequest(f"Invalid date {'-'.join([str(part) for part in [year, month, day] if part])} in $filter.")
+    return compile_date_range(column, '=', lower.strftime('%Y-%m-%d'), upper.strftime('%Y-%m-%d'))
+  query = re.sub(r"year\(((?:\w+\.)?\w+)\)\s*=\s*'?(\d+)'?\s+and\s+month\(\1\)\s*=\s*'?(\d+)'?" + \
+    r"(?:\s+and\s+day\(\1\)\s*=\s*'?(\d+)'?)?", compile_date_chain, query, flags=re.IGNORECASE)
+
+  # Single date functions
+  def compile_date_function(match):
+    func, column, op, value = match.group(1).lower(), match.group(2), match.group(3), int(match.group(4))
+    if func == 'year':
+      if not 1 <= value <= 9998:
+        raise BadRequest(f"Invalid year {value} in $filter.")
+      return compile_date_range(column, op, f'{value:04d}', f'{value + 1:04d}')
+    return f"CAST(strftime('{date_functions[func]}', {column}) AS INTEGER) {op} {value}"
+  query = re.sub(r"\b(year|month|day|hour|minute|second)\(((?:\w+\.)?\w+)\)\s*(<=|>=|!=|=|<|>)\s*'?(\d+)'?",
+                 compile_date_function, query, flags=re.IGNORECASE)
+  return query
+
 # Function to parse OData filters
-def parse_odata_filter(query, joins, curr_db_table):
+def parse_odata_filter(query, joins, curr_db_table, fields=None, search_columns=None):
   # Replace ID columns
   query = re.sub('^Id', f'{curr_db_table}.Id', query)
-  # Replace lookup column with the associated table
-  main_col_matches = re.findall('\w+\/', query)
-  main_col_replacements = []
-  for match in main_col_matches:
-    main_col_replacements.append(joins[match[:-1]]['table'])
-  for match, replacement in zip(main_col_matches, main_col_replacements):
-    query = re.sub(match, replacement + '.', query)
+  # Replace lookup paths (`lookup/col`, `lookup/nested/col`) with their table aliases
+  def replace_lookup_path(match):
+    if match.group(1) is None:
+      return match.group(0)
+    return parse_odata_column(match.group(1) + match.group(2), joins, curr_db_table)
+  query = re.sub(r"'(?:[^']|'')*'|((?:\w+\/)+)(\w+)", replace_lookup_path, query)
   
   # Replace slashes with dots
   # query = query.replace('/', '.')
@@ -148,7 +553,8 @@ def parse_odata_filter(query, joins, curr_db_table):
       sw_terms = re.sub('\).*', '', sw_terms)
       sw_terms = [s.strip() for s in sw_terms.split(',')]
       sw_terms[1] = re.sub('[^a-zA-Z0-9]', '', sw_terms[1])
-      query = re.sub(match.replace('(', '\(').replace(')', '\)'), f"{sw_terms[0]} LIKE '{sw_terms[1]}%'", query)
+      query = re.sub(match.replace('(', '\(').replace(')', '\)'),
+                     compile_like_filter(sw_terms[0], f'{sw_terms[1]}%', sw_terms[1], curr_db_table, search_columns), query)
       
   # substringof(string, column)
   matches_so = re.findall('substringof\(.*?\)', query, re.IGNORECASE)
@@ -159,19 +565,18 @@ def parse_odata_filter(query, joins, curr_db_table):
       so_terms = re.sub('\).*', '', so_terms)
       so_terms = [s.strip() for s in so_terms.split(',')]
       so_terms[0] = re.sub('[^a-zA-Z0-9]', '', so_terms[0])
-      query = re.sub(match.replace('(', '\(').replace(')', '\)'), f"{so_terms[1]} LIKE '%{so_terms[0]}%'", query)
+      query = re.sub(match.replace('(', '\(').replace(')', '\)'),
+                     compile_like_filter(so_terms[1], f'%{so_terms[0]}%', so_terms[0], curr_db_table, search_columns), query)
   
-  # day()
+  # Type literals by field
+  if fields:
+    query = type_filter_literals(query, curr_db_table, fields)
 
-  # month()
-  
-  # year()
-  
-  # hour()
-  
-  # minute()
-  
-  # second()
+  # datetime'...' literals
+  query = re.sub(r"datetime'([^']*)'", lambda match: f"'{parse_odata_datetime(match.group(1))}'", query)
+
+  # day(), month(), year(), hour(), minute(), second()
+  query = parse_odata_date_functions(query)
 
   return query
 
@@ -182,13 +587,26 @@ def parse_odata_query(query):
     'main_cols': [],
     'join_cols': [],
     'filter_query': '',
-    'expand_cols': []
+    'expand_cols': [],
+    'orderby_cols': [],
+    'top': None,
+    'apply': '',
+    'search': '',
+    'inlinecount': None
   }
   if not query:
     return output
   for query, value in query.items():
     if query == '$filter':
       output['filter_query'] = value
+    elif query == '$top':
+      output['top'] = value.strip()
+    elif query == '$apply':
+      output['apply'] = value.strip()
+    elif query == '$inlinecount':
+      output['inlinecount'] = value.strip()
+    elif query == '$search':
+      output['search'] = value.strip()
     else:
       columns = [v.strip() for v in value.split(',')]
       if query == '$select':    
@@ -199,10 +617,650 @@ def parse_odata_query(query):
             output['main_cols'].append(column)
       elif query == '$expand':
         output['expand_cols'].extend(columns)
+      elif query == '$orderby':
+        output['orderby_cols'].extend([column for column in columns if column])
+  return output
+
+# Function to map an OData column (`col` or `lookup/col`) to a SQL column
+def parse_odata_column(column, joins, curr_db_table):
+  if not re.fullmatch(r'\w+(\/\w+)*', column):
+    raise BadRequest(f"Invalid column '{column}'.")
+  if '/' not in column:
+    return f"{curr_db_table}.{column}"
+  lookup_path, lookup_table_col = column.rsplit('/', 1)
+  if lookup_path not in joins:
+    raise BadRequest(f'Lookup field {lookup_path} not specified in $expand parameter.')
+  if not joins[lookup_path]['joined']:
+    raise BadRequest(f"Field '{column}' is fetched separately for each item and cannot be used here.")
+  return f"{joins[lookup_path]['table']}.{lookup_table_col}"
+
+# Function to parse OData orderby
+def parse_odata_orderby(orderby_cols, joins, curr_db_table, aliases=None):
+  # Compile `col [asc|desc]` terms into plain column references so that SQLite
+  # can walk an index (or the rowid) instead of sorting the whole table
+  clauses = []
+  direction = 'ASC'
+  has_id = False
+  for term in orderby_cols:
+    parts = term.split()
+    if len(parts) not in [1, 2] or (len(parts) == 2 and parts[1].lower() not in ['asc', 'desc']):
+      raise BadRequest(f"Invalid $orderby term '{term}'. Use <column> [asc|desc].")
+    direction = parts[1].upper() if len(parts) == 2 else 'ASC'
+    column = parts[0]
+
+    # Aggregated results can only be sorted by their output columns
+    if aliases is not None:
+      alias = column.replace('/', '__')
+      if alias not in aliases:
+        raise BadRequest(f"Invalid $orderby column '{column}'. Use a groupby column or aggregate alias.")
+      clauses.append(f"\"{alias}\" {direction}")
+      continue
+
+    # Lookup columns are sorted on the joined lookup table
+    multi_paths = [path for path in get_lookup_paths(column) if path in joins and joins[path]['is_multi']]
+    if multi_paths:
+      raise BadRequest(f"Sorting by multi-lookup field '{multi_paths[0]}' is not supported.")
+    has_id = has_id or column == 'Id'
+    clauses.append(f"{parse_odata_column(column, joins, curr_db_table)} {direction}")
+
+  # Break ties on Id in the same direction as the last key; every SQLite index
+  # ends with the rowid, so the index still satisfies the full ORDER BY
+  if clauses and not has_id and aliases is None:
+    clauses.append(f"{curr_db_table}.Id {direction}")
+  return ', '.join(clauses)
+
+# Function to parse OData top
+def parse_odata_top(top):
+  if top is None:
+    return None
+  if not top.isdigit():
+    raise BadRequest(f"Invalid $top value '{top}'. Use a non-negative integer.")
+  return int(top)
+
+# Aggregation methods for $apply
+aggregate_methods = {
+  'count': 'COUNT({})',
+  'countdistinct': 'COUNT(DISTINCT {})',
+  'sum': 'SUM({})',
+  'average': 'AVG({})',
+  'min': 'MIN({})',
+  'max': 'MAX({})'
+}
+
+# Function to parse OData apply (RavenPoint extension)
+# Supports `groupby((cols))`, `aggregate(col with method as alias, ...)` and
+# `groupby((cols),aggregate(...))`
+def parse_odata_apply(apply, joins, curr_db_table):
+  group_cols = []
+  aggregates = []
+  groupby_match = re.fullmatch(r'groupby\(\((.*?)\)\s*(?:,\s*aggregate\((.*)\))?\)', apply)
+  aggregate_match = re.fullmatch(r'aggregate\((.*)\)', apply)
+  if groupby_match:
+    group_cols = [col.strip() for col in groupby_match.group(1).split(',') if col.strip()]
+    if groupby_match.group(2):
+      aggregates = [agg.strip() for agg in groupby_match.group(2).split(',')]
+  elif aggregate_match:
+    aggregates = [agg.strip() for agg in aggregate_match.group(1).split(',')]
+  else:
+    raise BadRequest("Invalid $apply. Use groupby((<columns>)), aggregate(<column> with <method> as <alias>) or both.")
+
+  output = {'select': [], 'group_by': [], 'aliases': []}
+  for col in group_cols:
+    sql_col = parse_odata_column(col, joins, curr_db_table)
+    alias = col.replace('/', '__')
+    output['select'].append(f"{sql_col} AS '{alias}'")
+    output['group_by'].append(sql_col)
+    output['aliases'].append(alias)
+  for agg in aggregates:
+    agg_match = re.fullmatch(r'(\S+)\s+with\s+(\w+)\s+as\s+(\w+)', agg)
+    if not agg_match or agg_match.group(2).lower() not in aggregate_methods:
+      raise BadRequest(f"Invalid aggregate '{agg}'. Use <column> with " + \
+        f"[{'|'.join(aggregate_methods.keys())}] as <alias>.")
+    col, method, alias = agg_match.groups()
+    sql_col = parse_odata_column(col, joins, curr_db_table)
+    output['select'].append(f"{aggregate_methods[method.lower()].format(sql_col)} AS '{alias}'")
+    output['aliases'].append(alias)
   return output
 
+# Function to get the lookup paths in a column or expression, e.g. `a/b/Title` -> ['a', 'a/b']
+def get_lookup_paths(text):
+  paths = []
+  for match in re.findall(r"((?:\w+\/)+)\w+", re.sub(r"'(?:[^']|'')*'", "''", text)):
+    segments = match[:-1].split('/')
+    paths.extend(['/'.join(segments[:depth]) for depth in range(1, len(segments) + 1)])
+  return list(dict.fromkeys(paths))
+
+# Function to plan $expand as a tree of lookups
+# Each expanded path (`lookup`, `lookup/nested`, ...) gets its own table alias, so a table can
+# be expanded more than once. Single lookups are joined, as they add no rows. Multi-lookups are
+# fetched with a secondary query per path (`owner` is the secondary query a lookup is selected
+# in), so the main query returns one row per item. Lookups that $filter or $apply refer to are
+# also joined into the main query (`joined`), for filtering only
+def plan_expand(expand_cols, all_rships, curr_db_table, referenced=()):
+  joins = {}
+  aliases = [curr_db_table]
+  for col in expand_cols:
+    segments = col.split('/')
+    for depth in range(1, len(segments) + 1):
+      path = '/'.join(segments[:depth])
+      if path in joins:
+        continue
+      parent = '/'.join(segments[:depth - 1]) or None
+      left_table = joins[parent]['lookup_table'] if parent else curr_db_table
+      rship = all_rships.loc[all_rships.table_left.eq(left_table) & \
+        all_rships.table_left_on.eq(segments[depth - 1])].to_dict('records')
+      if len(rship) == 0:
+        raise BadRequest(f"Relationship from field '{path}' does not exist.")
+      alias = rship[0]['table_lookup']
+      while alias in aliases:
+        alias = f"{rship[0]['table_lookup']}_{len(aliases)}"
+      aliases.append(alias)
+      is_multi = bool(rship[0]['is_multi'])
+      owner = path if is_multi else joins[parent]['owner'] if parent else None
+      joins[path] = {
+        'table': alias,
+        'table_pk': rship[0]['table_lookup_on'],
+        'is_multi': is_multi,
+        'lookup_table': rship[0]['table_lookup'],
+        'left_table': left_table,
+        'left_on': segments[depth - 1],
+        'parent': parent,
+        'owner': owner,
+        'joined': (parent is None or joins[parent]['joined']) and (owner is None or path in referenced)
+      }
+  return joins
+
+# Function to compile the joins for lookups, in the main query or in the secondary query of `owner`
+def compile_lookup_joins(joins, curr_db_table, owner=None):
+  join_clauses = {}
+  for path, node in joins.items():
+    if (owner is None and not node['joined']) or (owner is not None and (node['owner'] != owner or path == owner)):
+      continue
+    left_alias = joins[node['parent']]['table'] if node['parent'] else curr_db_table
+    lookup_table = node['lookup_table'] + (f" AS {node['table']}" if node['table'] != node['lookup_table'] else '')
+    if not node['is_multi']:
+      join_clauses[path] = f"LEFT JOIN {lookup_table}" + \
+        f" ON {left_alias}.{node['left_on']} = {node['table']}.{node['table_pk']}"
+    else:
+      junction_table = f"{node['left_table']}_{node['lookup_table']}"
+      junction_alias = junction_table if node['table'] == node['lookup_table'] else f"{node['table']}_junction"
+      join_clauses[path] = f"LEFT JOIN {junction_table}" + \
+        (f" AS {junction_alias}" if junction_alias != junction_table else '') + \
+        f" ON {left_alias}.Id = {junction_alias}.{node['left_table']}_pk " + \
+        f"LEFT JOIN {lookup_table} " + \
+        f"ON {junction_alias}.{node['lookup_table']}_pk = {node['table']}.{node['table_pk']}"
+  return join_clauses
+
+# Function to build a SQL query for list items from parsed OData params
+def build_list_query(params, all_rships, curr_db_table, check_select=True, all_fields=None):
+  # EXPAND - Plan the lookups in the query
+  for col in params['expand_cols']:
+    # Check if the column to expand was included in the selected columns ($apply selects its own)
+    if check_select and not params['apply'] and not any([join_col.startswith(col + '/') for join_col in params['join_cols']]):
+      raise BadRequest(f"The query to field '{col}' is not valid. The $select query string must specify the target fields and the $expand query string must contain {col}.")
+  joins = plan_expand(params['expand_cols'], all_rships, curr_db_table,
+                      get_lookup_paths(f"{params['filter_query']} {params['apply']}"))
+  secondary = {path: {'select': [], 'keys': []} for path, node in joins.items() if node['is_multi']}
+
+  # Process joins data; columns of multi-lookups are selected in their secondary query
+  # Without $select, every column of the list is returned
+  select_all = not params['main_cols'] and not params['join_cols']
+  main_join_cols = []
+  for col in params['join_cols']:
+    lookup_path, lookup_table_col = col.rsplit('/', 1)
+    if not lookup_path in joins:
+      raise BadRequest(f'Lookup field {lookup_path} not specified in $expand parameter.')
+    owner = joins[lookup_path]['owner']
+    sql_col = f"{joins[lookup_path]['table']}.{lookup_table_col}"
+    if owner is None:
+      main_join_cols.append(f"{sql_col} AS '{col.replace('/', '__')}'")
+    else:
+      secondary[owner]['select'].append(f"{sql_col} AS '{col[len(owner) + 1:].replace('/', '__')}'")
+  params['join_cols'] = main_join_cols
+
+  # Process filter; lookup aliases are typed as their tables
+  fields = get_fields_by_table(all_fields) if all_fields is not None else None
+  if fields is not None:
+    fields = {**fields, **{node['table']: fields.get(node['lookup_table'], {}) for node in joins.values()}}
+  search_columns = get_search_columns(all_fields) if all_fields is not None else {}
+  params['filter_query'] = parse_odata_filter(params['filter_query'], joins, curr_db_table, fields, search_columns)
+
+  # Process search
+  if params.get('search'):
+    search_query = compile_search(params['search'], curr_db_table, fields or {}, search_columns)
+    if search_query:
+      params['filter_query'] = f"({params['filter_query']}) AND {search_query}" if params['filter_query'] else search_query
+
+  # Process aggregations or selected columns, then sort order
+  join_clauses = compile_lookup_joins(joins, curr_db_table)
+  group_by = []
+  if params['apply']:
+    if params['main_cols'] or params['join_cols']:
+      raise BadRequest('$select cannot be combined with $apply.')
+    aggregation = parse_odata_apply(params['apply'], joins, curr_db_table)
+    select_aliases = aggregation['select']
+    group_by = aggregation['group_by']
+    params['orderby_query'] = parse_odata_orderby(params['orderby_cols'], joins, curr_db_table,
+                                                  aggregation['aliases'])
+  else:
+    # Add aliases to lookup tables
+    # Only the selected columns are read, always with the Id, so that clients can apply
+    # changes to items; lookup keys are added below as hidden columns
+    main_cols = params['main_cols'] if 'Id' in params['main_cols'] else ['Id'] + params['main_cols']
+    select_aliases = [f"{curr_db_table}.{col}" for col in main_cols] + params['join_cols']
+    if select_all:
+      select_aliases = [f"{curr_db_table}.*"]
+    params['orderby_query'] = parse_odata_orderby(params['orderby_cols'], joins, curr_db_table)
+    # Multi-lookups joined for $filter return one row per matching value
+    if any([joins[path]['is_multi'] for path in join_clauses]):
+      group_by = [f"{curr_db_table}.Id"]
+
+  # Secondary queries: each returns the lookup rows of a batch of parent Ids, which are
+  # selected from the query that owns the parent under a hidden key column
+  secondary_queries = []
+  for i, path in enumerate(secondary):
+    node = joins[path]
+    parent = joins.get(node['parent'])
+    key = f'_key_{i}'
+    key_select = f"{parent['table'] if parent else curr_db_table}.Id AS '{key}'"
+    parent_owner = None if parent is None else parent['owner']
+    if parent_owner is None:
+      select_aliases.append(key_select)
+    else:
+      secondary[parent_owner]['keys'].append(key_select)
+    secondary_queries.append({
+      'path': path,
+      'key': key,
+      'parent_owner': parent_owner,
+      'out_col': (path if parent_owner is None else path[len(parent_owner) + 1:]).replace('/', '__')
+    })
+  for secondary_query in secondary_queries:
+    node = joins[secondary_query['path']]
+    junction_table = f"{node['left_table']}_{node['lookup_table']}"
+    lookup_table = node['lookup_table'] + (f" AS {node['table']}" if node['table'] != node['lookup_table'] else '')
+    select = [f"{junction_table}.{node['left_table']}_pk AS '_parent'"] + \
+      secondary[secondary_query['path']]['select'] + secondary[secondary_query['path']]['keys']
+    secondary_query['sql'] = ' '.join([
+      f"SELECT {', '.join(select)}",
+      f"FROM {junction_table} JOIN {lookup_table}",
+      f"ON {junction_table}.{node['lookup_table']}_pk = {node['table']}.{node['table_pk']}",
+      *compile_lookup_joins(joins, curr_db_table, secondary_query['path']).values(),
+      f"WHERE {junction_table}.{node['left_table']}_pk IN ({{ids}})",
+      f"ORDER BY {junction_table}.Id"
+    ])
+
+  return {
+    'table': curr_db_table,
+    'select': select_aliases,
+    'joins': joins,
+    'join_clauses': join_clauses,
+    'secondary': [] if params['apply'] else secondary_queries,
+    'where': params['filter_query'],
+    'group_by': group_by,
+    'order_by': params['orderby_query'],
+    'aggregate': bool(params['apply'])
+  }
+
+# Function to compile a list query into SQL
+def compile_list_query(query, top=None):
+  sql_query = []
+  sql_query.append(f"SELECT {', '.join(query['select'])}")
+  sql_query.append(f"FROM {query['table']}")
+  sql_query.extend(query['join_clauses'].values())
+  if query['where']:
+    sql_query.append(f"WHERE {query['where']}")
+  if query['group_by']:
+    sql_query.append(f"GROUP BY {', '.join(query['group_by'])}")
+  if query['order_by']:
+    sql_query.append(f"ORDER BY {query['order_by']}")
+  if top is not None:
+    sql_query.append(f"LIMIT {top}")
+  return ' '.join(sql_query)
+
+# Function to compile a count query for list items
+# Aggregated queries return one row per group, so their groups are counted
+def compile_count_query(query):
+  if query['aggregate']:
+    return f"SELECT COUNT(*) FROM ({compile_list_query({**query, 'order_by': ''})})"
+  # Lookup joins that the filter does not reference cannot remove rows, so they are skipped;
+  # the joins that referenced lookups are nested under are kept
+  referenced = [path for path in query['join_clauses'].keys() \
+    if re.search(rf"\b{query['joins'][path]['table']}\.", query['where'])]
+  join_paths = [path for path in query['join_clauses'].keys() \
+    if any([col == path or col.startswith(path + '/') for col in referenced])]
+  # Multi-lookup joins return one row per lookup value
+  if any([query['joins'][path]['is_multi'] for path in join_paths]):
+    count_expr = f"COUNT(DISTINCT {query['table']}.Id)"
+  else:
+    count_expr = 'COUNT(*)'
+  sql_query = []
+  sql_query.append(f"SELECT {count_expr}")
+  sql_query.append(f"FROM {query['table']}")
+  sql_query.extend([query['join_clauses'][path] for path in join_paths])
+  if query['where']:
+    sql_query.append(f"WHERE {query['where']}")
+  return ' '.join(sql_query)
+
+# Function to open a read-only snapshot of the database
+# In WAL mode, every read in the transaction sees the same committed state, even
+# while an admin task is replacing tables, and never waits on the write lock
+@contextmanager
+def read_snapshot():
+  conn = get_connection()
+  try:
+    conn.execute('BEGIN')
+    yield conn
+  finally:
+    conn.rollback()
+    conn.close()
+
+# Function to replace a table's contents without exposing a missing or partial table
+# The data is written to a shadow table first, then swapped in with a single transaction
+def replace_table(conn, df, table_name, fields, primary_key='Id'):
+  shadow_table = f'{table_name}__shadow'
+  # DateTime values are stored in one format, as the API writes them
+  df = df.assign(**{col: normalize_datetime_values(df[col]) for col, field_type in fields.items() \
+    if field_type == 'DateTime' and col in df.columns})
+  conn.execute(f'DROP TABLE IF EXISTS {shadow_table}')
+  conn.execute(create_table_sql(shadow_table, fields, primary_key))
+  df.to_sql(shadow_table, con=conn, if_exists='append', index=False)
+  conn.commit()
+  swap_shadow_table(conn, table_name)
+  index_datetime_fields(conn, table_name, fields)
+  change_token = record_change(conn, table_name, None, 'Reset')
+  conn.commit()
+  publish_change(table_name, change_token, None, 'Reset')
+
+# Function to swap a fully written shadow table in for a table in one transaction
+def swap_shadow_table(conn, table_name):
+  shadow_table = f'{table_name}__shadow'
+  try:
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute(f'DROP TABLE IF EXISTS {table_name}')
+    conn.execute(f'ALTER TABLE {shadow_table} RENAME TO {table_name}')
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    conn.execute(f'DROP TABLE IF EXISTS {shadow_table}')
+    conn.commit()
+    raise
+
+# Function to build a multi-lookup junction table and keep it in sync with the left table
+# Comma-separated Ids in the lookup column are exploded in SQL; triggers on the left table
+# then maintain the junction rows incrementally on every insert, update and delete
+def build_junction_table(conn, table_left, table_left_on, table_lookup):
+  fill_junction_shadow(conn, table_left, table_left_on, table_lookup)
+  try:
+    conn.execute('BEGIN IMMEDIATE')
+    swap_junction_table(conn, table_left, table_left_on, table_lookup)
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    drop_junction_shadow(conn, table_left, table_lookup)
+    raise
+
+# Function to fill the shadow table of a junction table from the left table
+def fill_junction_shadow(conn, table_left, table_left_on, table_lookup):
+  shadow_table = f'{table_left}_{table_lookup}__shadow'
+  conn.execute(f'DROP TABLE IF EXISTS {shadow_table}')
+  conn.execute(f'''CREATE TABLE {shadow_table} (Id INTEGER PRIMARY KEY, \
+{table_left}_pk INTEGER, {table_lookup}_pk INTEGER)''')
+  conn.execute(f'''INSERT INTO {shadow_table} ({table_left}_pk, {table_lookup}_pk) \
+SELECT {table_left}.Id, CAST(ids.value AS INTEGER) \
+FROM {table_left}, json_each('[' || {table_left}.{table_left_on} || ']') AS ids''')
+  conn.commit()
+
+# Function to drop the shadow table of a junction table, e.g. after a failed swap
+def drop_junction_shadow(conn, table_left, table_lookup):
+  conn.execute(f'DROP TABLE IF EXISTS {table_left}_{table_lookup}__shadow')
+  conn.commit()
+
+# Function to swap in a filled junction table, then index it and attach the triggers
+# Runs in the caller's transaction, so that the triggers can switch with other changes
+def swap_junction_table(conn, table_left, table_left_on, table_lookup):
+  junction_table = f'{table_left}_{table_lookup}'
+  insert_rows = f'''INSERT INTO {junction_table} ({table_left}_pk, {table_lookup}_pk) \
+SELECT NEW.Id, CAST(value AS INTEGER) FROM json_each('[' || NEW.{table_left_on} || ']');'''
+  delete_rows = f'DELETE FROM {junction_table} WHERE {table_left}_pk = OLD.Id;'
+  drop_junction_triggers(conn, table_left, table_lookup)
+  conn.execute(f'DROP TABLE IF EXISTS {junction_table}')
+  conn.execute(f'ALTER TABLE {junction_table}__shadow RENAME TO {junction_table}')
+  conn.execute(f'CREATE INDEX ix_{junction_table}_{table_left}_pk ON {junction_table} ({table_left}_pk)')
+  conn.execute(f'CREATE INDEX ix_{junction_table}_{table_lookup}_pk ON {junction_table} ({table_lookup}_pk)')
+  conn.execute(f'''CREATE TRIGGER {junction_table}_insert AFTER INSERT ON {table_left} \
+BEGIN {insert_rows} END''')
+  conn.execute(f'''CREATE TRIGGER {junction_table}_update AFTER UPDATE OF {table_left_on} ON {table_left} \
+BEGIN {delete_rows} {insert_rows} END''')
+  conn.execute(f'''CREATE TRIGGER {junction_table}_delete AFTER DELETE ON {table_left} \
+BEGIN {delete_rows} END''')
+
+# Function to drop the triggers that maintain a junction table
+def drop_junction_triggers(conn, table_left, table_lookup):
+  for action in ['insert', 'update', 'delete']:
+    conn.execute(f'DROP TRIGGER IF EXISTS {table_left}_{table_lookup}_{action}')
+
+# Function to drop a multi-lookup junction table and its triggers
+def drop_junction_table(conn, table_left, table_lookup):
+  drop_junction_triggers(conn, table_left, table_lookup)
+  conn.execute(f'DROP TABLE IF EXISTS {table_left}_{table_lookup}')
+
+# Function to plan the junction table changes of a relationship edit
+# `old` and `new` are the relationship before and after the edit (None when it is created or
+# deleted). Returns the steps, e.g. [('drop', 'krs', 'tags'), ('build', 'krs', 'krTags', 'tags')];
+# an edit that keeps the junction's source needs none, and a junction that keeps its name is
+# rebuilt by swapping in the new one, without dropping it first
+def plan_junction_migration(old, new):
+  get_source = lambda rship: (rship['table_left'], rship['table_left_on'], rship['table_lookup']) \
+    if rship is not None and rship['is_multi'] else None
+  old_source = get_source(old)
+  new_source = get_source(new)
+  if old_source == new_source:
+    return []
+  steps = []
+  if old_source is not None and (new_source is None or (old_source[0], old_source[2]) != (new_source[0], new_source[2])):
+    steps.append(('drop', old_source[0], old_source[2]))
+  if new_source is not None:
+    steps.append(('build', *new_source))
+  return steps
+
+# Function to count the rows of a relationship's table that refer to missing lookup items
+# Anti-joins probe the lookup table's primary key (multi-lookups start from the junction table),
+# so neither table is read into memory. Returns the orphaned rows and the missing references
+def count_orphans(conn, table_left, table_left_on, table_lookup, is_multi):
+  if is_multi:
+    junction_table = f'{table_left}_{table_lookup}'
+    sql_query = f'''SELECT COUNT(DISTINCT j.{table_left}_pk), COUNT(*) FROM {junction_table} AS j \
+WHERE NOT EXISTS (SELECT 1 FROM {table_lookup} AS l WHERE l.Id = j.{table_lookup}_pk)'''
+  else:
+    sql_query = f'''SELECT COUNT(*), COUNT(*) FROM {table_left} AS t \
+WHERE t.{table_left_on} IS NOT NULL AND t.{table_left_on} != '' \
+AND NOT EXISTS (SELECT 1 FROM {table_lookup} AS l WHERE l.Id = t.{table_left_on})'''
+  rows, references = conn.execute(sql_query).fetchone()
+  return {'rows': rows, 'references': references}
+
+# FULL-TEXT SEARCH
+# Lists can opt in to an FTS5 index over selected Text fields. The index is an external
+# content table with the trigram tokenizer, kept in sync by triggers, so substring searches
+# read only the matching rows instead of scanning the list.
+
+# The trigram tokenizer needs SQLite 3.34+; on older versions searchable fields are not
+# indexed, and searches fall back to LIKE
+search_index_available = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+# Function to (re)build the search index of a table from its searchable fields
+# Tables are swapped in on upload, which drops their triggers; call this afterwards
+def build_search_index(conn, table_db_name):
+  fts_table = f'{table_db_name}_fts'
+  columns = [row[0] for row in conn.execute(
+    'SELECT column_name FROM columns WHERE table_db_name = ? AND searchable ORDER BY position',
+    (table_db_name,)).fetchall()]
+  col_list = ', '.join([f'"{col}"' for col in columns])
+  insert_row = f'''INSERT INTO {fts_table} (rowid, {col_list}) \
+VALUES (NEW.Id, {', '.join([f'NEW."{col}"' for col in columns])});'''
+  delete_row = f'''INSERT INTO {fts_table} ({fts_table}, rowid, {col_list}) \
+VALUES ('delete', OLD.Id, {', '.join([f'OLD."{col}"' for col in columns])});'''
+  try:
+    conn.execute('BEGIN IMMEDIATE')
+    drop_search_index(conn, table_db_name)
+    if columns and search_index_available:
+      conn.execute(f'''CREATE VIRTUAL TABLE {fts_table} USING fts5({col_list}, \
+content='{table_db_name}', content_rowid='Id', tokenize='trigram')''')
+      conn.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+      conn.execute(f'''CREATE TRIGGER {fts_table}_insert AFTER INSERT ON {table_db_name} \
+BEGIN {insert_row} END''')
+      conn.execute(f'''CREATE TRIGGER {fts_table}_update AFTER UPDATE OF {col_list} ON {table_db_name} \
+BEGIN {delete_row} {insert_row} END''')
+      conn.execute(f'''CREATE TRIGGER {fts_table}_delete AFTER DELETE ON {table_db_name} \
+BEGIN {delete_row} END''')
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
+
+# Function to drop the search index of a table and its triggers
+def drop_search_index(conn, table_db_name):
+  for action in ['insert', 'update', 'delete']:
+    conn.execute(f'DROP TRIGGER IF EXISTS {table_db_name}_fts_{action}')
+  conn.execute(f'DROP TABLE IF EXISTS {table_db_name}_fts')
+
+# Function to compile a LIKE filter, narrowed through the search index where one exists
+# The trigram index needs at least 3 characters; the LIKE keeps the exact semantics
+def compile_like_filter(column, pattern, term, curr_db_table, search_columns):
+  like_filter = f"{column} LIKE '{pattern}'"
+  table, col = column.split('.') if '.' in column else (curr_db_table, column)
+  if not search_index_available or not search_columns or col not in search_columns.get(table, []) or len(term) < 3:
+    return like_filter
+  return f"""({table}.Id IN (SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH '{col} : "{term}"') \
+AND {like_filter})"""
+
+# Function to compile a $search query
+# Every term must appear in one of the searchable fields (or, if there are none, any Text field)
+def compile_search(search, curr_db_table, fields, search_columns):
+  terms = [term.strip('"') for term in re.findall(r'"[^"]*"|\S+', search) if term.strip('"')]
+  searchable_cols = search_columns.get(curr_db_table, [])
+  indexed_cols = searchable_cols if search_index_available else []
+  text_cols = searchable_cols or [col for col, field_type in fields.get(curr_db_table, {}).items() if field_type == 'Text']
+  if not text_cols:
+    raise BadRequest('$search is not available for this list: it has no Text fields.')
+  predicates = []
+  for term in terms:
+    if indexed_cols and len(term) >= 3:
+      fts_query = '"' + term.replace('"', '""') + '"'
+      predicates.append(f"{curr_db_table}.Id IN (SELECT rowid FROM {curr_db_table}_fts WHERE \
+{curr_db_table}_fts MATCH '{fts_query.replace(chr(39), chr(39) * 2)}')")
+    else:
+      pattern = re.sub(r'([\\%_])', r'\\\1', term).replace("'", "''")
+      predicates.append('(' + ' OR '.join([f'''{curr_db_table}."{col}" LIKE '%{pattern}%' ESCAPE '\\' '''.strip() \
+        for col in text_cols]) + ')')
+  return ' AND '.join(predicates)
+
+# CHANGE TRACKING
+# Write endpoints stamp items with Modified and a version number, and log every change.
+# The change log id is the change token: clients pass back the last token they saw and
+# read only the items changed since, instead of re-fetching the whole list.
+change_fields = {'Modified': 'DateTime', 'owshiddenversion': 'Integer'}
+
+# Function to add the Modified and version fields to a list that lacks them
+def ensure_change_fields(conn, table_db_name):
+  declared = [col[1] for col in conn.execute(f'PRAGMA table_info({table_db_name})').fetchall()]
+  new_fields = {col: field_type for col, field_type in change_fields.items() if col not in declared}
+  if not new_fields:
+    return
+  position = conn.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM columns WHERE table_db_name = ?',
+                          (table_db_name,)).fetchone()[0]
+  for col, field_type in new_fields.items():
+    conn.execute(f'ALTER TABLE {table_db_name} ADD COLUMN {col} {field_types[field_type]["sql"]}')
+  conn.executemany(
+    'INSERT OR REPLACE INTO columns (id, table_db_name, column_name, field_type, position, searchable) VALUES (?, ?, ?, ?, ?, 0)',
+    [(hashlib.md5(f'{table_db_name}.{col}'.encode()).hexdigest(), table_db_name, col, field_type, position + i) \
+      for i, (col, field_type) in enumerate(new_fields.items())]
+  )
+  conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{table_db_name}_Modified" ON {table_db_name} ("Modified")')
+
+# Function to log a change; the caller commits
+# `Reset` marks a bulk replacement of the list, after which clients must sync in full
+def record_change(conn, table_db_name, item_id, change_type):
+  cursor = conn.execute(
+    'INSERT INTO changes (table_db_name, item_id, change_type, changed_at) VALUES (?, ?, ?, ?)',
+    (table_db_name, item_id, change_type, datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'))
+  )
+  return cursor.lastrowid
+
+# Function to create, update or delete an item and log the change in one transaction
+# Subscribers to the list are notified once the change is committed
+def write_list_item(conn, table_db_name, change_type, colnames=None, values=None, item_id=None):
+  modified = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+  pairs = [(col, value) for col, value in zip(colnames or [], values or []) if col not in change_fields]
+  colnames, values = [col for col, _ in pairs], [value for _, value in pairs]
+  try:
+    conn.execute('BEGIN IMMEDIATE')
+    ensure_change_fields(conn, table_db_name)
+    if change_type == 'Add':
+      query = f'''INSERT INTO {table_db_name} ({', '.join(colnames + list(change_fields))}) \
+VALUES ({', '.join(['?'] * (len(colnames) + len(change_fields)))})'''
+      item_id = conn.execute(query, values + [modified, 1]).lastrowid
+    elif change_type == 'Update':
+      # Items from before the list was tracked have no version yet; they count as version 1
+      query = f'''UPDATE {table_db_name} \
+SET {', '.join([f'{k} = ?' for k in colnames] + ['Modified = ?', 'owshiddenversion = COALESCE(owshiddenversion, 1) + 1'])} \
+WHERE Id = ?'''
+      conn.execute(query, values + [modified, int(item_id)])
+    else:
+      query = f'DELETE FROM {table_db_name} WHERE Id = ?'
+      conn.execute(query, (int(item_id),))
+    change_token = record_change(conn, table_db_name, int(item_id), change_type)
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
+  publish_change(table_db_name, change_token, int(item_id), change_type,
+                 None if change_type == 'Delete' else {**dict(zip(colnames, values)), 'Modified': modified})
+  return query, item_id
+
+# Function to parse a change token
+# SharePoint tokens (`1;3;<list id>;<ticks>;<change number>`) end with the change number
+def parse_change_token(token):
+  if token is None or str(token).strip() == '':
+    return None
+  change_number = str(token).split(';')[-1].strip()
+  if not change_number.isdigit():
+    raise BadRequest(f"Invalid change token '{token}'.")
+  return int(change_number)
+
+# Function to get the latest change token
+def get_latest_change_token(conn):
+  return conn.execute('SELECT COALESCE(MAX(id), 0) FROM changes').fetchone()[0]
+
+# Function to list the changes to a list since a token as events, oldest first
+# Returns a single Reset event if the list was replaced or more than `limit` changes were missed
+def get_change_events(conn, table_db_name, token, limit):
+  changes = conn.execute(
+    'SELECT id, item_id, change_type FROM changes WHERE table_db_name = ? AND id > ? ORDER BY id LIMIT ?',
+    (table_db_name, token, limit + 1)
+  ).fetchall()
+  if len(changes) > limit or any([change_type == 'Reset' for _, _, change_type in changes]):
+    return [{'changeToken': str(get_latest_change_token(conn)), 'changeType': 'Reset', 'Id': None}]
+  return [{'changeToken': str(change_id), 'changeType': change_type, 'Id': item_id} \
+    for change_id, item_id, change_type in changes]
+
+# Function to summarise the changes to a list since a token
+# Returns None if the list must be synced in full (no token, or the list was replaced since)
+def get_changes_since(conn, table_db_name, token):
+  if token is None:
+    return None
+  changes = conn.execute(
+    '''SELECT item_id, change_type FROM changes WHERE id IN \
+(SELECT MAX(id) FROM changes WHERE table_db_name = ? AND id > ? GROUP BY item_id)''',
+    (table_db_name, token)
+  ).fetchall()
+  if any([change_type == 'Reset' for _, change_type in changes]):
+    return None
+  return {
+    'changed': [item_id for item_id, change_type in changes if change_type != 'Delete'],
+    'deleted': [item_id for item_id, change_type in changes if change_type == 'Delete']
+  }
+
 # Function to validate create/update query
-conn_string = app.config['SQLALCHEMY_DATABASE_URI'].replace('sqlite:///', '')
 def validate_create_update_query(headers, data, list_id, update=False, item_id=None):
   # 1. Check headers
   xRequestDigest = headers.get('X-RequestDigest')
@@ -225,7 +1283,7 @@ def validate_create_update_query(headers, data, list_id, update=False, item_id=N
 
   # 3. Check ListItemEntityTypeFullName (LIETFN)
   # Check if list exists
-  with sqlite3.connect(conn_string) as conn:
+  with get_connection() as conn:
     all_tables = get_all_table_names(conn)
   if list_id not in all_tables.id.tolist():
     return { 'BadRequest': 'List does not exist.' }
@@ -242,16 +1300,17 @@ def validate_create_update_query(headers, data, list_id, update=False, item_id=N
   if request_lietfn != lietfn:
     return { 'BadRequest': 'Incorrect ListItemEntityTypeFullName.' }
 
-  # Check if item exists
-  with sqlite3.connect(conn_string) as conn:
-    df = pd.read_sql(f"SELECT * FROM {table['table_db_name']}", conn)
-  if update and int(item_id) not in df.Id.values:
-    return { 'BadRequest': 'Item does not exist.' }
+  # Get field types; check if item exists
+  with get_connection() as conn:
+    fields = get_table_fields(conn, table['table_db_name'])
+    if update and conn.execute(f"SELECT 1 FROM {table['table_db_name']} WHERE Id = ?",
+                               (int(item_id),)).fetchone() is None:
+      return { 'BadRequest': 'Item does not exist.' }
   
   return { 
     'Success': True,
     'table': table['table_db_name'],
-    'data': df
+    'fields': fields
   }
 
 def validate_delete_query(headers, list_id, item_id=None):
@@ -271,7 +1330,7 @@ def validate_delete_query(headers, list_id, item_id=None):
 
   # 3. Check ListItemEntityTypeFullName (LIETFN)
   # Check if list exists
-  with sqlite3.connect(conn_string) as conn:
+  with get_connection() as conn:
     all_tables = get_all_table_names(conn)
   if list_id not in all_tables.id.tolist():
     return { 'BadRequest': 'List does not exist.' }
@@ -281,15 +1340,14 @@ def validate_delete_query(headers, list_id, item_id=None):
       .loc[all_tables.id.eq(list_id)].to_dict('records')[0]
 
   # Check if item exists
-  with sqlite3.connect(conn_string) as conn:
-    df = pd.read_sql(f"SELECT * FROM {table['table_db_name']}", conn)
-  if int(item_id) not in df.Id.values:
-    return { 'BadRequest': 'Item does not exist.' }
+  with get_connection() as conn:
+    if conn.execute(f"SELECT 1 FROM {table['table_db_name']} WHERE Id = ?",
+                    (int(item_id),)).fetchone() is None:
+      return { 'BadRequest': 'Item does not exist.' }
   
   return { 
     'Success': True,
-    'table': table['table_db_name'],
-    'data': df
+    'table': table['table_db_name']
   }
 
 def validate_create_update_query_listname(headers, data, list_name, update=False, item_id=None):
@@ -314,7 +1372,7 @@ def validate_create_update_query_listname(headers, data, list_name, update=False
 
   # 3. Check ListItemEntityTypeFullName (LIETFN)
   # Check if list exists
-  with sqlite3.connect(conn_string) as conn:
+  with get_connection() as conn:
     all_tables = get_all_table_names(conn)
   if list_name not in all_tables.table_name.tolist():
     return { 'BadRequest': 'List does not exist.' }
@@ -332,16 +1390,17 @@ def validate_create_update_query_listname(headers, data, list_name, update=False
   if request_lietfn != lietfn:
     return { 'BadRequest': 'Incorrect ListItemEntityTypeFullName.' }
 
-  # Check if item exists
-  with sqlite3.connect(conn_string) as conn:
-    df = pd.read_sql(f"SELECT * FROM {table['table_db_name']}", conn)
-  if update and int(item_id) not in df.Id.values:
-    return { 'BadRequest': 'Item does not exist.' }
+  # Get field types; check if item exists
+  with get_connection() as conn:
+    fields = get_table_fields(conn, table['table_db_name'])
+    if update and conn.execute(f"SELECT 1 FROM {table['table_db_name']} WHERE Id = ?",
+                               (int(item_id),)).fetchone() is None:
+      return { 'BadRequest': 'Item does not exist.' }
   
   return { 
     'Success': True,
     'table': table['table_db_name'],
-    'data': df
+    'fields': fields
   }
 
 
@@ -365,7 +1424,7 @@ def validate_delete_query_listname(headers, list_name, item_id=None):
 
   # 3. Check ListItemEntityTypeFullName (LIETFN)
   # Check if list exists
-  with sqlite3.connect(conn_string) as conn:
+  with get_connection() as conn:
     all_tables = get_all_table_names(conn)
   if list_name not in all_tables.table_name.tolist():
     return { 'BadRequest': 'List does not exist.' }
@@ -375,31 +1434,237 @@ def validate_delete_query_listname(headers, list_name, item_id=None):
       .loc[all_tables.table_name.eq(list_name)].to_dict('records')[0]
 
   # Check if item exists
-  with sqlite3.connect(conn_string) as conn:
-    df = pd.read_sql(f"SELECT * FROM {table['table_db_name']}", conn)
-  if int(item_id) not in df.Id.values:
-    return { 'BadRequest': 'Item does not exist.' }
+  with get_connection() as conn:
+    if conn.execute(f"SELECT 1 FROM {table['table_db_name']} WHERE Id = ?",
+                    (int(item_id),)).fetchone() is None:
+      return { 'BadRequest': 'Item does not exist.' }
   
   return { 
     'Success': True,
-    'table': table['table_db_name'],
-    'data': df
+    'table': table['table_db_name']
   }
 
 
 
-def validate_file_query(header,filename):
+# USER DIRECTORY
+# Simulated site users live in the rpusers table. Email and Title are indexed so that
+# people-picker lookups never scan the table.
+users_table = 'rpusers'
+users_email_domain = '@defencemail.gov.sg'
+_current_user_cache = {}
+
+# Function to create the users table and its lookup indexes
+def ensure_user_table(conn):
+  conn.execute(f'''CREATE TABLE IF NOT EXISTS {users_table} \
+(Id INTEGER PRIMARY KEY, Title text, Email text COLLATE NOCASE)''')
+  conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{users_table}_Email ON {users_table} (Email COLLATE NOCASE)')
+  conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{users_table}_Title ON {users_table} (Title)')
+  conn.commit()
+
+# Function to query users as a list of dicts
+def query_users(conn, where='', args=()):
+  cursor = conn.execute(f'SELECT * FROM {users_table} {where}', args)
+  cols = [col[0] for col in cursor.description]
+  return [dict(zip(cols, row)) for row in cursor.fetchall()]
+
+# Function to get a user by Id
+def get_user_by_id(conn, id):
+  users = query_users(conn, 'WHERE Id = ?', (id,))
+  return users[0] if users else None
+
+# Function to get a user by email (case-insensitive)
+def get_user_by_email(conn, email):
+  users = query_users(conn, 'WHERE Email = ? COLLATE NOCASE LIMIT 1', (email.strip(),))
+  return users[0] if users else None
+
+# Function to get the current user (the first user in the table)
+# The result is cached until the users table is changed through RavenPoint
+def get_current_user(conn):
+  if get_site() not in _current_user_cache:
+    users = query_users(conn, 'ORDER BY Id LIMIT 1')
+    if not users:
+      return None
+    _current_user_cache[get_site()] = users[0]
+  return _current_user_cache[get_site()]
+
+# Function to clear cached user lookups after the users table changes
+def clear_user_cache():
+  _current_user_cache.pop(get_site(), None)
+
+# Function to get a user by logon name, creating the user if they do not exist
+# Claims-encoded names (i:0#.f|membership|user@domain) are reduced to the last segment
+def ensure_user(conn, logon_name):
+  login = str(logon_name).split('|')[-1].strip()
+  if not login or not re.match(r'^[\w\.\-@]+$', login):
+    raise BadRequest(f"Invalid logonName '{logon_name}'.")
+  if '@' in login:
+    where, args = 'WHERE Email = ? COLLATE NOCASE LIMIT 1', (login,)
+    title, email = login.split('@')[0], login
+  else:
+    where, args = 'WHERE Title = ? LIMIT 1', (login,)
+    title, email = login, login + users_email_domain
+
+  # Look up and create in one write transaction so concurrent calls cannot duplicate users
+  conn.execute('BEGIN IMMEDIATE')
+  try:
+    users = query_users(conn, where, args)
+    if users:
+      conn.rollback()
+      return users[0]
+    cursor = conn.execute(f'INSERT INTO {users_table} (Title, Email) VALUES (?, ?)', (title, email))
+    user_id = cursor.lastrowid
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
+  clear_user_cache()
+  return get_user_by_id(conn, user_id)
+
+
+# DOCUMENT STORE
+# File contents are stored once per SHA-256 hash under DOCUMENTS_FOLDER/.store, and the
+# documents table maps each folder and file name to a hash. Uploads are streamed to
+# disk in chunks, so large files are never held in memory.
+default_folder = 'Shared Documents'
+
+# Function to normalise a server-relative folder URL
+def normalize_folder(folder_url):
+  return folder_url.strip().strip('/')
+
+# Function to get the documents folder of the current site; site collections keep their own
+def get_documents_folder():
+  if get_site() is None:
+    return app.config['DOCUMENTS_FOLDER']
+  return os.path.join(app.config['DOCUMENTS_FOLDER'], '.sites', get_site())
+
+# Function to get the path of a stored blob
+def get_blob_path(hash):
+  return os.path.join(get_documents_folder(), '.store', hash[:2], hash)
+
+# Function to stream a file object into the store; identical contents are stored once
+def store_blob(stream, chunk_size=1024 * 1024):
+  tmp_dir = os.path.join(get_documents_folder(), '.store', 'tmp')
+  os.makedirs(tmp_dir, exist_ok=True)
+  sha256 = hashlib.sha256()
+  size = 0
+  with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as f:
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+      sha256.update(chunk)
+      f.write(chunk)
+      size += len(chunk)
+  hash = sha256.hexdigest()
+  blob_path = get_blob_path(hash)
+  if os.path.exists(blob_path):
+    os.remove(f.name)
+  else:
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    os.replace(f.name, blob_path)
+  return hash, size
+
+# Function to delete a blob once no document refers to it
+def release_blob(hash):
+  if Document.query.filter_by(hash=hash).first() is None and os.path.exists(get_blob_path(hash)):
+    os.remove(get_blob_path(hash))
+
+# Function to add or replace a document from a file object
+def store_document(folder, name, stream):
+  hash, size = store_blob(stream)
+  existing = get_document(folder, name, import_legacy=False)
+  old_hash = existing.hash if existing is not None else None
+  document = db.session.merge(Document(folder, name, size, hash, time.time()))
+  db.session.commit()
+  if old_hash is not None and old_hash != hash:
+    release_blob(old_hash)
+  return document
+
+# Function to look up a document by folder and name
+# Files placed directly in the documents folder (e.g. through a Docker volume) are
+# moved into the store as Shared Documents on first access
+def get_document(folder, name, import_legacy=True):
+  document = Document.query.get(hashlib.md5(f'{folder}/{name}'.encode()).hexdigest())
+  if document is None and import_legacy and folder == default_folder and get_site() is None:
+    filepath = safe_join(app.config['DOCUMENTS_FOLDER'], name)
+    if filepath is not None and os.path.isfile(filepath):
+      with open(filepath, 'rb') as f:
+        document = store_document(folder, name, f)
+      os.remove(filepath)
+  return document
+
+# Function to import all files placed directly in the documents folder
+def import_legacy_documents():
+  for entry in os.scandir(app.config['DOCUMENTS_FOLDER']):
+    if entry.is_file():
+      get_document(default_folder, entry.name)
+
+# Function to list the documents and subfolders of a folder
+def list_folder(folder):
+  documents = Document.query.filter_by(folder=folder).order_by(Document.name).all()
+  subfolders = db.session.query(Document.folder).distinct() \
+    .filter(Document.folder.like(f'{folder}/%')).all()
+  subfolders = sorted(set([sub[0][len(folder) + 1:].split('/')[0] for sub in subfolders]))
+  return documents, subfolders
+
+# Function to remove a document from the store
+def remove_document(folder, name):
+  document = get_document(folder, name)
+  if document is not None:
+    db.session.delete(document)
+    db.session.commit()
+    release_blob(document.hash)
+
+# Function to get the staging file of a chunked upload
+def get_upload_path(upload_id):
+  if not re.fullmatch(r'[0-9a-fA-F\-]+', upload_id):
+    raise BadRequest('Invalid uploadId.')
+  upload_dir = os.path.join(get_documents_folder(), '.uploads')
+  os.makedirs(upload_dir, exist_ok=True)
+  return os.path.join(upload_dir, upload_id.lower())
+
+# Function to append a chunk to a chunked upload; returns the new file offset
+def append_upload_chunk(upload_id, stream, file_offset=None, chunk_size=1024 * 1024):
+  upload_path = get_upload_path(upload_id)
+  if file_offset is None:
+    mode = 'wb'
+  else:
+    if not os.path.exists(upload_path):
+      raise BadRequest(f'Upload {upload_id} has not been started.')
+    if os.path.getsize(upload_path) != file_offset:
+      raise BadRequest(f'Invalid fileOffset {file_offset}. The upload is at offset {os.path.getsize(upload_path)}.')
+    mode = 'ab'
+  with open(upload_path, mode) as f:
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+      f.write(chunk)
+  return os.path.getsize(upload_path)
+
+# Function to finish a chunked upload and store the assembled file
+def finish_upload(upload_id, folder, name, stream, file_offset):
+  append_upload_chunk(upload_id, stream, file_offset)
+  upload_path = get_upload_path(upload_id)
+  with open(upload_path, 'rb') as f:
+    document = store_document(folder, name, f)
+  os.remove(upload_path)
+  return document
+
+# Function to describe a document in SharePoint's SP.File format
+def get_file_metadata(document):
+  return {
+    'Name': document.name,
+    'ServerRelativeUrl': f'/{document.folder}/{document.name}',
+    'Length': document.size,
+    'ETag': f'"{document.hash}"',
+    'TimeLastModified': datetime.utcfromtimestamp(document.mtime).strftime('%Y-%m-%dT%H:%M:%SZ')
+  }
+
+def validate_file_query(header, filename, folder=default_folder):
   xRequestDigest = header.get('X-RequestDigest')
-  folder = "/project/data/documents"
-  curdir = os.path.abspath(os.getcwd())
-  fulldir = curdir.replace('''\\''', "/") + folder
-  files = os.listdir(fulldir)
   if xRequestDigest is None:
     return { 'BadRequest': f"No token provided. Unable to 'authenticate' request." }
-  if filename not in files:
+  document = get_document(folder, filename)
+  if document is None:
     return { 'BadRequest': f'''incorrect file name or file does not exist
       please check if you have specified the correct filename in your request
        or have uploaded your file into ravenpoint ''' }
   return {
         'Success': True,
+        'document': document
     }
@@ -0,0 +1,117 @@
+import os
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pytest
+
+# Tests run against an in-memory database; each test gets its own site collection
+os.environ['RAVENPOINT_DATABASE'] = ':memory:'
+
+from project import app, database
+from project.cli import seed_lists
+from project.database import get_connection, use_site
+
+# Header that write requests need
+digest = {'X-RequestDigest': 'test'}
+
+
+# Function to get the default lists of a test site: Projects and Tags, and Tasks that look up
+# a project and any number of tags
+def get_default_spec(rows):
+  return {'lists': [
+    {'name': 'Projects', 'rows': 3, 'columns': [{'name': 'Title', 'type': 'title'}]},
+    {'name': 'Tags', 'rows': 4, 'columns': [{'name': 'Title', 'type': 'title'}]},
+    {'name': 'Tasks', 'rows': rows, 'columns': [
+      {'name': 'Title', 'type': 'title'},
+      {'name': 'status', 'type': 'choice', 'choices': ['Open', 'Closed']},
+      {'name': 'points', 'type': 'integer', 'min': 1, 'max': 8},
+      {'name': 'dueDate', 'type': 'datetime'}
+    ], 'lookups': [
+      {'name': 'project', 'list': 'Projects'},
+      {'name': 'tags', 'list': 'Tags', 'multi': True, 'min': 0, 'max': 3}
+    ]}
+  ]}
+
+
+# A site collection created for a test
+class Site:
+  def __init__(self, name):
+    self.name = name
+    self.api = f'/ravenpoint/sites/{name}/_api'
+
+  # Function to get the URL of a list endpoint, e.g. `items` or `items(1)`
+  def list_url(self, list_name, path='items'):
+    return f"{self.api}/web/lists/GetByTitle('{list_name}')/{path}"
+
+  # Function to open a connection to the site's database
+  @contextmanager
+  def connect(self):
+    with app.app_context(), use_site(self.name):
+      conn = get_connection()
+      try:
+        yield conn
+      finally:
+        conn.close()
+
+  # Function to create an item through the API; returns the created item
+  def add_item(self, client, list_name, **values):
+    response = client.post(self.list_url(list_name), headers=digest, json={
+      '__metadata': {'type': f'SP.Data.{list_name}ListItem'}, **values})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['d']
+
+  # Function to update an item through the API
+  def update_item(self, client, list_name, item_id, **values):
+    response = client.post(self.list_url(list_name, f'items({item_id})'), json={
+      '__metadata': {'type': f'SP.Data.{list_name}ListItem'}, **values},
+      headers={**digest, 'IF-MATCH': '*', 'X-HTTP-Method': 'MERGE'})
+    assert response.status_code == 200, response.get_json()
+
+  # Function to delete an item through the API
+  def delete_item(self, client, list_name, item_id):
+    response = client.post(self.list_url(list_name, f'items({item_id})'),
+                           headers={**digest, 'IF-MATCH': '*', 'X-HTTP-Method': 'DELETE'})
+    assert response.status_code == 200, response.get_json()
+
+  # Function to read list items through the API with the given URL params
+  def get_items(self, client, list_name, **params):
+    response = client.get(self.list_url(list_name), query_string=params)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['value']
+
+
+@pytest.fixture
+def client():
+  app.config['TESTING'] = True
+  return app.test_client()
+
+
+# Function to create a site with the given lists (default: get_default_spec with `rows` tasks)
+@pytest.fixture
+def site():
+  def create_site(spec=None, rows=10):
+    name = f'test-{uuid.uuid4().hex[:8]}'
+    with app.app_context(), use_site(name):
+      seed_lists(spec or get_default_spec(rows), random_seed=0)
+    return Site(name)
+  return create_site
+
+
+# Function to keep site collections created in the test in database files under `tmp_path`
+# The sites opened by other tests are set aside meanwhile
+@pytest.fixture
+def file_databases(tmp_path, monkeypatch):
+  monkeypatch.setitem(app.config, 'DATABASE', str(tmp_path / 'ravenpoint.sqlite'))
+  monkeypatch.setitem(app.config, 'SITES_FOLDER', str(tmp_path / 'sites'))
+  monkeypatch.setattr(database, '_sites', OrderedDict())
+  yield tmp_path / 'sites'
+  for keeper in database._sites.values():
+    keeper.close()
+
+
+# Function to keep the documents of the test under `tmp_path`
+@pytest.fixture
+def documents_folder(tmp_path, monkeypatch):
+  monkeypatch.setitem(app.config, 'DOCUMENTS_FOLDER', str(tmp_path))
+  return tmp_path
@@ -0,0 +1,40 @@
+def test_count_endpoint_counts_filtered_items(client, site):
+  site = site()
+  response = client.get(site.list_url('Tasks', 'items/$count'), query_string={'$filter': "status eq 'Open'"})
+  assert response.status_code == 200
+  open_items = site.get_items(client, 'Tasks', **{'$select': 'Id', '$filter': "status eq 'Open'"})
+  assert int(response.get_data(as_text=True)) == len(open_items)
+
+
+def test_inlinecount_counts_all_pages(client, site):
+  site = site()
+  response = client.get(site.list_url('Tasks'), query_string={'$select': 'Title', '$top': '3', '$inlinecount': 'allpages'})
+  assert response.status_code == 200
+  assert len(response.get_json()['value']) == 3
+  assert response.get_json()['__count'] == 10
+
+
+def test_apply_groups_and_counts_groups(client, site):
+  site = site()
+  response = client.get(site.list_url('Tasks'), query_string={
+    '$apply': 'groupby((status),aggregate(Id with count as n, points with sum as total))',
+    '$inlinecount': 'allpages'})
+  assert response.status_code == 200, response.get_json()
+  groups = response.get_json()['value']
+  assert response.get_json()['__count'] == len(groups)
+  items = site.get_items(client, 'Tasks', **{'$select': 'status,points'})
+  assert {group['status']: (group['n'], group['total']) for group in groups} == {
+    status: (len([item for item in items if item['status'] == status]),
+             sum([item['points'] for item in items if item['status'] == status]))
+    for status in set([item['status'] for item in items])}
+
+
+def test_apply_groups_by_lookup(client, site):
+  site = site()
+  response = client.get(site.list_url('Tasks'), query_string={
+    '$apply': 'groupby((project/Title),aggregate(Id with count as n))', '$expand': 'project',
+    '$inlinecount': 'allpages'})
+  assert response.status_code == 200, response.get_json()
+  groups = response.get_json()['value']
+  assert sum([group['n'] for group in groups]) == 10
+  assert response.get_json()['__count'] == len(groups)
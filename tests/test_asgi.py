@@ -0,0 +1,84 @@
+import asyncio
+import json
+from urllib.parse import urlencode
+
+from conftest import digest
+from project import app
+from project.asgi import application
+from project.events import count_subscribers
+
+
+# Function to call the ASGI app; the body is sent in `body_chunks`, and `receive_more` may
+# hold the connection open (e.g. for event streams) until it returns
+async def call_asgi(method, path, params=None, headers=None, body_chunks=(b'',), on_send=None, receive_more=None):
+  incoming = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(body_chunks) - 1}
+              for i, chunk in enumerate(body_chunks)]
+  messages = []
+
+  async def receive():
+    if incoming:
+      return incoming.pop(0)
+    if receive_more is not None:
+      await receive_more()
+    return {'type': 'http.disconnect'}
+
+  async def send(message):
+    messages.append(message)
+    if on_send is not None:
+      await on_send(message)
+
+  scope = {'type': 'http', 'method': method, 'path': path, 'root_path': '', 'query_string': urlencode(params or {}).encode(),
+           'headers': [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()],
+           'client': ('127.0.0.1', 5000), 'server': ('localhost', 80)}
+  await application(scope, receive, send)
+  status = [message['status'] for message in messages if message['type'] == 'http.response.start'][0]
+  bodies = [message['body'] for message in messages if message['type'] == 'http.response.body']
+  return status, bodies
+
+
+def test_asgi_serves_the_same_responses(client, site):
+  site = site()
+  params = {'$select': 'Title,project/Title,tags/Title', '$expand': 'project,tags', '$orderby': 'points desc'}
+  status, bodies = asyncio.run(call_asgi('GET', site.list_url('Tasks'), params))
+  assert status == 200
+  assert json.loads(b''.join(bodies)) == client.get(site.list_url('Tasks'), query_string=params).get_json()
+
+  status, _ = asyncio.run(call_asgi('GET', site.list_url('Missing')))
+  assert status == 400
+
+
+def test_asgi_reads_and_writes_in_chunks(client, site, monkeypatch):
+  monkeypatch.setitem(app.config, 'ASGI_CHUNK_SIZE', 64)
+  site = site()
+  body = json.dumps({'__metadata': {'type': 'SP.Data.TasksListItem'}, 'Title': 'Sent in parts', 'points': 3}).encode()
+  status, bodies = asyncio.run(call_asgi('POST', site.list_url('Tasks'), headers={**digest, 'Content-Type': 'application/json'},
+                                         body_chunks=[body[:10], body[10:30], body[30:]]))
+  assert status == 200, b''.join(bodies)
+  assert len(bodies) > 2 and all([len(chunk) <= 64 for chunk in bodies])
+  item = json.loads(b''.join(bodies))['d']
+  assert site.get_items(client, 'Tasks', **{'$filter': f"Id eq {item['Id']}"})[0]['Title'] == 'Sent in parts'
+
+
+def test_asgi_streams_events_until_disconnect(client, site):
+  site = site()
+  disconnect = asyncio.Event()
+  events = []
+
+  async def on_send(message):
+    body = message.get('body', b'')
+    if body.startswith(b'retry'):
+      # The stream is open; write from another thread, as a WSGI request would
+      await asyncio.get_running_loop().run_in_executor(None, lambda: site.add_item(client, 'Tasks', Title='Live'))
+    elif body.startswith(b'id:'):
+      events.append(body.decode())
+      disconnect.set()
+
+  async def run():
+    return await asyncio.wait_for(call_asgi('GET', site.list_url('Tasks', 'subscribe'), on_send=on_send,
+                                            receive_more=disconnect.wait), 10)
+
+  status, _ = asyncio.run(run())
+  assert status == 200
+  assert len(events) == 1 and 'event: Add' in events[0] and '"Title": "Live"' in events[0]
+  with site.connect():
+    assert count_subscribers('tasks') == 0
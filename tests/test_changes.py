@@ -0,0 +1,60 @@
+import pandas as pd
+
+from project.utils import get_table_fields, replace_table
+
+
+# Function to get the changes to the Tasks list since a token
+def get_changes(client, site, token=None, **params):
+  if token is not None:
+    params['changeToken'] = token
+  response = client.get(site.list_url('Tasks', 'GetListItemChangesSinceToken'), query_string=params)
+  assert response.status_code == 200, response.get_json()
+  return response.get_json()
+
+
+def test_changes_since_token(client, site):
+  site = site()
+  full = get_changes(client, site, **{'$select': 'Title'})
+  assert full['fullSync'] is True
+  assert len(full['value']) == 10
+
+  added = site.add_item(client, 'Tasks', Title='Added')
+  site.update_item(client, 'Tasks', 2, Title='Updated')
+  site.update_item(client, 'Tasks', 2, points=5)
+  site.delete_item(client, 'Tasks', 3)
+  site.add_item(client, 'Tasks', Title='Short-lived')
+  site.delete_item(client, 'Tasks', 12)
+
+  changes = get_changes(client, site, full['changeToken'], **{'$select': 'Title,points,owshiddenversion'})
+  assert changes['fullSync'] is False
+  assert sorted(changes['deleted']) == [3, 12]
+  assert sorted([(item['Id'], item['Title']) for item in changes['value']]) == [(2, 'Updated'), (added['Id'], 'Added')]
+  assert {item['Id']: item['owshiddenversion'] for item in changes['value']} == {2: 3, added['Id']: 1}
+  assert int(changes['changeToken']) > int(full['changeToken'])
+
+  # Nothing changed since the latest token
+  assert get_changes(client, site, changes['changeToken'])['value'] == []
+
+
+def test_sharepoint_and_posted_tokens(client, site):
+  site = site()
+  token = get_changes(client, site)['changeToken']
+  site.update_item(client, 'Tasks', 4, Title='Updated')
+  changes = get_changes(client, site, f'1;3;00000000-0000-0000-0000-000000000000;637000000000000000;{token}')
+  assert [item['Id'] for item in changes['value']] == [4]
+
+  response = client.post(site.list_url('Tasks', 'GetListItemChangesSinceToken'), json={'query': {'ChangeToken': token}})
+  assert [item['Id'] for item in response.get_json()['value']] == [4]
+  response = client.get(site.list_url('Tasks', 'GetListItemChangesSinceToken'), query_string={'changeToken': 'latest'})
+  assert response.status_code == 400
+
+
+def test_replaced_list_needs_full_sync(client, site):
+  site = site()
+  token = get_changes(client, site)['changeToken']
+  with site.connect() as conn:
+    data = pd.read_sql('SELECT * FROM tasks WHERE Id <= 5', con=conn)
+    replace_table(conn, data, 'tasks', get_table_fields(conn, 'tasks'))
+  changes = get_changes(client, site, token)
+  assert changes['fullSync'] is True
+  assert [item['Id'] for item in changes['value']] == [1, 2, 3, 4, 5]
@@ -0,0 +1,96 @@
+import hashlib
+import uuid
+
+from conftest import digest
+
+body = b'0123456789' * 100
+
+
+# Function to upload a file to a folder of a site
+def upload_file(client, api, folder, name, data, overwrite='true'):
+  return client.post(f"{api}/web/GetFolderByServerRelativeUrl('{folder}')/Files/add(url='{name}',overwrite={overwrite})",
+                     data=data, headers=digest)
+
+
+# Function to get the download URL of a file
+def file_url(api, folder, name):
+  return f"{api}/web/GetFolderByServerRelativeUrl('{folder}')/Files('{name}')/$value"
+
+
+def test_download_is_conditional_and_ranged(client, site, documents_folder):
+  api = site({'lists': []}).api
+  response = upload_file(client, api, 'Shared Documents', 'report.txt', body)
+  assert response.status_code == 200, response.get_json()
+  etag = hashlib.sha256(body).hexdigest()
+  assert response.get_json()['d']['ETag'] == f'"{etag}"'
+
+  response = client.get(file_url(api, 'Shared Documents', 'report.txt'), headers=digest)
+  assert (response.status_code, response.headers['ETag'], response.data) == (200, f'"{etag}"', body)
+  response = client.get(file_url(api, 'Shared Documents', 'report.txt'),
+                        headers={**digest, 'If-None-Match': f'"{etag}"'})
+  assert (response.status_code, response.data) == (304, b'')
+  response = client.get(file_url(api, 'Shared Documents', 'report.txt'),
+                        headers={**digest, 'Range': 'bytes=5-14'})
+  assert (response.status_code, response.headers['Content-Range'], response.data) == \
+    (206, f'bytes 5-14/{len(body)}', b'5678901234')
+
+
+def test_files_in_documents_folder_are_imported(client, documents_folder):
+  name = f'dropped-{uuid.uuid4().hex[:8]}.txt'
+  (documents_folder / name).write_bytes(b'dropped in')
+  response = client.get(file_url('/ravenpoint/_api', 'Shared Documents', name), headers=digest)
+  assert (response.status_code, response.data) == (200, b'dropped in')
+  # The file is moved into the store
+  assert not (documents_folder / name).exists()
+  response = client.get(file_url('/ravenpoint/_api', 'Shared Documents', name), headers=digest)
+  assert (response.status_code, response.data) == (200, b'dropped in')
+
+
+# Function to list the blobs in a store by hash
+def list_blobs(store):
+  return sorted([path.name for path in store.glob('*/*') if path.parent.name != 'tmp'])
+
+
+def test_folders_list_files_and_subfolders(client, site, documents_folder):
+  api = site({'lists': []}).api
+  for folder, name in [('Reports', 'b.txt'), ('Reports', 'a.txt'), ('Reports/2024', 'q1.txt'), ('Reports/2025/Q1', 'x.txt')]:
+    assert upload_file(client, api, folder, name, name.encode()).status_code == 200
+  response = client.get(f"{api}/web/GetFolderByServerRelativeUrl('/Reports')/Files")
+  assert [(file['Name'], file['ServerRelativeUrl'], file['Length']) for file in response.get_json()['value']] == \
+    [('a.txt', '/Reports/a.txt', 5), ('b.txt', '/Reports/b.txt', 5)]
+  response = client.get(f"{api}/web/GetFolderByServerRelativeUrl('Reports')/Folders")
+  assert [folder['ServerRelativeUrl'] for folder in response.get_json()['value']] == ['/Reports/2024', '/Reports/2025']
+
+
+def test_store_keeps_one_blob_per_content(client, site, documents_folder):
+  site = site({'lists': []})
+  api = site.api
+  store = documents_folder / '.sites' / site.name / '.store'
+  upload_file(client, api, 'Shared Documents', 'one.txt', body)
+  upload_file(client, api, 'Shared Documents', 'two.txt', body)
+  assert list_blobs(store) == [hashlib.sha256(body).hexdigest()]
+
+  response = upload_file(client, api, 'Shared Documents', 'one.txt', b'changed', overwrite='false')
+  assert response.status_code == 400
+  upload_file(client, api, 'Shared Documents', 'one.txt', b'changed')
+  upload_file(client, api, 'Shared Documents', 'two.txt', b'changed')
+  # The old contents are released with the last file that refers to them
+  assert list_blobs(store) == [hashlib.sha256(b'changed').hexdigest()]
+
+
+def test_chunked_upload_checks_offsets(client, site, documents_folder):
+  api = site({'lists': []}).api
+  upload_url = f"{api}/web/GetFileByServerRelativeUrl('/Shared Documents/big.bin')"
+  upload_id = str(uuid.uuid4())
+  response = client.post(f"{upload_url}/StartUpload(uploadId=guid'{upload_id}')", data=body[:300], headers=digest)
+  assert response.get_json()['d']['StartUpload'] == '300'
+  response = client.post(f"{upload_url}/ContinueUpload(uploadId=guid'{upload_id}',fileOffset=200)",
+                         data=body[300:600], headers=digest)
+  assert response.status_code == 400
+  response = client.post(f"{upload_url}/ContinueUpload(uploadId=guid'{upload_id}',fileOffset=300)",
+                         data=body[300:600], headers=digest)
+  assert response.get_json()['d']['ContinueUpload'] == '600'
+  response = client.post(f"{upload_url}/FinishUpload(uploadId=guid'{upload_id}',fileOffset=600)",
+                         data=body[600:], headers=digest)
+  assert response.get_json()['d']['Length'] == len(body)
+  assert client.get(file_url(api, 'Shared Documents', 'big.bin'), headers=digest).data == body
@@ -0,0 +1,88 @@
+import json
+
+import pandas as pd
+
+from project import app
+from project.events import count_subscribers
+from project.utils import get_table_fields, replace_table
+
+
+# Function to open the Tasks event stream; returns the response and an iterator over its events
+def open_stream(client, site, **headers):
+  response = client.get(site.list_url('Tasks', 'subscribe'), headers=headers, buffered=False)
+  assert response.status_code == 200, response.get_data()
+  chunks = response.iter_encoded()
+  assert next(chunks) == b'retry: 1000\n\n'
+  return response, chunks
+
+
+# Function to parse an event from the stream, e.g. ('Add', {'changeToken': '3', ...})
+def read_event(chunks):
+  lines = dict([line.split(': ', 1) for line in next(chunks).decode().strip().split('\n')])
+  data = json.loads(lines['data'])
+  assert lines['id'] == data['changeToken']
+  return lines['event'], data
+
+
+def test_stream_pushes_item_changes(client, site, monkeypatch):
+  monkeypatch.setitem(app.config, 'EVENTS_HEARTBEAT_SECONDS', 0.05)
+  site = site()
+  response, chunks = open_stream(client, site)
+  assert next(chunks) == b': keepalive\n\n'
+
+  item = site.add_item(client, 'Tasks', Title='Pushed', points=2)
+  change_type, event = read_event(chunks)
+  assert (change_type, event['Id'], event['fields']['Title'], event['fields']['points']) == ('Add', item['Id'], 'Pushed', 2)
+  site.delete_item(client, 'Tasks', item['Id'])
+  change_type, deleted = read_event(chunks)
+  assert (change_type, deleted['Id'], 'fields' in deleted) == ('Delete', item['Id'], False)
+  assert int(deleted['changeToken']) > int(event['changeToken'])
+
+  with site.connect():
+    assert count_subscribers('tasks') == 1
+  response.close()
+  with site.connect():
+    assert count_subscribers('tasks') == 0
+
+
+def test_reconnect_replays_missed_changes(client, site):
+  site = site()
+  token = client.get(site.list_url('Tasks', 'GetListItemChangesSinceToken')).get_json()['changeToken']
+  site.update_item(client, 'Tasks', 1, Title='First')
+  site.update_item(client, 'Tasks', 2, Title='Second')
+
+  response, chunks = open_stream(client, site, **{'Last-Event-ID': token})
+  assert [read_event(chunks)[1]['Id'] for _ in range(2)] == [1, 2]
+  site.update_item(client, 'Tasks', 3, Title='Live')
+  assert read_event(chunks)[1]['Id'] == 3
+  response.close()
+
+
+def test_replaced_list_resets_stream(client, site):
+  site = site()
+  token = client.get(site.list_url('Tasks', 'GetListItemChangesSinceToken')).get_json()['changeToken']
+  with site.connect() as conn:
+    replace_table(conn, pd.read_sql('SELECT * FROM tasks', con=conn), 'tasks', get_table_fields(conn, 'tasks'))
+
+  response, chunks = open_stream(client, site, **{'Last-Event-ID': token})
+  assert read_event(chunks)[0] == 'Reset'
+  assert list(chunks) == []
+
+
+def test_slow_subscriber_is_disconnected(client, site, monkeypatch):
+  monkeypatch.setitem(app.config, 'EVENTS_QUEUE_SIZE', 1)
+  site = site()
+  response, chunks = open_stream(client, site)
+  site.update_item(client, 'Tasks', 1, Title='Kept')
+  site.update_item(client, 'Tasks', 2, Title='Dropped')
+  # The client catches up from its last event id on reconnect
+  assert list(chunks) == []
+  with site.connect():
+    assert count_subscribers('tasks') == 0
+
+
+def test_subscriber_limit(client, site, monkeypatch):
+  monkeypatch.setitem(app.config, 'EVENTS_MAX_SUBSCRIBERS', 0)
+  site = site()
+  response = client.get(site.list_url('Tasks', 'subscribe'))
+  assert response.status_code == 503
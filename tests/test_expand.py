@@ -0,0 +1,74 @@
+import listdata
+
+# Tags are owned by people; milestones group tasks, and every task belongs to a milestone and
+# has reviewers and tags
+spec = {'lists': [
+  {'name': 'People', 'rows': 5, 'columns': [{'name': 'Title', 'type': 'title'}]},
+  {'name': 'Tags', 'rows': 6, 'columns': [{'name': 'Title', 'type': 'title'}],
+   'lookups': [{'name': 'owner', 'list': 'People'}]},
+  {'name': 'Milestones', 'rows': 4, 'columns': [{'name': 'Title', 'type': 'title'}],
+   'lookups': [{'name': 'tags', 'list': 'Tags', 'multi': True, 'min': 1, 'max': 3}]},
+  {'name': 'Tasks', 'rows': 25, 'columns': [{'name': 'Title', 'type': 'title'}], 'lookups': [
+    {'name': 'milestone', 'list': 'Milestones'},
+    {'name': 'reviewers', 'list': 'People', 'multi': True, 'min': 0, 'max': 3},
+    {'name': 'tags', 'list': 'Tags', 'multi': True, 'min': 0, 'max': 4}
+  ]}
+]}
+
+
+# Function to read a table's rows by Id, with multi-lookups split into lists of Ids
+def read_rows(site, table, *multi):
+  with site.connect() as conn:
+    cursor = conn.execute(f'SELECT * FROM {table}')
+    columns = [col[0] for col in cursor.description]
+    rows = {row[0]: dict(zip(columns, row)) for row in cursor.fetchall()}
+  for row in rows.values():
+    for col in multi:
+      row[col] = [int(value) for value in (row[col] or '').split(',') if value]
+  return rows
+
+
+def test_multiple_multi_lookups_do_not_fan_out(client, site):
+  site = site(spec)
+  tasks = read_rows(site, 'tasks', 'reviewers', 'tags')
+  items = site.get_items(client, 'Tasks', **{
+    '$select': 'Title,reviewers/Title,tags/Title', '$expand': 'reviewers,tags'})
+  assert [item['Id'] for item in items] == list(range(1, 26))
+  for item in items:
+    assert item['reviewers'] == [{'Title': f'People {i}'} for i in tasks[item['Id']]['reviewers']]
+    assert item['tags'] == [{'Title': f'Tags {i}'} for i in tasks[item['Id']]['tags']]
+
+
+def test_nested_expansions(client, site):
+  site = site(spec)
+  tasks = read_rows(site, 'tasks', 'tags')
+  milestones = read_rows(site, 'milestones', 'tags')
+  tags = read_rows(site, 'tags')
+  items = site.get_items(client, 'Tasks', **{
+    '$select': 'Title,milestone/Title,milestone/tags/Title,tags/Id,tags/owner/Title',
+    '$expand': 'milestone,milestone/tags,tags,tags/owner'})
+  for item in items:
+    milestone = milestones[int(tasks[item['Id']]['milestone'])]
+    assert item['milestone'] == {'Title': milestone['Title'],
+                                 'tags': [{'Title': f'Tags {i}'} for i in milestone['tags']]}
+    assert item['tags'] == [{'Id': i, 'owner': {'Title': f"People {int(tags[i]['owner'])}"}}
+                            for i in tasks[item['Id']]['tags']]
+
+
+def test_batched_expansions_match(client, site, monkeypatch):
+  site = site(spec)
+  params = {'$select': 'Title,milestone/tags/Title,reviewers/Title', '$expand': 'milestone,milestone/tags,reviewers'}
+  items = site.get_items(client, 'Tasks', **params)
+  monkeypatch.setattr(listdata, 'expand_batch_size', 2)
+  assert site.get_items(client, 'Tasks', **params) == items
+  # $top is applied to items, not to lookup values
+  assert site.get_items(client, 'Tasks', **params, **{'$top': '7'}) == items[:7]
+
+
+def test_filter_on_multi_lookup_keeps_all_values(client, site):
+  site = site(spec)
+  tasks = read_rows(site, 'tasks', 'tags')
+  items = site.get_items(client, 'Tasks', **{
+    '$select': 'Title,tags/Id', '$expand': 'tags', '$filter': "tags/Title eq 'Tags 2'"})
+  assert [item['Id'] for item in items] == [i for i, task in tasks.items() if 2 in task['tags']]
+  assert all([[tag['Id'] for tag in item['tags']] == tasks[item['Id']]['tags'] for item in items])
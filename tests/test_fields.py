@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from conftest import digest
+from project.utils import infer_field_types
+
+
+def test_fields_endpoint_reports_types(client, site):
+  site = site()
+  response = client.get(site.list_url('Tasks', 'fields'), query_string={'$select': 'InternalName,TypeAsString'})
+  assert response.status_code == 200, response.get_json()
+  assert {field['InternalName']: field['TypeAsString'] for field in response.get_json()['d']['results']} == {
+    'Id': 'Counter', 'Title': 'Text', 'status': 'Text', 'points': 'Integer', 'dueDate': 'DateTime',
+    'project': 'Lookup', 'tags': 'LookupMulti'}
+  fields = {field['InternalName']: field for field in client.get(site.list_url('Tasks', 'fields')).get_json()['d']['results']}
+  assert (fields['tags']['AllowMultipleValues'], fields['tags']['LookupField'], fields['Id']['ReadOnlyField']) == (True, 'Id', True)
+
+
+def test_writes_are_coerced_to_field_types(client, site):
+  site = site()
+  item = site.add_item(client, 'Tasks', Title=12, points='5', projectId='2', dueDate='2024-03-01 10:30')
+  with site.connect() as conn:
+    stored = conn.execute('SELECT Title, typeof(Title), points, typeof(points), project, dueDate FROM tasks WHERE Id = ?',
+                          (item['Id'],)).fetchone()
+  assert stored == ('12', 'text', 5, 'integer', 2, '2024-03-01T10:30:00Z')
+
+  for values in [{'points': 'five'}, {'points': 2.5}, {'unknown': 1}, {'tags': 'a,b'}]:
+    response = client.post(site.list_url('Tasks'), headers=digest,
+                           json={'__metadata': {'type': 'SP.Data.TasksListItem'}, 'Title': 'Bad', **values})
+    assert response.status_code == 400, values
+
+
+def test_filter_on_null(client, site):
+  site = site()
+  item = site.add_item(client, 'Tasks', Title='No points')
+  assert [task['Id'] for task in site.get_items(client, 'Tasks', **{'$filter': 'points eq null'})] == [item['Id']]
+  assert len(site.get_items(client, 'Tasks', **{'$filter': 'points ne null'})) == 10
+
+
+def test_infer_field_types():
+  df = pd.DataFrame({
+    'Id': [1, 2, 3],
+    'count': [1, np.nan, 3],
+    'ratio': [0.5, 1, 2],
+    'flag': [True, False, True],
+    'when': ['2024-01-01', '2024-02-01T10:00:00Z', None],
+    'note': ['a', 1, None],
+    'blank': [None, None, None]
+  })
+  assert infer_field_types(df) == {'Id': 'Counter', 'count': 'Integer', 'ratio': 'Number', 'flag': 'Boolean',
+                                   'when': 'DateTime', 'note': 'Text', 'blank': 'Text'}
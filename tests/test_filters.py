@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from project.utils import build_list_query, compile_list_query, get_all_fields, get_all_relationships, \
+  parse_odata_query
+
+
+# Function to get the titles of the tasks that match a filter
+def filter_titles(client, site, query):
+  return sorted([item['Title'] for item in site.get_items(client, 'Tasks', **{'$select': 'Title', '$filter': query})])
+
+
+def test_midnight_datetime_literals_match_stored_values(client, site):
+  site = site(rows=0)
+  site.add_item(client, 'Tasks', Title='midnight', dueDate='2022-03-01T00:00:00Z')
+  site.add_item(client, 'Tasks', Title='morning', dueDate='2022-03-01T09:30:00Z')
+
+  assert filter_titles(client, site, "dueDate eq datetime'2022-03-01T00:00:00Z'") == ['midnight']
+  assert filter_titles(client, site, "dueDate le datetime'2022-03-01T00:00:00Z'") == ['midnight']
+  assert filter_titles(client, site, "dueDate gt datetime'2022-03-01T00:00:00Z'") == ['morning']
+  assert filter_titles(client, site, "dueDate eq datetime'2022-03-01'") == ['midnight']
+
+
+# Function to get the titles of the tasks whose due date matches a condition
+def due_titles(site, condition):
+  with site.connect() as conn:
+    rows = conn.execute('SELECT Title, dueDate FROM tasks').fetchall()
+  return sorted([title for title, due in rows if condition(datetime.strptime(due, '%Y-%m-%dT%H:%M:%SZ'))])
+
+
+def test_date_functions(client, site):
+  site = site(rows=60)
+  cases = {
+    'year(dueDate) eq 2023': lambda due: due.year == 2023,
+    'year(dueDate) ge 2024': lambda due: due.year >= 2024,
+    'year(dueDate) lt 2022 or year(dueDate) gt 2024': lambda due: due.year < 2022 or due.year > 2024,
+    'year(dueDate) eq 2022 and month(dueDate) eq 12': lambda due: (due.year, due.month) == (2022, 12),
+    'year(dueDate) eq 2021 and month(dueDate) eq 2 and day(dueDate) le 14': \
+      lambda due: (due.year, due.month) == (2021, 2) and due.day <= 14,
+    'month(dueDate) eq 6': lambda due: due.month == 6,
+    'hour(dueDate) lt 6 and minute(dueDate) ge 30': lambda due: due.hour < 6 and due.minute >= 30
+  }
+  for query, condition in cases.items():
+    assert filter_titles(client, site, query) == due_titles(site, condition), query
+  response = client.get(site.list_url('Tasks'), query_string={'$filter': 'year(dueDate) eq 2023 and month(dueDate) eq 13'})
+  assert response.status_code == 400
+
+
+def test_year_filters_use_the_datetime_index(site):
+  site = site()
+  with site.connect() as conn:
+    params = parse_odata_query({'$filter': 'year(dueDate) eq 2023 and month(dueDate) eq 4'})
+    query = build_list_query(params, get_all_relationships(conn), 'tasks', all_fields=get_all_fields(conn))
+    plan = ' '.join([row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {compile_list_query(query)}').fetchall()])
+  assert 'ix_tasks_dueDate' in plan
@@ -0,0 +1,38 @@
+# Function to read the tags of each task from the junction table, e.g. {1: [2, 3], ...}
+def read_junction(site):
+  with site.connect() as conn:
+    rows = conn.execute('SELECT tasks_pk, tags_pk FROM tasks_tags ORDER BY Id').fetchall()
+  junction = {}
+  for task_id, tag_id in rows:
+    junction.setdefault(task_id, []).append(tag_id)
+  return junction
+
+
+# Function to read the tags of each task from the lookup column
+def read_column(site):
+  with site.connect() as conn:
+    rows = conn.execute('SELECT Id, tags FROM tasks').fetchall()
+  return {task_id: [int(value) for value in tags.split(',')] for task_id, tags in rows if tags}
+
+
+def test_seeded_junction_matches_column(site):
+  site = site(rows=30)
+  assert read_junction(site) == read_column(site)
+
+
+def test_writes_maintain_junction(client, site):
+  site = site()
+  item = site.add_item(client, 'Tasks', Title='Tagged', tags={'results': [3, 1]})
+  assert read_junction(site)[item['Id']] == [3, 1]
+
+  site.update_item(client, 'Tasks', item['Id'], tags={'results': [2]})
+  # Updating other fields leaves the junction rows alone
+  site.update_item(client, 'Tasks', item['Id'], Title='Renamed')
+  assert read_junction(site)[item['Id']] == [2]
+  items = site.get_items(client, 'Tasks', **{'$select': 'Title,tags/Title', '$expand': 'tags',
+                                             '$filter': f"Id eq {item['Id']}"})
+  assert items[0]['tags'] == [{'Title': 'Tags 2'}]
+
+  site.delete_item(client, 'Tasks', item['Id'])
+  assert item['Id'] not in read_junction(site)
+  assert read_junction(site) == read_column(site)
@@ -0,0 +1,48 @@
+import json
+import os
+import subprocess
+import sys
+
+from project.database import connect_database, memory_database
+
+# Script that reads the titles of a list through the API of a fresh process
+read_titles = '''
+from project import app
+response = app.test_client().get("/ravenpoint/_api/web/lists/GetByTitle('Notes')/items", query_string={'$select': 'Title'})
+print([item['Title'] for item in response.get_json()['value']])
+'''
+
+
+# Function to run a script in a new process with an in-memory database; returns the output lines
+def run_in_memory(script, **env):
+  env = {**os.environ, 'RAVENPOINT_DATABASE': memory_database, **{f'RAVENPOINT_DATABASE_{key}': value for key, value in env.items()}}
+  result = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, timeout=120,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+  assert result.returncode == 0, result.stderr
+  return result.stdout.strip().split('\n')
+
+
+def test_memory_databases_are_shared_by_name():
+  first, second, other = [connect_database(memory_database, name) for name in ['test-shared', 'test-shared', 'test-other']]
+  first.execute('CREATE TABLE notes (Title TEXT)')
+  first.execute("INSERT INTO notes VALUES ('shared')")
+  first.commit()
+  first.close()
+  assert second.execute('SELECT Title FROM notes').fetchall() == [('shared',)]
+  assert other.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'notes'").fetchone()[0] == 0
+  second.close()
+  other.close()
+  # The database outlives its connections
+  third = connect_database(memory_database, 'test-shared')
+  assert third.execute('SELECT Title FROM notes').fetchall() == [('shared',)]
+  third.close()
+
+
+def test_memory_database_loads_and_persists(tmp_path):
+  spec = tmp_path / 'spec.json'
+  spec.write_text(json.dumps({'lists': [{'name': 'Notes', 'rows': 3, 'columns': [{'name': 'Title', 'type': 'title'}]}]}))
+  archive = str(tmp_path / 'notes.tar.gz')
+  output = run_in_memory(read_titles, LOAD=str(spec), PERSIST=archive)
+  assert "['Notes 1', 'Notes 2', 'Notes 3']" in output
+  assert output[-1].startswith(f'Saved 1 list(s) and 0 document blob(s) to {archive}')
+  assert "['Notes 1', 'Notes 2', 'Notes 3']" in run_in_memory(read_titles, LOAD=archive)
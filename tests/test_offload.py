@@ -0,0 +1,47 @@
+import json
+import sqlite3
+
+from listdata import render_list_items
+from project import app, offload
+from project.offload import estimate_cells, should_offload
+from project.utils import get_all_fields, get_all_relationships, parse_odata_query, build_list_query
+
+
+# Function to build the list query of Tasks for the given URL params
+def get_query(conn, args):
+  return build_list_query(parse_odata_query(args), get_all_relationships(conn), 'tasks', all_fields=get_all_fields(conn))
+
+
+def test_estimate_cells_counts_list_fields(site):
+  with site().connect() as conn:
+    # Id, Title, status, points, dueDate, project and tags
+    assert estimate_cells(conn, get_query(conn, {})) == 10 * 7
+    assert estimate_cells(conn, get_query(conn, {'$select': 'Title'})) == 10 * 2
+    assert estimate_cells(conn, get_query(conn, {}), top=3) == 3 * 7
+    assert estimate_cells(conn, get_query(conn, {}), rows=2) == 2 * 7
+
+
+def test_selective_filters_stay_inline(site, monkeypatch):
+  # Test sites are in memory, which is never offloaded
+  monkeypatch.setattr(offload, 'is_memory_database', lambda path=None: False)
+  monkeypatch.setitem(app.config, 'OFFLOAD_WORKERS', 1)
+  monkeypatch.setitem(app.config, 'OFFLOAD_MIN_CELLS', 10 * 7)
+  with site().connect() as conn:
+    assert should_offload(conn, get_query(conn, {}))
+    assert should_offload(conn, get_query(conn, {'$filter': 'Id ge 1'}))
+    assert not should_offload(conn, get_query(conn, {'$filter': 'Id eq 5'}))
+
+
+def test_workers_render_without_the_app(tmp_path, monkeypatch):
+  path = str(tmp_path / 'items.sqlite')
+  conn = sqlite3.connect(path)
+  conn.execute('CREATE TABLE items (Id INTEGER PRIMARY KEY, Title TEXT)')
+  conn.execute("INSERT INTO items VALUES (1, 'A')")
+  conn.commit()
+  conn.close()
+  monkeypatch.setitem(app.config, 'OFFLOAD_WORKERS', 1)
+  pool = offload.get_pool()
+  body = pool.submit(render_list_items, path, {'secondary': []}, 'SELECT * FROM items',
+                     'SELECT COUNT(*) FROM items', {'value': None}).result()
+  assert json.loads(body) == {'value': [{'Id': 1, 'Title': 'A'}], '__count': 1}
+  assert pool.submit(eval, "'project' in __import__('sys').modules").result() is False
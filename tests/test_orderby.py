@@ -0,0 +1,32 @@
+def test_orderby_breaks_ties_on_id(client, site):
+  site = site(rows=20)
+  items = site.get_items(client, 'Tasks', **{'$select': 'points', '$orderby': 'points desc'})
+  assert [(item['points'], item['Id']) for item in items] == \
+    sorted([(item['points'], item['Id']) for item in items], reverse=True)
+
+
+def test_orderby_lookup_column(client, site):
+  site = site(rows=20)
+  items = site.get_items(client, 'Tasks', **{
+    '$select': 'Title,project/Title', '$expand': 'project', '$orderby': 'project/Title,Id desc'})
+  keys = [(item['project']['Title'], -item['Id']) for item in items]
+  assert keys == sorted(keys)
+
+
+def test_top_limits_sorted_items(client, site):
+  site = site(rows=20)
+  items = site.get_items(client, 'Tasks', **{'$select': 'Title', '$orderby': 'Id desc', '$top': '5'})
+  assert [item['Id'] for item in items] == [20, 19, 18, 17, 16]
+
+
+def test_top_counts_items_with_multi_lookups(client, site):
+  site = site(rows=20)
+  items = site.get_items(client, 'Tasks', **{'$select': 'Title,tags/Title', '$expand': 'tags', '$top': '3'})
+  assert [item['Id'] for item in items] == [1, 2, 3]
+
+
+def test_invalid_orderby_and_top(client, site):
+  site = site()
+  for params in [{'$orderby': 'points sideways'}, {'$orderby': 'tags/Title', '$expand': 'tags'}, {'$top': '-1'}]:
+    response = client.get(site.list_url('Tasks'), query_string=params)
+    assert response.status_code == 400, params
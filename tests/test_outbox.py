@@ -0,0 +1,68 @@
+import time
+
+from conftest import digest
+from project import app, outbox
+from project.database import use_site
+from project.models import OutboxEmail
+
+
+# SMTP connection that fails the first `failures` sends
+class FlakyConnection:
+  def __init__(self, sent, failures):
+    self.sent = sent
+    self.failures = failures
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    pass
+
+  def send(self, msg):
+    if self.failures:
+      self.failures.pop()
+      raise ConnectionRefusedError('SMTP server unavailable')
+    self.sent.append(msg)
+
+
+# Function to wait for an email to leave the queue
+def wait_for_email(email_id):
+  for _ in range(200):
+    with app.app_context(), use_site(None):
+      email = OutboxEmail.query.get(email_id)
+      if email.status in ['sent', 'failed']:
+        return email
+    time.sleep(0.05)
+  raise AssertionError(f'Email {email_id} was not delivered.')
+
+
+def test_retry_backs_off_then_gives_up(monkeypatch):
+  monkeypatch.setitem(app.config, 'OUTBOX_MAX_ATTEMPTS', 4)
+  monkeypatch.setitem(app.config, 'OUTBOX_RETRY_BASE_SECONDS', 2)
+  monkeypatch.setitem(app.config, 'OUTBOX_RETRY_MAX_SECONDS', 5)
+  email = OutboxEmail('a@example.com', ['b@example.com'], 'Subject', 'Body', time.time())
+  delays = []
+  for _ in range(3):
+    before = time.time()
+    outbox._retry_later(email, 'timed out')
+    assert email.status == 'queued'
+    delays.append(round(email.next_attempt_at - before))
+  assert delays == [2, 4, 5]
+  outbox._retry_later(email, 'timed out')
+  assert (email.status, email.attempts, email.last_error) == ('failed', 4, 'timed out')
+
+
+def test_send_email_is_retried_until_delivered(client, monkeypatch):
+  sent = []
+  failures = [True]
+  monkeypatch.setattr(outbox.mail, 'connect', lambda: FlakyConnection(sent, failures))
+  monkeypatch.setitem(app.config, 'OUTBOX_RETRY_BASE_SECONDS', 0.05)
+  response = client.post('/ravenpoint/_api/SP.Utilities.Utility.SendEmail', headers=digest, json={
+    'properties': {'To': {'results': ['b@example.com', 'c@example.com']}, 'Body': 'Body', 'Subject': 'Hello'}})
+  assert response.status_code == 200
+  email_id = int(response.get_json().split('id ')[1].rstrip(')'))
+
+  email = wait_for_email(email_id)
+  assert (email.status, email.attempts) == ('sent', 2)
+  assert email.last_error == 'SMTP server unavailable'
+  assert [(msg.subject, msg.recipients) for msg in sent] == [('Hello', ['b@example.com', 'c@example.com'])]
@@ -0,0 +1,45 @@
+import random
+import time
+
+from project import app
+from project.profiles import profile_header, get_profile_settings, sample_latency, get_delay_slots, delay_thread
+
+
+def test_profile_injects_errors(client, site, monkeypatch):
+  monkeypatch.setitem(app.config, 'PROFILES', {'down': {'error_rate': 1, 'errors': [503], 'retry_after': 7}})
+  site = site()
+  response = client.get(site.list_url('Tasks'), headers={profile_header: 'down'})
+  assert response.status_code == 503
+  assert response.headers['Retry-After'] == '7'
+  assert client.get(site.list_url('Tasks'), headers={profile_header: 'none'}).status_code == 200
+  assert client.get(site.list_url('Tasks'), headers={profile_header: 'unknown'}).status_code == 400
+
+
+def test_profile_endpoint_overrides():
+  assert get_profile_settings('flaky', 'UpdateListItems')['error_rate'] == 0.15
+  assert get_profile_settings('flaky', 'ListItems')['error_rate'] == 0.05
+  assert get_profile_settings('flaky', None) is None
+
+
+def test_sample_latency_follows_percentiles():
+  random.seed(0)
+  samples = sorted([sample_latency({'p50': 1, 'p90': 2, 'max': 4}) for _ in range(2000)])
+  assert 0 <= samples[0] and samples[-1] <= 4
+  assert 0.9 < samples[1000] < 1.1
+  assert 1.9 < samples[1800] < 2.1
+
+
+def test_wsgi_delays_are_bounded():
+  slots = get_delay_slots()
+  held = 0
+  while slots.acquire(blocking=False):
+    held += 1
+  try:
+    assert held == app.config['PROFILE_WSGI_MAX_DELAYED']
+    started = time.monotonic()
+    assert delay_thread(5) is False
+    assert time.monotonic() - started < 1
+  finally:
+    for _ in range(held):
+      slots.release()
+  assert delay_thread(0.01) is True
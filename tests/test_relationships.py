@@ -0,0 +1,82 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from project.relationships import _executor, get_migrations, migrate_relationship
+
+
+# Function to hold the migration worker, so that migrations queued meanwhile stay queued
+@contextmanager
+def hold_migrations():
+  gate = threading.Event()
+  _executor.submit(gate.wait)
+  try:
+    yield
+  finally:
+    gate.set()
+
+
+# Function to wait for a migration to finish
+def wait_for_migration(rship_id):
+  for _ in range(200):
+    migration = get_migrations()[rship_id]
+    if migration['status'] in ['done', 'failed']:
+      return migration
+    time.sleep(0.05)
+  raise AssertionError(f'Migration of relationship {rship_id} did not finish.')
+
+
+# Function to get the expanded lookup Ids of the tasks, e.g. {1: [2, 3], ...}
+def get_expanded_ids(client, site, lookup):
+  items = site.get_items(client, 'Tasks', **{'$select': f'Title,{lookup}/Id', '$expand': lookup})
+  return {item['Id']: sorted([value['Id'] for value in item[lookup]]) for item in items}
+
+
+def test_new_multi_lookup_expands_once_migrated(client, site):
+  site = site()
+  # `points` (1-8) doubles as a list of Tag Ids; 5-8 are orphans
+  values = {'table_left': 'tasks', 'table_left_on': 'points', 'table_lookup': 'tags',
+            'table_lookup_on': 'Id', 'is_multi': True, 'description': ''}
+  with hold_migrations():
+    with site.connect():
+      rship_id, steps = migrate_relationship(None, values)
+    assert steps == [('build', 'tasks', 'points', 'tags')]
+    # Not registered until its junction table is in place
+    response = client.get(site.list_url('Tasks'), query_string={'$select': 'Title,points/Id', '$expand': 'points'})
+    assert response.status_code == 400, response.get_json()
+
+  migration = wait_for_migration(rship_id)
+  assert migration['status'] == 'done', migration['error']
+  with site.connect() as conn:
+    points = dict(conn.execute('SELECT Id, points FROM tasks').fetchall())
+  assert get_expanded_ids(client, site, 'points') == {
+    item_id: [int(value)] if int(value) <= 4 else [] for item_id, value in points.items()}
+  orphans = sum([int(value) > 4 for value in points.values()])
+  assert migration['orphans'] == {'rows': orphans, 'references': orphans}
+
+
+def test_edited_lookup_switches_junction_with_registry(client, site):
+  site = site()
+  with site.connect() as conn:
+    rship_id = conn.execute("SELECT rship_id FROM relationships WHERE table_left_on = 'tags'").fetchone()[0]
+    tags = {item_id: sorted([int(value) for value in (value or '').split(',') if value])
+            for item_id, value in conn.execute('SELECT Id, tags FROM tasks').fetchall()}
+  values = {'table_left': 'tasks', 'table_left_on': 'tags', 'table_lookup': 'projects',
+            'table_lookup_on': 'Id', 'is_multi': True, 'description': ''}
+  with hold_migrations():
+    with site.connect():
+      _, steps = migrate_relationship(rship_id, values)
+    assert steps == [('drop', 'tasks', 'tags'), ('build', 'tasks', 'tags', 'projects')]
+    # The old junction table serves the old relationship until the migration runs
+    assert get_expanded_ids(client, site, 'tags') == tags
+
+  assert wait_for_migration(rship_id)['status'] == 'done'
+  with site.connect() as conn:
+    stale = conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'tasks_tags%'").fetchall()
+  assert stale == []
+  # Projects 1-3 exist; tag Id 4 is an orphan
+  expected = {item_id: [value for value in ids if value <= 3] for item_id, ids in tags.items()}
+  assert get_expanded_ids(client, site, 'tags') == expected
+  # Writes go to the new junction table
+  item = site.add_item(client, 'Tasks', Title='New', tags='1,2')
+  assert get_expanded_ids(client, site, 'tags')[item['Id']] == [1, 2]
@@ -0,0 +1,31 @@
+import pytest
+
+from project import utils
+
+notes_spec = {'lists': [{'name': 'Notes', 'rows': 50, 'columns': [
+  {'name': 'Title', 'type': 'title'},
+  {'name': 'body', 'type': 'text', 'length': 6, 'search': True}
+]}]}
+
+
+# Function to get the Ids of the notes that match URL params
+def find_notes(client, site, **params):
+  return sorted([item['Id'] for item in site.get_items(client, 'Notes', **{'$select': 'Id', **params})])
+
+
+@pytest.mark.parametrize('indexed', [True, False])
+def test_search_matches_substrings(client, site, monkeypatch, indexed):
+  # Without the trigram tokenizer (SQLite < 3.34), no index is built and LIKE is used
+  monkeypatch.setattr(utils, 'search_index_available', indexed and utils.search_index_available)
+  if indexed and not utils.search_index_available:
+    pytest.skip('SQLite has no trigram tokenizer.')
+  site = site(notes_spec)
+  with site.connect() as conn:
+    assert bool(conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'notes_fts'").fetchone()) == indexed
+    bodies = dict(conn.execute('SELECT Id, body FROM notes').fetchall())
+  matching = lambda *terms: sorted([item_id for item_id, body in bodies.items() \
+    if all([term.lower() in body.lower() for term in terms])])
+  first, second = bodies[1].split()[:2]
+  assert find_notes(client, site, **{'$search': first[1:4]}) == matching(first[1:4])
+  assert find_notes(client, site, **{'$filter': f"substringof('{first[1:4]}', body)"}) == matching(first[1:4])
+  assert find_notes(client, site, **{'$search': f'{first} {second}'}) == matching(first, second)
@@ -0,0 +1,60 @@
+import uuid
+
+import click
+import numpy as np
+import pytest
+
+from conftest import Site
+from project import app
+from project.cli import generate_multi_lookup, sort_seed_lists
+
+
+# Function to seed the default spec into a new site through the CLI
+def seed_site(*args):
+  site = Site(f'seed-{uuid.uuid4().hex[:8]}')
+  result = app.test_cli_runner().invoke(args=['ravenpoint', 'seed', '--site', site.name, *args])
+  assert result.exit_code == 0, result.output
+  return site
+
+
+def test_seed_generates_lists_in_chunks(client):
+  site = seed_site('--rows', '40', '--fanout', '4', '--multi-min', '1', '--multi-max', '2', '--chunk-size', '7', '--seed', '1')
+  with site.connect() as conn:
+    rows = conn.execute('SELECT Id, parentObjective, tags FROM seed_key_results ORDER BY Id').fetchall()
+    objectives = conn.execute('SELECT COUNT(*) FROM seed_objectives').fetchone()[0]
+    junction_rows = conn.execute('SELECT COUNT(*) FROM seed_key_results_seed_tags').fetchone()[0]
+  assert [row[0] for row in rows] == list(range(1, 41))
+  assert objectives == 10
+  assert all([1 <= parent <= 10 for _, parent, _ in rows])
+  tags = [[int(value) for value in row[2].split(',')] for row in rows]
+  assert all([1 <= len(values) <= 2 and values == sorted(set(values)) for values in tags])
+  assert junction_rows == sum([len(values) for values in tags])
+
+  items = site.get_items(client, 'Seed Key Results', **{
+    '$select': 'Title,parentObjective/Title,tags/Id', '$expand': 'parentObjective,tags', '$top': '3'})
+  assert [item['Title'] for item in items] == ['Seed Key Results 1', 'Seed Key Results 2', 'Seed Key Results 3']
+  assert [[tag['Id'] for tag in item['tags']] for item in items] == tags[:3]
+
+
+def test_seed_is_reproducible():
+  data = []
+  for site in [seed_site('--rows', '30', '--seed', '7'), seed_site('--rows', '30', '--seed', '7')]:
+    with site.connect() as conn:
+      data.append(conn.execute('SELECT * FROM seed_key_results ORDER BY Id').fetchall())
+  assert data[0] == data[1]
+
+
+def test_multi_lookup_values_are_unique_per_row():
+  values = generate_multi_lookup(np.random.default_rng(0), 1000, 3, 0, 5)
+  assert any([value is None for value in values])
+  ids = [[int(i) for i in value.split(',')] for value in values if value is not None]
+  assert all([i == sorted(set(i)) and set(i) <= {1, 2, 3} for i in ids])
+  assert max([len(i) for i in ids]) == 3
+
+
+def test_seed_spec_checks():
+  with pytest.raises(click.ClickException):
+    sort_seed_lists([{'name': 'A', 'lookups': [{'name': 'b', 'list': 'B'}]},
+                     {'name': 'B', 'lookups': [{'name': 'a', 'list': 'A'}]}])
+  result = app.test_cli_runner().invoke(args=['ravenpoint', 'seed', '--site', '../default'])
+  assert result.exit_code == 2
@@ -0,0 +1,28 @@
+from project.utils import build_list_query, compile_list_query, get_all_fields, get_all_relationships, \
+  parse_odata_query
+
+
+def test_select_returns_id(client, site):
+  site = site()
+  items = site.get_items(client, 'Tasks', **{'$select': 'Title'})
+  assert len(items) == 10
+  assert all([sorted(item.keys()) == ['Id', 'Title'] for item in items])
+
+
+def test_changes_select_returns_id(client, site):
+  site = site()
+  response = client.get(site.list_url('Tasks', 'GetListItemChangesSinceToken'), query_string={'$select': 'Title'})
+  assert response.status_code == 200, response.get_json()
+  assert sorted([item['Id'] for item in response.get_json()['value']]) == list(range(1, 11))
+
+
+def test_lookup_only_select_projects_lookup_columns(client, site):
+  site = site()
+  items = site.get_items(client, 'Tasks', **{'$select': 'project/Title', '$expand': 'project'})
+  assert all([sorted(item.keys()) == ['Id', 'project'] and list(item['project']) == ['Title'] for item in items])
+  with site.connect() as conn:
+    params = parse_odata_query({'$select': 'project/Title,tags/Title', '$expand': 'project,tags'})
+    query = build_list_query(params, get_all_relationships(conn), 'tasks', all_fields=get_all_fields(conn))
+    columns = [col[0] for col in conn.execute(f'{compile_list_query(query)} LIMIT 0').description]
+  # The Id, the joined lookup column and the key of the tags lookup, fetched separately
+  assert columns[:2] == ['Id', 'project__Title'] and len(columns) == 3
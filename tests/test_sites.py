@@ -0,0 +1,49 @@
+import os
+import sqlite3
+
+import pytest
+
+from project import app, database
+from project.database import get_connection, split_site_path, use_site
+
+
+def test_split_site_path():
+  assert split_site_path('/ravenpoint/sites/hr-2/_api/web') == ('hr-2', '/ravenpoint/_api/web')
+  assert split_site_path('/ravenpoint/_api/web') == (None, '/ravenpoint/_api/web')
+  assert split_site_path('/ravenpoint/sites/a.b/_api/web') == (None, '/ravenpoint/sites/a.b/_api/web')
+
+
+def test_sites_keep_their_own_lists(client, site):
+  tasks_site = site()
+  notes_site = site({'lists': [{'name': 'Notes', 'rows': 3, 'columns': [{'name': 'Title', 'type': 'title'}]}]})
+  other_tasks_site = site(rows=4)
+
+  item = tasks_site.add_item(client, 'Tasks', Title='Only here')
+  assert len(tasks_site.get_items(client, 'Tasks')) == 11
+  assert len(other_tasks_site.get_items(client, 'Tasks')) == 4
+  assert [note['Title'] for note in notes_site.get_items(client, 'Notes')] == ['Notes 1', 'Notes 2', 'Notes 3']
+  assert item['Id'] not in [task['Id'] for task in other_tasks_site.get_items(client, 'Tasks')]
+  response = client.get(tasks_site.list_url('Notes'))
+  assert response.status_code == 400
+  # The default site has none of these lists
+  response = client.get("/ravenpoint/_api/web/lists/GetByTitle('Notes')/items")
+  assert response.status_code == 400
+
+
+def test_file_sites_beyond_limit_are_closed(file_databases, monkeypatch):
+  monkeypatch.setitem(app.config, 'SITES_MAX_OPEN', 2)
+  keepers = {}
+  for name in ['a', 'b', 'c']:
+    with use_site(name), get_connection() as conn:
+      conn.execute('CREATE TABLE notes (Id INTEGER PRIMARY KEY, Title TEXT)')
+      conn.execute('INSERT INTO notes (Title) VALUES (?)', (f'Note in {name}',))
+    keepers[name] = database._sites[name]
+  assert list(database._sites) == ['b', 'c']
+  assert os.path.exists(file_databases / 'a.sqlite')
+  with pytest.raises(sqlite3.ProgrammingError):
+    keepers['a'].execute('SELECT 1')
+
+  # A closed site is opened again with its data
+  with use_site('a'), get_connection() as conn:
+    assert conn.execute('SELECT Title FROM notes').fetchall() == [('Note in a',)]
+  assert list(database._sites) == ['c', 'a']
@@ -0,0 +1,69 @@
+import hashlib
+import tarfile
+
+from conftest import digest
+from project import app
+
+
+# Function to run a snapshot command
+def run_snapshot(*args):
+  return app.test_cli_runner().invoke(args=['ravenpoint', 'snapshot', *args])
+
+
+# Function to upload a file to the Shared Documents of a site
+def upload_file(client, site, name, data):
+  response = client.post(f"{site.api}/web/GetFolderByServerRelativeUrl('Shared Documents')/Files/add(url='{name}',overwrite=true)",
+                         data=data, headers=digest)
+  assert response.status_code == 200, response.get_json()
+
+
+# Function to download a file from the Shared Documents of a site
+def download_file(client, site, name):
+  return client.get(f"{site.api}/web/GetFolderByServerRelativeUrl('Shared Documents')/Files('{name}')/$value", headers=digest)
+
+
+def test_restore_resets_site_to_snapshot(client, site, documents_folder):
+  site = site()
+  upload_file(client, site, 'kept.txt', b'kept')
+  archive = str(documents_folder / 'fixtures.tar.gz')
+  result = run_snapshot('save', archive, '--site', site.name)
+  assert result.exit_code == 0, result.output
+  token = client.get(site.list_url('Tasks', 'GetListItemChangesSinceToken')).get_json()['changeToken']
+
+  site.add_item(client, 'Tasks', Title='After the snapshot')
+  site.delete_item(client, 'Tasks', 1)
+  upload_file(client, site, 'kept.txt', b'changed')
+  upload_file(client, site, 'added.txt', b'added')
+  result = run_snapshot('restore', archive, '--site', site.name)
+  assert result.exit_code == 0, result.output
+
+  assert [item['Id'] for item in site.get_items(client, 'Tasks', **{'$select': 'Title'})] == list(range(1, 11))
+  assert download_file(client, site, 'kept.txt').data == b'kept'
+  assert download_file(client, site, 'added.txt').status_code == 400
+  # Blobs of documents that are gone are removed
+  assert len(list((documents_folder / '.sites' / site.name / '.store').glob('*/*'))) == 1
+  # Clients holding a token from before the restore sync in full
+  changes = client.get(site.list_url('Tasks', 'GetListItemChangesSinceToken'), query_string={'changeToken': token}).get_json()
+  assert changes['fullSync'] is True
+  assert int(changes['changeToken']) > int(token)
+
+
+def test_snapshot_copies_site(client, site, documents_folder):
+  source, target = site(rows=5), site({'lists': []})
+  upload_file(client, source, 'shared.txt', b'shared')
+  archive = str(documents_folder / 'fixtures.tar')
+  assert run_snapshot('save', archive, '--site', source.name, '--compress-level', '0').exit_code == 0
+  with tarfile.open(archive, 'r:') as f:
+    assert sorted(f.getnames()) == ['data.sqlite', f"documents/{hashlib.sha256(b'shared').hexdigest()}", 'snapshot.json']
+  assert run_snapshot('restore', archive, '--site', target.name).exit_code == 0
+  assert target.get_items(client, 'Tasks', **{'$select': 'Title'}) == source.get_items(client, 'Tasks', **{'$select': 'Title'})
+  assert download_file(client, target, 'shared.txt').data == b'shared'
+
+
+def test_restore_rejects_other_archives(site, tmp_path):
+  site = site()
+  path = tmp_path / 'other.tar.gz'
+  with tarfile.open(path, 'w:gz') as f:
+    f.add(__file__, arcname='notes.txt')
+  result = run_snapshot('restore', str(path), '--site', site.name)
+  assert result.exit_code == 1 and 'is not a RavenPoint snapshot' in result.output
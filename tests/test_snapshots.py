@@ -0,0 +1,27 @@
+import pandas as pd
+import pytest
+
+from project.utils import get_table_fields, read_snapshot, replace_table
+
+
+def test_snapshot_reads_survive_table_replacement(client, site, file_databases):
+  site = site()
+  with site.connect() as conn:
+    with read_snapshot() as snapshot:
+      assert snapshot.execute('SELECT COUNT(*) FROM tasks').fetchone()[0] == 10
+      # The admin panel replaces the table while the snapshot is open
+      replace_table(conn, pd.read_sql('SELECT * FROM tasks WHERE Id <= 4', con=conn), 'tasks',
+                    get_table_fields(conn, 'tasks'))
+      assert snapshot.execute('SELECT COUNT(*) FROM tasks').fetchone()[0] == 10
+      assert snapshot.execute('SELECT COUNT(*) FROM tasks_tags WHERE tasks_pk > 4').fetchone()[0] > 0
+  assert [item['Id'] for item in site.get_items(client, 'Tasks', **{'$select': 'Title'})] == [1, 2, 3, 4]
+
+
+def test_failed_replacement_keeps_table(client, site):
+  site = site()
+  with site.connect() as conn:
+    fields = get_table_fields(conn, 'tasks')
+    data = pd.read_sql('SELECT * FROM tasks', con=conn).assign(Unknown=1)
+    with pytest.raises(Exception):
+      replace_table(conn, data, 'tasks', fields)
+  assert len(site.get_items(client, 'Tasks', **{'$select': 'Title'})) == 10
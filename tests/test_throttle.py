@@ -0,0 +1,31 @@
+from project import app, throttle
+from project.throttle import client_header, take_token
+
+
+def test_throttle_rejects_with_retry_after(client, site, monkeypatch):
+  monkeypatch.setitem(app.config, 'THROTTLE_RATE', 0.5)
+  monkeypatch.setitem(app.config, 'THROTTLE_BURST', 2)
+  site = site()
+  headers = {client_header: f'client-{site.name}'}
+  responses = [client.get(site.list_url('Tasks'), headers=headers) for _ in range(3)]
+  assert [response.status_code for response in responses] == [200, 200, 429]
+  assert responses[-1].headers['Retry-After'] == '2'
+  # Other clients have their own buckets, and requests are never delayed instead
+  assert client.get(site.list_url('Tasks'), headers={client_header: f'other-{site.name}'}).status_code == 200
+  assert 'THROTTLE_LATENCY' not in app.config
+
+
+def test_buckets_refill_at_the_rate(monkeypatch):
+  monkeypatch.setitem(app.config, 'THROTTLE_RATE', 2)
+  monkeypatch.setitem(app.config, 'THROTTLE_BURST', 1)
+  now = [100.0]
+  monkeypatch.setattr(throttle.time, 'monotonic', lambda: now[0])
+  key = ('refill', None, None)
+  assert take_token(key) == 0
+  assert take_token(key) == 0.5
+  now[0] += 0.5
+  assert take_token(key) == 0
+  # A bucket never holds more than the burst
+  now[0] += 60
+  assert take_token(key) == 0
+  assert take_token(key) > 0
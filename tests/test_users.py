@@ -0,0 +1,39 @@
+from conftest import digest
+from project.utils import users_email_domain
+
+
+# Function to resolve a logon name to a user of a site
+def ensure_user(client, site, logon_name):
+  response = client.post(f'{site.api}/web/ensureuser', json={'logonName': logon_name}, headers=digest)
+  assert response.status_code == 200, response.get_json()
+  return response.get_json()
+
+
+def test_ensure_user_creates_each_user_once(client, site):
+  site = site({'lists': []})
+  assert client.get(f'{site.api}/web/currentUser').status_code == 400
+
+  ada = ensure_user(client, site, 'i:0#.f|membership|ada@example.com')
+  assert (ada['Title'], ada['Email']) == ('ada', 'ada@example.com')
+  assert ensure_user(client, site, 'ADA@example.com')['Id'] == ada['Id']
+  grace = ensure_user(client, site, 'grace')
+  assert (grace['Email'], grace['Id'] != ada['Id']) == (f'grace{users_email_domain}', True)
+  assert ensure_user(client, site, 'grace') == grace
+  response = client.post(f"{site.api}/web/ensureuser('bad name')", headers=digest)
+  assert response.status_code == 400
+
+  assert client.get(f'{site.api}/web/currentUser').get_json() == ada
+  assert client.get(f"{site.api}/web/getuserbyid('{grace['Id']}')").get_json() == grace
+  assert client.get(f"{site.api}/web/siteusers/getbyemail('Ada@Example.com')").get_json() == ada
+  assert client.get(f"{site.api}/web/getuserbyid('99')").status_code == 400
+
+
+def test_site_users_query(client, site):
+  site = site({'lists': []})
+  for name in ['carol', 'alice', 'bob', 'dave']:
+    ensure_user(client, site, f'{name}@example.com')
+  response = client.get(f'{site.api}/web/SiteUsers', query_string={
+    '$select': 'Title', '$filter': "Title ne 'dave'", '$orderby': 'Title desc', '$top': '2'})
+  assert [user['Title'] for user in response.get_json()['value']] == ['carol', 'bob']
+  assert len(client.get(f'{site.api}/web/siteusers').get_json()['value']) == 4
+  assert client.get(f'{site.api}/web/SiteUsers', query_string={'$skip': '1'}).status_code == 400